@@ -1,508 +1,447 @@
 import os
 import discord
+from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 import random
-import json
 import asyncio
-from datetime import datetime, timedelta
-from collections import defaultdict
+import csv
+from datetime import timezone
 import signal
 import logging
+import io
+import contextlib
+import secrets
+import tempfile
+import time
+import metrics
+from backups import BackupStore
+from catalog import CatalogError, DEFAULT_CATALOG_FILE, get_catalog, load_catalog, set_catalog
+from engine import GameError, StaleTeamError
+from export import FORMATS as EXPORT_FORMATS, KINDS as EXPORT_KINDS, export_async
+from games import CHANNEL_ROLES, DEFAULT_GAME, GameManager
+from member_index import MemberIndex
+from outbox import Outbox
+from profiling import CommandProfiler
+from scheduler import DeadlineScheduler
+from storage import has_saved_game, open_storage
+from tasks import task_details
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Get the token and channel IDs from the environment variables
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
-GAME_CHAT_ID = int(os.getenv('GAME_CHAT_ID'))
-GAME_CHANNEL_ID = int(os.getenv('GAME_CHANNEL_ID'))
-ANNOUNCEMENTS_ID = int(os.getenv('ANNOUNCEMENTS_ID'))
+GAME_CHAT_ID = int(os.getenv('GAME_CHAT_ID', 0))
+GAME_CHANNEL_ID = int(os.getenv('GAME_CHANNEL_ID', 0))
+ANNOUNCEMENTS_ID = int(os.getenv('ANNOUNCEMENTS_ID', 0))
+
+# The guild whose default game keeps SAVE_FILE, JOURNAL_FILE, SEASON and the channel IDs above,
+# so a bot that ran a single event carries on with it
+GUILD_ID = int(os.getenv('GUILD_ID', 0)) or None
+
+# Shard across gateway connections (for bots in many guilds)
+AUTO_SHARD = os.getenv('AUTO_SHARD', '').lower() in ('1', 'true', 'yes')
+
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics; 0 turns them off
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
 
 # Initialize the bot with the required intents and make commands case-insensitive
 intents = discord.Intents.default()
 intents.message_content = True  # Enable the Message Content Intent
-bot = commands.Bot(command_prefix=commands.when_mentioned_or('!'), intents=intents, case_insensitive=True)
-
-# In-memory game state
-game_state = {}
-
-# Path to save the game state
-SAVE_FILE = "game_state.json"
-
-# Load game state when the bot starts
-def load_game_state():
-    global game_started
-    if os.path.exists(SAVE_FILE):
-        with open(SAVE_FILE, 'r') as file:
-            data = json.load(file)
-            game_started = data.get("game_started", False)
-            return data.get("game_state", {})
-    return {}
-
-
-def save_game_state():
-    global game_state, game_started
-    with open(SAVE_FILE, 'w') as file:
-        json.dump({
-            "game_state": game_state,
-            "game_started": game_started
-        }, file, indent=4)
-
-game_state = load_game_state()
-
-# Shop items
-shop_items = {
-    1: {"name": "RickRolling Stew", "description": "Smells like a new task!", "cost": 10, "weight": 10},
-    2: {"name": "DoubleDipping Brew", "description": "Earn double points on a task if completed within 4 hours.", "cost": 15, "weight": 30},
-    3: {"name": "Monkey's Paw", "description": "Re-roll a specific task with a higher chance of a harder task.", "cost": 5, "weight": 70},
-    4: {"name": "GP", "description": "Award 1 million GP to each team member.", "cost": 20, "weight": 50},
-    5: {"name": "Null", "description": "How'd you get this?", "cost": 50, "weight": 10},
-}
+intents.members = True  # Member join/update/remove events keep member_index current (Server Members Intent)
+bot_class = commands.AutoShardedBot if AUTO_SHARD else commands.Bot
+bot = bot_class(command_prefix=commands.when_mentioned_or('!'), intents=intents, case_insensitive=True,
+                http_trace=metrics.discord_trace())
+
+# Seed that every team's wave stream is derived from; picked at !start unless GAME_SEED is set
+GAME_SEED = os.getenv('GAME_SEED')
+
+# Path to save the game state; games other than GUILD_ID's default one are saved under GAMES_DIR
+SAVE_FILE = "game_state.snap"
+# Where games were saved before snapshots had their own format; read until the first new save
+LEGACY_SAVE_FILE = "game_state.json"
+# Snapshot compression: "zlib", "gzip" or "none"
+SNAPSHOT_COMPRESSION = os.getenv('SNAPSHOT_COMPRESSION', 'zlib')
+GAMES_DIR = os.getenv('GAMES_DIR', 'games')
+
+# Which channels play which game, per guild
+GAMES_FILE = os.getenv('GAMES_FILE', 'games.json')
+
+# Games nobody has used for this long are written out and dropped from memory
+GAME_IDLE_SECONDS = float(os.getenv('GAME_IDLE_SECONDS', 1800))
+
+# Append-only log of game events since the last snapshot
+JOURNAL_FILE = "game_state.journal"
+
+# Storage backend: "json" (snapshot file + journal) or "sqlite" (normalized tables in SQLITE_FILE)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'game_state.db')
+# Lets several events share one SQLite database
+SEASON = os.getenv('SEASON', 'default')
+
+# Saves are coalesced and written off the event loop, at most once per SAVE_DELAY seconds
+SAVE_DELAY = float(os.getenv('SAVE_DELAY', 2.0))
+
+# Compact the journal into a fresh snapshot after this many events
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', 1000))
+
+# Restore points for !restore, per game under BACKUPS_DIR: one every BACKUP_INTERVAL seconds if
+# the game changed, and one before every !set_teams, !start, !reset_tasks and !restore
+BACKUPS_DIR = os.getenv('BACKUPS_DIR', 'backups')
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', 300))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 48))
+
+# Pending timed effects (DoubleDipping Brew windows, prompt expiries, wave time limits), kept across restarts
+DEADLINES_FILE = os.getenv('DEADLINES_FILE', 'deadlines.json')
+# How long !progress prompts and shop offers keep their buttons, and how long a team has for a
+# wave before time is called; 0 means no limit
+PROMPT_EXPIRY_SECONDS = float(os.getenv('PROMPT_EXPIRY_SECONDS', 0))
+SHOP_OFFER_SECONDS = float(os.getenv('SHOP_OFFER_SECONDS', 0))
+WAVE_TIME_LIMIT_SECONDS = float(os.getenv('WAVE_TIME_LIMIT_SECONDS', 0))
+
+# Task families, boss tasks and shop items; !reload_catalog re-reads it
+CATALOG_FILE = os.getenv('CATALOG_FILE', DEFAULT_CATALOG_FILE)
+
+
+def open_game_storage(key, snapshot):
+    guild_id, game_id = key
+    if key == (GUILD_ID, DEFAULT_GAME):
+        directory, season = "", SEASON
+    else:
+        directory = os.path.join(GAMES_DIR, str(guild_id), game_id)
+        if STORAGE_BACKEND == "json":
+            os.makedirs(directory, exist_ok=True)
+        season = f"{guild_id}:{game_id}"
+    save_file, journal_file = os.path.join(directory, SAVE_FILE), os.path.join(directory, JOURNAL_FILE)
+    return open_storage(STORAGE_BACKEND, snapshot, save_file, journal_file, SQLITE_FILE, season,
+                        delay=SAVE_DELAY, compact_every=JOURNAL_COMPACT_EVERY, compression=SNAPSHOT_COMPRESSION,
+                        legacy_file=os.path.join(directory, LEGACY_SAVE_FILE))
+
+
+def open_game_backups(key):
+    guild_id, game_id = key
+    return BackupStore(os.path.join(BACKUPS_DIR, str(guild_id), game_id), keep=BACKUP_KEEP)
+
+
+# Every game, keyed by guild and game ID: teams, waves and rules, with their storage and rendered
+# views. Commands below only talk to Discord and the game of the channel they are used in.
+games = GameManager(open_game_storage, GAMES_FILE, storage_reads=STORAGE_BACKEND == "sqlite",
+                    idle_seconds=GAME_IDLE_SECONDS, open_backups=open_game_backups)
+
+if GUILD_ID:
+    for role, channel_id in zip(CHANNEL_ROLES, (GAME_CHAT_ID, GAME_CHANNEL_ID, ANNOUNCEMENTS_ID)):
+        if channel_id and role not in games.channels(GUILD_ID, DEFAULT_GAME):
+            games.bind(GUILD_ID, DEFAULT_GAME, channel_id, role)
+
+# Long replies are packed into as few 2000-character messages as possible and paced per channel
+outbox = Outbox(rate=int(os.getenv('SEND_RATE', 5)), per=float(os.getenv('SEND_RATE_PERIOD', 5.0)))
+
+
+# Every timed effect of every game, fired from one background task
+scheduler = DeadlineScheduler(DEADLINES_FILE, delay=SAVE_DELAY)
+
+# Admin-started cProfile sessions (!profile)
+profiler = CommandProfiler()
+
+# Guild members by ID and name, for resolving the member names commands are given
+member_index = MemberIndex()
+
+@bot.listen()
+async def on_member_join(member):
+    member_index.add(member.guild, member)
+
+@bot.listen()
+async def on_member_update(before, after):
+    member_index.add(after.guild, after)
+
+@bot.listen()
+async def on_member_remove(member):
+    member_index.remove(member.guild, member)
+
+@bot.listen()
+async def on_user_update(before, after):
+    member_index.update_user(after)
+
+async def resolve_member(ctx, query):
+    """The one guild member a typed mention, ID or name means; otherwise says why not and returns None."""
+    found = member_index.resolve(ctx.guild, query)
+    if not found:
+        await ctx.send(f"Could not find a member with the name or mention {query}. Please ensure the name or mention is correct.")
+        return None
+    if len(found) > 1:
+        await ctx.send(f"{query} could be any of {', '.join(sorted(str(member) for member in found))}. Please use a mention instead.")
+        return None
+    return found[0]
+
+metrics.instrument(bot)
+metrics.REGISTRY.register(metrics.Gauge(
+    "roguelike_wait_for_listeners", "wait_for calls still waiting for their event.",
+    function=lambda: sum(len(listeners) for listeners in bot._listeners.values())))
+metrics.REGISTRY.register(metrics.Gauge("roguelike_games_loaded", "Games in memory.", function=lambda: len(games)))
+metrics.REGISTRY.register(metrics.Gauge(
+    "roguelike_deadlines_pending", "Timed effects waiting for their deadline.", function=lambda: len(scheduler)))
+
+
+async def setup_hook():
+    # The catalog and every game with channels are loaded once, before the first command arrives
+    set_catalog(load_catalog(CATALOG_FILE))
+    await games.load_configured()
+    scheduler.load()
+    bot.loop.create_task(scheduler.run())
+    # Idle games are written out and dropped from memory in the background
+    bot.loop.create_task(games.evict_forever())
+    bot.loop.create_task(games.backup_forever(BACKUP_INTERVAL))
+    if METRICS_PORT:
+        bot.loop.create_task(metrics.watch_event_loop())
+        await metrics.serve(METRICS_HOST, METRICS_PORT)
+
+bot.setup_hook = setup_hook
+
+
+@bot.check
+async def guild_only(ctx):
+    # Games belong to guilds, so commands can't be used in DMs
+    if ctx.guild is None:
+        raise commands.NoPrivateMessage()
+    return True
+
+
+@bot.before_invoke
+async def attach_game(ctx):
+    metrics.command_started(ctx)
+    profiler.command_started(ctx)
+    # Every command plays the game of the channel it was used in, loading it on first use
+    ctx.game = await games.get(ctx.guild.id, ctx.channel.id)
+
+
+@bot.after_invoke
+async def after_command(ctx):
+    metrics.command_finished(ctx)
+    session = profiler.command_finished(ctx)
+    if session:
+        await send_profile(session)
+
+@bot.listen()
+async def on_command_error(ctx, error):
+    # after_invoke is skipped when attach_game or a slash invocation fails, so a profiled
+    # invocation is finished here too; command_finished ignores one that already finished
+    session = profiler.command_finished(ctx)
+    if session:
+        await send_profile(session)
+
+
+async def send_profile(session):
+    # Sorting the stats of a long session is slow enough to keep off the event loop
+    report = await asyncio.to_thread(session.report)
+    name = session.command or "window"
+    await session.destination.send(f"Profiling of {'!' + session.command if session.command else 'the time window'} "
+                                   f"is done; the hottest functions are attached.",
+                                   file=discord.File(io.BytesIO(report.encode('utf-8')), filename=f"profile-{name}.txt"))
+
+# Discord shows at most 25 autocomplete suggestions
+AUTOCOMPLETE_LIMIT = 25
+
+NUMBER_EMOJIS = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+
+
+def is_captain_or_admin(member):
+    is_team_captain = any(role.name == "Team Captain" for role in member.roles)
+    return is_team_captain or member.guild_permissions.administrator
+
+
+def wave_tasks_message(header, tasks):
+    message = header
+    for i, task in enumerate(tasks, 1):
+        message += f"{NUMBER_EMOJIS[i - 1]} {task.description} (Points: {task.points})\n"
+    return message
+
 
 def get_random_shop_items(n=2):
-    items = list(shop_items.keys())
-    weights = [shop_items[item]['weight'] for item in items]
-    selected_items = random.choices(items, weights=weights, k=n)
-    return {item_id: shop_items[item_id] for item_id in selected_items}
-
-# Task definitions
-easy_task_set = [
-    {
-        "id": 1,
-        "tasks": [
-            {"description": "Obtain any barrows item", "points": 1},
-            {"description": "Obtain any 4 barrows items", "points": 2},
-            {"description": "Obtain any barrows set from scratch", "points": 3}
-        ]
-    },
-    {
-        "id": 2,
-        "tasks": [
-            {"description": "Obtain any perlis moons item", "points": 1},
-            {"description": "Obtain any 4 perlis moons items", "points": 2},
-            {"description": "Obtain any perlis moons set from scratch", "points": 3}
-        ]
-    },
-    {
-        "id": 3,
-        "tasks": [
-            {"description": "Obtain a drop unique to wintertodt", "points": 1},
-            {"description": "Obtain 3 drops unique to wintertodt", "points": 2},
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 3}
-        ]
-    },
-    {
-        "id": 4,
-        "tasks": [
-            {"description": "Obtain a drop unique to tempeross", "points": 1},
-            {"description": "Obtain 3 drops unique to tempeross", "points": 2},
-            {"description": "Obtain 5 drops unique to tempeross", "points": 3}
-        ]
-    },
-    {
-        "id": 5,
-        "tasks": [
-            {"description": "Obtain a drop unique to Guardians of the Rift", "points": 1},
-            {"description": "Obtain 3 drops unique to Guardians of the Rift", "points": 2},
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 3}
-        ]
-    },
-    {
-        "id": 6,
-        "tasks": [
-            {"description": "Obtain 5 beginner clue uniques", "points": 1},
-            {"description": "Obtain 10 beginner clue uniques", "points": 2},
-            {"description": "Obtain 15 beginner clue uniques", "points": 3}
-        ]
-    },
-    {
-        "id": 7,
-        "tasks": [
-            {"description": "Obtain 5 easy clue uniques", "points": 1},
-            {"description": "Obtain 10 easy clue uniques", "points": 2},
-            {"description": "Obtain 15 easy clue uniques", "points": 3}
-        ]
-    },
-    {
-        "id": 8,
-        "tasks": [
-            {"description": "Obtain 5 medium clue uniques", "points": 1},
-            {"description": "Obtain 10 medium clue uniques", "points": 2},
-            {"description": "Obtain 15 medium clue uniques", "points": 3}
-        ]
-    },
-    {
-        "id": 9,
-        "tasks": [
-            {"description": "Obtain 3 hard clue uniques", "points": 1},
-            {"description": "Obtain 5 hard clue uniques", "points": 2},
-            {"description": "Obtain 10 hard clue uniques", "points": 3}
-        ]
-    },
-    {
-        "id": 10,
-        "tasks": [
-            {"description": "Obtain a granite maul", "points": 1},
-            {"description": "Obtain an abyssal whip", "points": 2},
-            {"description": "Obtain a drop unique to a slayer boss", "points": 3}
-        ]
-    },
-]
-
-medium_task_set = [
-    {
-        "id": 1,
-        "tasks": [
-            {"description": "Defeat Obor 5 times", "points": 4},
-            {"description": "Defeat Obor 10 times", "points": 5},
-            {"description": "Defeat Obor 15 times", "points": 6}
-        ]
-    },
-    {
-        "id": 2,
-        "tasks": [
-            {"description": "Defeat Bryophyta 5 times", "points": 4},
-            {"description": "Defeat Bryophyta 10 times", "points": 5},
-            {"description": "Defeat Bryophyta 15 times", "points": 6}
-        ]
-    },
-    {
-        "id": 3,
-        "tasks": [
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 4},
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 5},
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 6}
-        ]
-    },
-    {
-        "id": 4,
-        "tasks": [
-            {"description": "Obtain 5 drops unique to tempeross", "points": 4},
-            {"description": "Obtain 5 drops unique to tempeross", "points": 5},
-            {"description": "Obtain 5 drops unique to tempeross", "points": 6}
-        ]
-    },
-    {
-        "id": 5,
-        "tasks": [
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 4},
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 5},
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 6}
-        ]
-    },
-    {
-        "id": 6,
-        "tasks": [
-            {"description": "Obtain 15 beginner clue uniques", "points": 4},
-            {"description": "Obtain 15 beginner clue uniques", "points": 5},
-            {"description": "Obtain 15 beginner clue uniques", "points": 6}
-        ]
-    },
-    {
-        "id": 7,
-        "tasks": [
-            {"description": "Obtain 15 easy clue uniques", "points": 4},
-            {"description": "Obtain 15 easy clue uniques", "points": 5},
-            {"description": "Obtain 15 easy clue uniques", "points": 6}
-        ]
-    },
-    {
-        "id": 8,
-        "tasks": [
-            {"description": "Obtain 15 medium clue uniques", "points": 4},
-            {"description": "Obtain 15 medium clue uniques", "points": 5},
-            {"description": "Obtain 15 medium clue uniques", "points": 6}
-        ]
-    },
-    {
-        "id": 9,
-        "tasks": [
-            {"description": "Obtain 10 hard clue uniques", "points": 4},
-            {"description": "Obtain 10 hard clue uniques", "points": 5},
-            {"description": "Obtain 10 hard clue uniques", "points": 6}
-        ]
-    },
-    {
-        "id": 10,
-        "tasks": [
-            {"description": "Obtain a drop unique to a slayer boss", "points": 4},
-            {"description": "Obtain a drop unique to a slayer boss", "points": 5},
-            {"description": "Obtain a drop unique to a slayer boss", "points": 6}
-        ]
-    },
-]
-
-hard_task_set = [
-    {
-        "id": 1,
-        "tasks": [
-            {"description": "Defeat Obor 25 times", "points": 7},
-            {"description": "Defeat Obor 30 times", "points": 8},
-            {"description": "Defeat Obor 35 times", "points": 9}
-        ]
-    },
-    {
-        "id": 2,
-        "tasks": [
-            {"description": "Defeat Bryophyta 25 times", "points": 7},
-            {"description": "Defeat Bryophyta 30 times", "points": 8},
-            {"description": "Defeat Bryophyta 35 times", "points": 9}
-        ]
-    },
-    {
-        "id": 3,
-        "tasks": [
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 7},
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 8},
-            {"description": "Obtain 5 drops unique to wintertodt", "points": 9}
-        ]
-    },
-    {
-        "id": 4,
-        "tasks": [
-            {"description": "Obtain 5 drops unique to tempeross", "points": 7},
-            {"description": "Obtain 5 drops unique to tempeross", "points": 8},
-            {"description": "Obtain 5 drops unique to tempeross", "points": 9}
-        ]
-    },
-    {
-        "id": 5,
-        "tasks": [
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 7},
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 8},
-            {"description": "Obtain 5 drops unique to Guardians of the Rift", "points": 9}
-        ]
-    },
-    {
-        "id": 6,
-        "tasks": [
-            {"description": "Obtain 15 beginner clue uniques", "points": 7},
-            {"description": "Obtain 15 beginner clue uniques", "points": 8},
-            {"description": "Obtain 15 beginner clue uniques", "points": 9}
-        ]
-    },
-    {
-        "id": 7,
-        "tasks": [
-            {"description": "Obtain 15 easy clue uniques", "points": 7},
-            {"description": "Obtain 15 easy clue uniques", "points": 8},
-            {"description": "Obtain 15 easy clue uniques", "points": 9}
-        ]
-    },
-    {
-        "id": 8,
-        "tasks": [
-            {"description": "Obtain 15 medium clue uniques", "points": 7},
-            {"description": "Obtain 15 medium clue uniques", "points": 8},
-            {"description": "Obtain 15 medium clue uniques", "points": 9}
-        ]
-    },
-    {
-        "id": 9,
-        "tasks": [
-            {"description": "Obtain 10 hard clue uniques", "points": 7},
-            {"description": "Obtain 10 hard clue uniques", "points": 8},
-            {"description": "Obtain 10 hard clue uniques", "points": 9}
-        ]
-    },
-    {
-        "id": 10,
-        "tasks": [
-            {"description": "Obtain a drop unique to a slayer boss", "points": 7},
-            {"description": "Obtain a drop unique to a slayer boss", "points": 8},
-            {"description": "Obtain a drop unique to a slayer boss", "points": 9}
-        ]
-    },
-]
-
-boss_task_set = {
-    1: ("Obtain a Purple from COX", 15),
-    2: ("Obtain a Purple from TOA", 10),
-    3: ("Obtain a Purple from TOB", 25),
-    # Add more boss tasks here if needed
-}
-
-task_sets = {
-    "easy": easy_task_set,  # Your easy tasks
-    "medium": medium_task_set,  # Structure medium tasks similarly
-    "hard": hard_task_set,  # Structure hard tasks similarly
-}
-
-
-def get_task_weights(wave):
-    if wave < 10:
-        return {"easy": 90, "medium": 9, "hard": 1}
-    elif wave < 20:
-        return {"easy": 70, "medium": 25, "hard": 5}
-    elif wave < 30:
-        return {"easy": 50, "medium": 40, "hard": 10}
-    elif wave < 40:
-        return {"easy": 30, "medium": 50, "hard": 20}
-    elif wave < 50:
-        return {"easy": 10, "medium": 60, "hard": 30}
-    else:
-        return {"easy": 5, "medium": 35, "hard": 60}
+    # Shop items come from the catalog
+    catalog = get_catalog()
+    items = list(catalog.shop_ids)
+    weights = list(catalog.shop_weights)
+    # Draw without replacement so the shop always offers n different items
+    selected_items = []
+    while items and len(selected_items) < n:
+        index = random.choices(range(len(items)), weights=weights)[0]
+        selected_items.append(items.pop(index))
+        weights.pop(index)
+    return {item_id: catalog.shop_items[item_id] for item_id in selected_items}
+
+
+def deadline_key(kind, game, team_key, *rest):
+    return (kind, game.guild_id, game.game_id, team_key, *rest)
+
+
+def start_wave_clock(game, team):
+    """Call time on the team's current wave WAVE_TIME_LIMIT_SECONDS from now, if waves have a limit."""
+    if WAVE_TIME_LIMIT_SECONDS:
+        scheduler.schedule(deadline_key("wave_limit", game, team.key), time.time() + WAVE_TIME_LIMIT_SECONDS,
+                           wave=team.wave.number)
+
+
+def expire_prompt(game, team_key, wave, message, seconds, shop=False):
+    """Take the buttons off a !progress prompt or shop offer after `seconds`, if they are still there."""
+    if seconds and message is not None:
+        scheduler.schedule(deadline_key("prompt", game, team_key, wave), time.time() + seconds,
+                           channel_id=message.channel.id, message_id=message.id, shop=shop)
+
+
+async def announce(guild_id, game_id, text):
+    """Post to a game's announcements channel, or its chat channel if it has none."""
+    channels = games.channels(guild_id, game_id)
+    channel = bot.get_channel(channels.get("announcements") or channels.get("chat") or 0)
+    if channel is None:
+        logging.warning(f"No channel to announce to for game {game_id} of guild {guild_id}: {text}")
+        return
+    await outbox.send(channel, text)
+
+
+@scheduler.handler("double_points")
+async def double_points_expired(key, deadline):
+    _, guild_id, game_id, team_key = key
+    engine = (await games.get_game(guild_id, game_id)).engine
+    team = engine.teams.get(team_key)
+    if team is None:
+        return
+    async with engine.transaction(team):
+        task_index = team.double_points_task["task_index"] if team.double_points_task else None
+        expired = engine.expire_double_points(team, deadline)
+    if expired:
+        await announce(guild_id, game_id, f"⏰ {team.name}'s **DoubleDipping Brew** has worn off; "
+                                          f"task {task_index + 1} is worth its usual points again.")
+
+
+@scheduler.handler("prompt")
+async def prompt_expired(key, channel_id, message_id, shop=False):
+    _, guild_id, game_id, team_key, wave = key
+    team = (await games.get_game(guild_id, game_id)).engine.teams.get(team_key)
+    # Once the team has moved on, the prompt's buttons are already gone
+    channel = bot.get_channel(channel_id)
+    if team is None or team.wave.number != wave or channel is None:
+        return
+    closed = "The shop has closed" if shop else "This prompt has expired"
+    try:
+        await channel.get_partial_message(message_id).edit(
+            content=f"{closed}. Use `!progress {team.name}` to choose again.", view=None)
+    except discord.HTTPException as e:
+        logging.warning(f"Could not expire the prompt for {team_key}: {e}")
 
 
-def select_task_for_team(difficulty, team):
-    # Get the team's completed tasks for the difficulty
-    completed_tasks = team.get("completed_tasks", {}).get(difficulty, {})
+@scheduler.handler("wave_limit")
+async def wave_time_up(key, wave):
+    _, guild_id, game_id, team_key = key
+    team = (await games.get_game(guild_id, game_id)).engine.teams.get(team_key)
+    if team is None or team.wave.number != wave or team.wave.cleared:
+        return
+    await announce(guild_id, game_id, f"⏰ Time is up for **{team.name}** on Wave {wave}! "
+                                      f"They completed {team.wave.completed_count}/{team.wave.required} tasks.")
+
 
-    available_tasks = []
+# Slash command autocomplete runs on every keystroke and must answer within 3 seconds, so
+# suggestions come from the engine's prefix indexes rather than a walk over the game state.
 
-    # Iterate over the tasks in the task set
-    for task_info in task_sets[difficulty]:
-        task_id = task_info["id"]
-        task_levels = task_info["tasks"]
+def autocomplete_choice(name, value):
+    # Discord caps choice names at 100 characters
+    return app_commands.Choice(name=name[:100], value=value)
 
-        # Get the highest level completed for this task
-        completed_level = completed_tasks.get(task_id, -1)
 
-        # Ensure completed_level is an integer
-        if not isinstance(completed_level, int):
-            completed_level = -1
+def interaction_engine(interaction):
+    # Suggestions never wait for a game to load; the command itself will load it
+    game = games.loaded(interaction.guild_id, interaction.channel_id) if interaction.guild_id else None
+    return game.engine if game else None
 
-        # Only add the task if the next level is not completed
-        if completed_level + 1 < len(task_levels):
-            available_tasks.append((difficulty, task_levels[completed_level + 1]["description"],
-                                    task_levels[completed_level + 1]["points"], task_id, completed_level + 1))
 
-    # If there are available tasks, randomly select one
-    if available_tasks:
-        return random.choice(available_tasks)
+def interaction_team(interaction):
+    """The team already entered in a slash command's team_name option, if any."""
+    engine = interaction_engine(interaction)
+    team_name = getattr(interaction.namespace, "team_name", None)
+    return engine.lookup(team_name) if engine and team_name else None
 
-    # If no tasks are available (all levels completed), return None to trigger a re-roll
-    return None
 
-def generate_tasks(wave, team):
-    tasks = []
-    if wave % 10 == 0:
-        # Boss wave, only one task
-        task_id, task = random.choice(list(boss_task_set.items()))
-        tasks.append(("boss", task[0], task[1], task_id, 0))
+async def team_autocomplete(interaction, current):
+    engine = interaction_engine(interaction)
+    if not engine:
+        return []
+    return [autocomplete_choice(name, name) for name, _ in engine.registry.matches(current, AUTOCOMPLETE_LIMIT)]
+
+
+async def member_autocomplete(interaction, current):
+    # Members of the chosen team, or every player when the command has no team
+    team = interaction_team(interaction)
+    if team:
+        names = team.history.matches(current, AUTOCOMPLETE_LIMIT)
     else:
-        weights = get_task_weights(wave)
-        attempted_tasks = set()  # Keep track of tasks already assigned this wave
+        engine = interaction_engine(interaction)
+        names = engine.leaderboard.matches(current, AUTOCOMPLETE_LIMIT) if engine else []
+    return [autocomplete_choice(name, name) for name in names]
 
-        for _ in range(3):  # Assuming you want 3 tasks per wave
-            while True:
-                difficulty = random.choices(
-                    ["easy", "medium", "hard"],
-                    weights=[weights["easy"], weights["medium"], weights["hard"]]
-                )[0]
-                selected_task = select_task_for_team(difficulty, team)
 
-                # Re-roll until a valid and unique task is found
-                if selected_task and (selected_task[3], selected_task[4]) not in attempted_tasks:
-                    tasks.append(selected_task)
-                    attempted_tasks.add((selected_task[3], selected_task[4]))  # Mark this task as assigned
-                    break
+async def task_autocomplete(interaction, current):
+    team = interaction_team(interaction)
+    if not team:
+        return []
+    typed = str(current).casefold()
+    return [
+        autocomplete_choice(f"{i}. {task.description} (Points: {task.points})", i)
+        for i, task in enumerate(team.wave.tasks, 1)
+        if not task.completed and (str(i).startswith(typed) or task.description.casefold().startswith(typed))
+    ][:AUTOCOMPLETE_LIMIT]
 
-    return tasks
 
-@bot.command()
+async def item_autocomplete(interaction, current):
+    team = interaction_team(interaction)
+    if not team:
+        return []
+    typed = str(current).casefold()
+    return [
+        autocomplete_choice(f"{i}. {item}", i)
+        for i, item in enumerate(team.purchases, 1)
+        if str(i).startswith(typed) or item.casefold().startswith(typed)
+    ][:AUTOCOMPLETE_LIMIT]
+
+@bot.hybrid_command()
+@app_commands.rename(member_str="member")
+@app_commands.autocomplete(team_name=team_autocomplete, task_number=task_autocomplete, member_str=member_autocomplete)
 async def complete(ctx, team_name: str, task_number: int, member_str: str):
-    global game_state
+    engine = ctx.game.engine
     try:
         print(f"Running !complete command: team_name={team_name}, task_number={task_number}, member_str={member_str}")
 
-        team = next(
-            (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-            None
-        )
+        team = engine.lookup(team_name)
         if not team:
             await ctx.send(f"Team {team_name} does not exist.")
             return
 
-        print(f"Team data: {team}")
-
         member = ctx.author
-        is_team_captain = any(role.name == "Team Captain" for role in member.roles)
-        is_admin = member.guild_permissions.administrator
-
-        if not (is_team_captain or is_admin):
+        if not is_captain_or_admin(member):
             await ctx.send(f"{member.mention}, you are not authorized to complete tasks for {team_name}. Only team captains or server administrators can do so.")
             return
 
-        completed_tasks_count = sum(1 for t in team["tasks"] if "completed" in t)
-
-        if completed_tasks_count >= 2 and team["tasks"][task_number - 1][0] != "boss":
-            await ctx.send(f"{team_name} has already completed 2 tasks this wave. Progress: Complete {completed_tasks_count}/2 tasks to continue.")
-            return
-
-        if task_number < 1 or task_number > len(team["tasks"]):
-            await ctx.send(f"Invalid task number. Please choose a number between 1 and {len(team['tasks'])}.")
+        member = await resolve_member(ctx, member_str)
+        if member is None:
             return
 
         try:
-            task = team["tasks"][task_number - 1]
-        except IndexError as e:
-            logging.error(f"IndexError when accessing team tasks: {e}")
-            print(f"Current task list: {team['tasks']}")
-            await ctx.send(f"An error occurred while trying to access task number {task_number}.")
-            return
-
-        print(f"Task details: {task}")
-
-        if "completed" in task:
-            await ctx.send(f"Task '{task[1]}' has already been completed.")
+            async with engine.transaction(team):
+                result = engine.complete(team, task_number, member.display_name, by=str(ctx.author))
+        except GameError as e:
+            await ctx.send(str(e))
             return
 
-        points = task[2]
-        double_points_info = team.get("double_points_task")
-        if double_points_info:
-            task_index = double_points_info["task_index"]
-            deadline = datetime.fromisoformat(double_points_info["deadline"])
+        task = result.task
+        if result.doubled:
+            scheduler.cancel(deadline_key("double_points", ctx.game, team.key))
+            await ctx.send(f"**Double Points!** Task '{task.description}' completed within the time limit. Points doubled to {result.points}.")
 
-            if task_number - 1 == task_index and datetime.utcnow() <= deadline:
-                points *= 2
-                await ctx.send(f"**Double Points!** Task '{task[1]}' completed within the time limit. Points doubled to {points}.")
-                del team["double_points_task"]
+        await ctx.send(f"Task '{task.description}' completed by {task.completed_by} from {team_name}! {result.points} points awarded. Progress: Complete {result.completed_count}/{result.required} tasks to continue.")
 
-        try:
-            member = await commands.MemberConverter().convert(ctx, member_str)
-        except commands.BadArgument:
-            await ctx.send(f"Could not find a member with the name or mention {member_str}. Please ensure the name or mention is correct.")
-            return
-
-        member_display_name = member.display_name
-
-        task = list(task)
-        task.append("completed")
-        task.append(member_display_name)
-        team["tasks"][task_number - 1] = tuple(task)
-
-        print(f"Updated task: {task}")
-
-        team["points"] += points
-        team["members"].setdefault(member_display_name, 0)
-        team["members"][member_display_name] += points
-
-        difficulty = task[0]
-        task_id = task[3]
-        set_index = task[4]
-
-        if difficulty not in team["completed_tasks"]:
-            team["completed_tasks"][difficulty] = {}
-
-        if task_id not in team["completed_tasks"][difficulty]:
-            team["completed_tasks"][difficulty][task_id] = [None] * len(task_sets[difficulty])
-
-        team["completed_tasks"][difficulty][task_id][set_index] = member_display_name
-
-        save_game_state()
-
-        completed_tasks_count += 1
-
-        await ctx.send(f"Task '{task[1]}' completed by {member_display_name} from {team_name}! {points} points awarded. Progress: Complete {completed_tasks_count}/2 tasks to continue.")
-
-        if completed_tasks_count >= 2 or task[0] == "boss":
+        if result.wave_cleared:
             await ctx.send(f"{team_name} has completed the wave. Please use `!progress {team_name}` to continue to the next wave.")
 
-    except IndexError as e:
-        logging.error(f"Error in !complete command: {e}")
-        await ctx.send(f"An error occurred while processing the command: {str(e)}")
     except Exception as e:
         logging.error(f"Error in !complete command: {e}")
         await ctx.send(f"An error occurred while processing the command: {str(e)}")
@@ -526,202 +465,330 @@ async def complete_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
         await ctx.send("You do not have the required permissions to use this command.")
 
+def bulk_rows(text, name):
+    """(where, fields) for each non-empty line of CSV or space-separated "team task member" entries."""
+    rows = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        fields = next(csv.reader([line])) if "," in line else line.split(None, 2)
+        fields = [field.strip() for field in fields]
+        # A CSV header row
+        if number == 1 and fields and fields[0].lower() == "team":
+            continue
+        rows.append((f"{name} line {number}", fields))
+    return rows
+
+
 @bot.command()
-async def progress(ctx, team_name: str):
-    global game_state
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
-    if not team:
-        await ctx.send(f"Team {team_name} does not exist.")
+async def complete_bulk(ctx, *, entries: str = ""):
+    """
+    Complete many tasks at once: one "team, task number, member" entry per line after the
+    command, or in attached CSV files. Valid entries are applied together and written in one
+    go; the reply lists every rejected entry and why.
+    """
+    engine = ctx.game.engine
+    if not is_captain_or_admin(ctx.author):
+        await ctx.send(f"{ctx.author.mention}, only team captains or server administrators can complete tasks.")
         return
 
-    # Check if the user is a team captain or an administrator
-    member = ctx.author
-    is_team_captain = any(role.name == "Team Captain" for role in member.roles)
-    is_admin = member.guild_permissions.administrator
-
-    if not (is_team_captain or is_admin):
-        await ctx.send(f"{member.mention}, you are not authorized to progress {team_name}. Only team captains or server administrators can do so.")
+    rows = bulk_rows(entries, "message")
+    for attachment in ctx.message.attachments:
+        try:
+            text = (await attachment.read()).decode('utf-8-sig')
+        except (discord.HTTPException, UnicodeDecodeError) as e:
+            await ctx.send(f"Could not read {attachment.filename}: {e}")
+            return
+        rows += bulk_rows(text, attachment.filename)
+    if not rows:
+        await ctx.send("Nothing to complete. List `team, task number, member` entries one per line, or attach a CSV file.")
         return
 
-    # Check if the team has completed enough tasks to progress
-    completed_tasks = sum(1 for t in team["tasks"] if "completed" in t)
-    if completed_tasks < 2 and not any(t[0] == "boss" for t in team["tasks"]):
-        await ctx.send(f"{team_name} has not completed enough tasks to progress. Complete at least 2 tasks before using `!progress`.")
+    # Teams, task numbers and members are checked here; the game's rules by the engine
+    accepted, rejects = [], []
+    for row in rows:
+        where, fields = row
+        if len(fields) != 3:
+            rejects.append((row, "expected team, task number and member"))
+            continue
+        team_name, task_number, member_query = fields
+        team = engine.lookup(team_name)
+        if team is None:
+            rejects.append((row, f"team {team_name} does not exist"))
+            continue
+        if not task_number.isdigit():
+            rejects.append((row, f"{task_number} is not a task number"))
+            continue
+        found = member_index.resolve(ctx.guild, member_query)
+        if len(found) != 1:
+            rejects.append((row, f"no member named {member_query}" if not found
+                            else f"{member_query} could be any of {', '.join(sorted(str(member) for member in found))}"))
+            continue
+        accepted.append((row, (team, int(task_number), found[0].display_name)))
+
+    async with engine.transaction_many(entry[0] for _, entry in accepted):
+        completions, engine_rejects = engine.complete_many([entry for _, entry in accepted], by=str(ctx.author))
+    rejects += [(accepted[position][0], reason) for position, reason in engine_rejects]
+    # In the order the entries were given
+    order = {where: position for position, (where, _) in enumerate(rows)}
+    rejects.sort(key=lambda reject: order[reject[0][0]])
+
+    cleared = []
+    for position, result in completions:
+        team = accepted[position][1][0]
+        if result.doubled:
+            scheduler.cancel(deadline_key("double_points", ctx.game, team.key))
+        if result.wave_cleared and team.name not in cleared:
+            cleared.append(team.name)
+
+    lines = [f"**Bulk completion:** {len(completions)} of {len(rows)} entries applied, "
+             f"{sum(result.points for _, result in completions)} points awarded."]
+    if cleared:
+        lines.append(f"Wave cleared by {', '.join(cleared)}; use `!progress <team>` to continue.")
+    if rejects:
+        lines.append(f"**Rejected ({len(rejects)}):**")
+        lines.extend(f"• {where} `{', '.join(fields)}`: {reason}" for (where, fields), reason in rejects)
+    await outbox.send(ctx, "\n".join(lines))
+
+
+class WaveChoiceButton(discord.ui.DynamicItem[discord.ui.Button], template=r"roguelike:wave:(?P<game>[^:]+):(?P<team>[^:]+):(?P<wave>\d+):(?P<choice>shop|next)"):
+    """"Access the shop" / "Continue" on a cleared wave. Everything it needs is in its custom_id, so it works across restarts."""
+
+    def __init__(self, game_id, team_key, wave, choice):
+        label, emoji = ("Access the shop", "1️⃣") if choice == "shop" else ("Continue to the next wave", "2️⃣")
+        super().__init__(discord.ui.Button(label=label, emoji=emoji, style=discord.ButtonStyle.primary,
+                                           custom_id=f"roguelike:wave:{game_id}:{team_key}:{wave}:{choice}"))
+        self.game_id = game_id
+        self.team_key = team_key
+        self.wave = wave
+        self.choice = choice
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match["game"], match["team"], int(match["wave"]), match["choice"])
+
+    async def callback(self, interaction):
+        await wave_choice(interaction, self.game_id, self.team_key, self.wave, self.choice)
+
+
+class ShopItemButton(discord.ui.DynamicItem[discord.ui.Button], template=r"roguelike:shop:(?P<game>[^:]+):(?P<team>[^:]+):(?P<wave>\d+):(?P<item>\d+)"):
+    """Buys one offered shop item (item 0 leaves the shop) and moves the team on to the next wave."""
+
+    def __init__(self, game_id, team_key, wave, item_id):
+        item = get_catalog().shop_items.get(item_id)
+        if item_id == 0 or item is None:
+            button = discord.ui.Button(label="Cancel", style=discord.ButtonStyle.secondary,
+                                       custom_id=f"roguelike:shop:{game_id}:{team_key}:{wave}:0")
+        else:
+            button = discord.ui.Button(label=f"{item['name']} ({item['cost']} points)", style=discord.ButtonStyle.success,
+                                       custom_id=f"roguelike:shop:{game_id}:{team_key}:{wave}:{item_id}")
+        super().__init__(button)
+        self.game_id = game_id
+        self.team_key = team_key
+        self.wave = wave
+        self.item_id = item_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match["game"], match["team"], int(match["wave"]), int(match["item"]))
+
+    async def callback(self, interaction):
+        await shop_choice(interaction, self.game_id, self.team_key, self.wave, self.item_id)
+
+
+# Buttons are matched by custom_id, including on messages sent before the bot restarted
+bot.add_dynamic_items(WaveChoiceButton, ShopItemButton)
+
+
+def wave_choice_view(game_id, team_key, wave):
+    view = discord.ui.View(timeout=None)
+    view.add_item(WaveChoiceButton(game_id, team_key, wave, "shop"))
+    view.add_item(WaveChoiceButton(game_id, team_key, wave, "next"))
+    return view
+
+
+def shop_view(game_id, team_key, wave, item_ids):
+    view = discord.ui.View(timeout=None)
+    for item_id in item_ids:
+        view.add_item(ShopItemButton(game_id, team_key, wave, item_id))
+    view.add_item(ShopItemButton(game_id, team_key, wave, 0))
+    return view
+
+
+async def prompt_team(interaction, engine, team_key, wave):
+    """The team a button is for, or None after telling the clicker why it can't be used."""
+    team = engine.teams.get(team_key)
+    if not is_captain_or_admin(interaction.user):
+        await interaction.response.send_message(
+            "Only team captains or server administrators can choose for a team.", ephemeral=True)
+        return None
+    if team is None or team.wave.number != wave:
+        await interaction.response.send_message("This prompt is out of date; the team has already moved on.", ephemeral=True)
+        return None
+    return team
+
+
+async def wave_choice(interaction, game_id, team_key, wave, choice):
+    game = await games.get_game(interaction.guild_id, game_id)
+    team = await prompt_team(interaction, game.engine, team_key, wave)
+    if team is None:
         return
 
-    if team.get("shop_accessed", False):
-        # Reset the shop_accessed flag if it’s preventing progress in a new wave
-        await ctx.send(f"{team_name} has already accessed the shop in the previous wave. Resetting shop access to allow progression.")
-        team["shop_accessed"] = False
-        save_game_state()
+    if choice == "shop":
+        available_items = get_random_shop_items(2)
+        shop_message = f"**Welcome to the shop, {team.name}! Here are the available items:**\n"
+        for i, (item_id, item) in enumerate(available_items.items(), 1):
+            shop_message += f"{NUMBER_EMOJIS[i-1]} **{item['name']}** - {item['description']} (Cost: {item['cost']} points)\n"
+        shop_message += "\nPick the item you'd like to purchase, or Cancel to exit."
+        await interaction.response.edit_message(content=shop_message, view=shop_view(game_id, team_key, wave, available_items))
+        # The shop replaces the prompt in the same message, so its offer replaces the prompt's deadline
+        expire_prompt(game, team_key, wave, interaction.message, SHOP_OFFER_SECONDS, shop=True)
+    else:
+        await advance_from_prompt(interaction, game, team, wave)
+
 
-    await ctx.send(f"{team_name}, you have completed the wave! Would you like to: \n1️⃣ Access the shop\n2️⃣ Continue to the next wave")
+async def shop_choice(interaction, game_id, team_key, wave, item_id):
+    game = await games.get_game(interaction.guild_id, game_id)
+    team = await prompt_team(interaction, game.engine, team_key, wave)
+    if team is None:
+        return
+
+    item = get_catalog().shop_items.get(item_id) if item_id else None
+    if item_id and item is None:
+        await interaction.response.send_message("That item is no longer sold; use Cancel or `!progress` again.", ephemeral=True)
+        return
+    await advance_from_prompt(interaction, game, team, wave, item, left_shop=item is None)
 
-    def check(m):
-        return m.author == ctx.author and m.content in ['1', '2']
 
+async def advance_from_prompt(interaction, game, team, wave, item=None, left_shop=False):
+    """Buy the item (if any) and advance the wave in one step, unless another command got there first."""
+    engine = game.engine
     try:
-        reply = await bot.wait_for('message', timeout=60.0, check=check)
+        async with engine.transaction(team, expect_wave=wave):
+            # A completion can have been undone, or the game restored, since the prompt was posted
+            if not team.wave.cleared:
+                await interaction.response.send_message(
+                    f"{team.name} has not cleared Wave {wave} any more, so there is nothing to do.", ephemeral=True)
+                return
+            purchased = item is not None and engine.purchase(team, item["name"], item["cost"], by=str(interaction.user))
+            # Mark the shop as accessed and advance the wave
+            new_wave = engine.advance_wave(team, shop_accessed=True)
+    except StaleTeamError:
+        await interaction.response.send_message("This prompt is out of date; the team has already moved on.", ephemeral=True)
+        return
+    scheduler.cancel(deadline_key("prompt", game, team.key, wave))
+    scheduler.cancel(deadline_key("double_points", game, team.key))
+    start_wave_clock(game, team)
+
+    outcome = f"{team.name} has moved to Wave {new_wave.number}!"
+    if left_shop:
+        outcome = f"{team.name} has exited the shop.\n" + outcome
+    elif item is not None and purchased:
+        outcome = f"{team.name} has purchased **{item['name']}** for {item['cost']} points!\n" + outcome
+    elif item is not None:
+        outcome = f"{team.name} does not have enough points to purchase **{item['name']}**.\n" + outcome
+    await interaction.response.edit_message(content=outcome, view=None)
+    await interaction.followup.send(wave_tasks_message(f"**{team.name}, here are your tasks for Wave {new_wave.number}:**\n", new_wave.tasks))
+
+
+@bot.hybrid_command()
+@app_commands.autocomplete(team_name=team_autocomplete)
+async def progress(ctx, team_name: str):
+    engine = ctx.game.engine
+    team = engine.lookup(team_name)
+    if not team:
+        await ctx.send(f"Team {team_name} does not exist.")
+        return
 
-        if reply.content == '1':
-            available_items = get_random_shop_items(2)
-            number_emojis = ["1️⃣", "2️⃣"]
-            shop_message = "**Welcome to the shop! Here are the available items:**\n"
-            for i, (item_id, item) in enumerate(available_items.items(), 1):
-                shop_message += f"{number_emojis[i-1]} **{item['name']}** - {item['description']} (Cost: {item['cost']} points)\n"
-            shop_message += "\nPlease enter the number of the item you'd like to purchase, or type `cancel` to exit."
-            await ctx.send(shop_message)
+    # Check if the user is a team captain or an administrator
+    member = ctx.author
+    if not is_captain_or_admin(member):
+        await ctx.send(f"{member.mention}, you are not authorized to progress {team_name}. Only team captains or server administrators can do so.")
+        return
 
-            def shop_check(m):
-                return m.author == ctx.author and (m.content in ['1', '2'] or m.content.lower() == "cancel")
+    async with engine.transaction(team):
+        # Check if the team has completed enough tasks to progress
+        if not team.wave.cleared:
+            await ctx.send(f"{team_name} has not completed enough tasks to progress. Complete at least {team.wave.required} tasks before using `!progress`.")
+            return
 
-            try:
-                shop_reply = await bot.wait_for('message', timeout=60.0, check=shop_check)
+        shop_reset = engine.reset_shop_access(team)
 
-                if shop_reply.content.lower() == "cancel":
-                    await ctx.send(f"{team_name} has exited the shop. Moving to the next wave.")
-                else:
-                    selected_index = int(shop_reply.content) - 1
-                    item = list(available_items.values())[selected_index]
-
-                    if team["points"] >= item["cost"]:
-                        team["points"] -= item["cost"]
-                        team["purchases"].append(item["name"])
-                        save_game_state()
-                        await ctx.send(f"{team_name} has purchased **{item['name']}** for {item['cost']} points!")
-                    else:
-                        await ctx.send(f"{team_name} does not have enough points to purchase **{item['name']}**.")
-
-            except asyncio.TimeoutError:
-                await ctx.send(f"{team_name}, no response received. Exiting the shop and moving to the next wave.")
-
-        # Mark the shop as accessed and advance the wave
-        team["shop_accessed"] = True
-        team["wave"] += 1
-        team["tasks"] = generate_tasks(team["wave"], team)
-        save_game_state()
-        await ctx.send(f"{team_name} has moved to Wave {team['wave']}!")
-
-        number_emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
-        tasks_message = f"**{team_name}, here are your tasks for Wave {team['wave']}:**\n"
-        for i, task in enumerate(team["tasks"], 1):
-            tasks_message += f"{number_emojis[i-1]} {task[1]} (Points: {task[2]})\n"
-        await ctx.send(tasks_message)
-
-    except asyncio.TimeoutError:
-        await ctx.send(f"{team_name}, no response received. Automatically continuing to the next wave.")
-        team["shop_accessed"] = True
-        team["wave"] += 1
-        team["tasks"] = generate_tasks(team["wave"], team)
-        save_game_state()
-        await ctx.send(f"{team_name} has moved to Wave {team['wave']}!")
-
-        number_emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
-        tasks_message = f"**{team_name}, here are your tasks for Wave {team['wave']}:**\n"
-        for i, task in enumerate(team["tasks"], 1):
-            tasks_message += f"{number_emojis[i-1]} {task[1]} (Points: {task[2]})\n"
-        await ctx.send(tasks_message)
+    if shop_reset:
+        # Reset the shop_accessed flag if it’s preventing progress in a new wave
+        await ctx.send(f"{team_name} has already accessed the shop in the previous wave. Resetting shop access to allow progression.")
 
-@bot.command()
+    # The choice is made with buttons; nothing waits on it, and it stays valid until the team leaves this wave
+    message = await ctx.send(f"{team_name}, you have completed the wave! Would you like to:",
+                             view=wave_choice_view(ctx.game.game_id, team.key, team.wave.number))
+    expire_prompt(ctx.game, team.key, team.wave.number, message, PROMPT_EXPIRY_SECONDS)
+
+@bot.hybrid_command()
+@app_commands.autocomplete(team_name=team_autocomplete)
 async def inventory(ctx, team_name: str):
-    global game_state
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
+    engine = ctx.game.engine
+    team = engine.lookup(team_name)
     if not team:
         await ctx.send(f"Team {team_name} does not exist.")
         return
 
-    purchases = team.get("purchases", [])
-
-    if not purchases:
+    if not team.purchases:
         await ctx.send(f"{team_name} has not purchased any items yet.")
     else:
-        number_emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"]
         inventory_message = f"**{team_name}'s Inventory:**\n"
-        for i, item in enumerate(purchases, 1):
-            inventory_message += f"{number_emojis[i-1]} {item}\n"
+        for i, item in enumerate(team.purchases, 1):
+            inventory_message += f"{NUMBER_EMOJIS[i-1]} {item}\n"
         await ctx.send(inventory_message)
 
-@bot.command()
-async def use(ctx, team_name: str, item_number: int):
-    global game_state
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (
-                    data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
+@bot.hybrid_command()
+@app_commands.autocomplete(team_name=team_autocomplete, item_number=item_autocomplete, task_number=task_autocomplete)
+async def use(ctx, team_name: str, item_number: int, task_number: int = None):
+    engine = ctx.game.engine
+    team = engine.lookup(team_name)
     if not team:
         await ctx.send(f"Team {team_name} does not exist.")
         return
 
     # Check if the user is a team captain or an administrator
     member = ctx.author
-    is_team_captain = any(role.name == "Team Captain" for role in member.roles)
-    is_admin = member.guild_permissions.administrator
-
-    if not (is_team_captain or is_admin):
+    if not is_captain_or_admin(member):
         await ctx.send(f"{member.mention}, you are not authorized to use items for {team_name}. Only team captains or server administrators can do so.")
         return
 
-    inventory = team.get("purchases", [])
-
-    if not inventory:
-        await ctx.send(f"{team_name} has no items in their inventory.")
-        return
-
-    if item_number < 1 or item_number > len(inventory):
-        await ctx.send(f"Invalid item number. Please choose a number between 1 and {len(inventory)}.")
+    try:
+        async with engine.transaction(team):
+            result = engine.use_item(team, item_number, by=str(ctx.author), task_number=task_number)
+    except GameError as e:
+        await ctx.send(str(e))
         return
 
-    item = inventory[item_number - 1]
-
+    item = result.item
     if item.lower() == "monkey's paw":
         await ctx.send(f"{team_name} used **Monkey's Paw**! All tasks will be re-rolled with a higher chance of getting harder tasks.")
-
-        # Re-roll all tasks with a higher weight for harder tasks
-        new_tasks = []
-        for task in team["tasks"]:
-            difficulty = task[0]  # Get the original task's difficulty
-            # Adjust weights to favor harder tasks
-            weights = {"easy": 10, "medium": 30, "hard": 60}
-            new_difficulty = random.choices(["easy", "medium", "hard"], weights=[weights["easy"], weights["medium"], weights["hard"]])[0]
-            new_task = select_task_for_team(new_difficulty, team)
-            new_tasks.append(new_task)
-
-        team["tasks"] = new_tasks
-        save_game_state()
-
         # Notify the team of their new tasks
-        number_emojis = ["1️⃣", "2️⃣", "3️⃣"]
-        tasks_message = f"**{team_name}, your tasks have been re-rolled:**\n"
-        for i, task in enumerate(team["tasks"], 1):
-            tasks_message += f"{number_emojis[i-1]} {task[1]} (Points: {task[2]})\n"
-        await ctx.send(tasks_message)
+        await ctx.send(wave_tasks_message(f"**{team_name}, your tasks have been re-rolled:**\n", team.wave.tasks))
 
     elif item.lower() == "rickrolling stew":
         await ctx.send(f"{team_name} used **RickRolling Stew**! Smells like a new task!")
 
-        if team["tasks"]:
-            reroll_index = random.randint(0, len(team["tasks"]) - 1)
-            old_task = team["tasks"][reroll_index]
-            difficulty = old_task[0]
-            new_task = select_task_for_team(difficulty, team)
-            team["tasks"][reroll_index] = new_task
-
-            await ctx.send(f"Task **{old_task[1]}** has been re-rolled to **{new_task[1]}** (Points: {new_task[2]})")
-        else:
+        if not result.rerolls:
             await ctx.send(f"{team_name} has no tasks to re-roll.")
+        for _, old_task, new_task in result.rerolls:
+            if new_task:
+                await ctx.send(f"Task **{old_task.description}** has been re-rolled to **{new_task.description}** (Points: {new_task.points})")
+            else:
+                await ctx.send(f"There are no tasks left to re-roll **{old_task.description}** into.")
 
-    # Handle other items similarly
+    elif item.lower() == "doubledipping brew":
+        deadline = result.deadline.replace(tzinfo=timezone.utc).timestamp()
+        scheduler.schedule(deadline_key("double_points", ctx.game, team.key), deadline,
+                           deadline=team.double_points_task["deadline"])
+        await ctx.send(f"{team_name} used **DoubleDipping Brew**! Task **{result.doubled_task.description}** "
+                       f"is worth double points if completed by <t:{int(deadline)}:t> (<t:{int(deadline)}:R>).")
+
+    elif item.lower() == "gp":
+        await ctx.send(f"{team_name} used **GP**! {result.gp:,} GP awarded to the team's {len(team.members)} members.")
 
-    # Remove the item from the team's inventory
-    inventory.pop(item_number - 1)
-    save_game_state()
     await ctx.send(f"{item} has been removed from {team_name}'s inventory.")
 
 @use.error
@@ -735,51 +802,37 @@ async def use_error(ctx, error):
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def set_teams(ctx, num_teams: int):
-    global game_started, game_state
-
-    if game_started:
-        await ctx.send("The game has already started! You cannot set teams after the game has started.")
+    engine = ctx.game.engine
+    await ctx.game.backup("before !set_teams")
+    try:
+        team_keys = engine.set_teams(num_teams)
+    except GameError as e:
+        await ctx.send(str(e))
         return
 
-    game_state = {
-        f"Team{i + 1}": {
-            "wave": 1,
-            "tasks": [],
-            "points": 0,
-            "gp": 0,
-            "members": {},
-            "purchases": [],
-            "completed_tasks": {},
-            "custom_name": None
-        }
-        for i in range(num_teams)
-    }
-
-    save_game_state()
-    await ctx.send(f"{num_teams} teams have been set with names: {', '.join(game_state.keys())}!")
+    await ctx.send(f"{num_teams} teams have been set with names: {', '.join(team_keys)}!")
 
 
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(administrator=True)
+@app_commands.autocomplete(team=team_autocomplete)
 async def set_name(ctx, team: str, name: str):
-    global game_state
-
-    # Convert the team name to lower case for case-insensitive matching
-    team_key = next((key for key in game_state if key.lower() == team.lower()), None)
+    engine = ctx.game.engine
+    team_data = engine.lookup(team)
 
-    if not team_key:
+    if not team_data:
         await ctx.send(f"Team '{team}' does not exist.")
         return
 
-    # Check if the new custom name is already taken (case-insensitive)
-    if any(data['custom_name'] and data['custom_name'].lower() == name.lower() for data in game_state.values()):
-        await ctx.send(f"The name '{name}' is already taken. Please choose a different name.")
+    # Set the custom name for the team, unless it is already taken (case-insensitive)
+    try:
+        async with engine.transaction(team_data):
+            engine.rename(team_data, name)
+    except GameError as e:
+        await ctx.send(str(e))
         return
 
-    # Set the custom name for the team
-    game_state[team_key]['custom_name'] = name
-    save_game_state()
-    await ctx.send(f"{team_key} is now named '{name}'!")
+    await ctx.send(f"{team_data.key} is now named '{name}'!")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
@@ -800,209 +853,220 @@ async def assign_captain(ctx, *members: discord.Member):
         return
 
     # Assign the role to each member
+    lines = []
     for member in members:
         if role not in member.roles:
             await member.add_roles(role)
-            await ctx.send(f"{member.display_name} has been assigned the '{role_name}' role.")
+            lines.append(f"{member.display_name} has been assigned the '{role_name}' role.")
         else:
-            await ctx.send(f"{member.display_name} already has the '{role_name}' role.")
+            lines.append(f"{member.display_name} already has the '{role_name}' role.")
 
     # Confirm the completion
-    await ctx.send("All specified members have been assigned the 'Team Captain' role.")
+    lines.append("All specified members have been assigned the 'Team Captain' role.")
+    await outbox.send(ctx, "\n".join(lines))
 
 @bot.command()
-async def assign_members(ctx, team_name: str, *members: discord.Member):
-    global game_state
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
+async def assign_members(ctx, team_name: str, *member_names: str):
+    engine = ctx.game.engine
+    team = engine.lookup(team_name)
 
     if not team:
         await ctx.send(f"Team {team_name} does not exist.")
         return
 
-    for member in members:
-        # Use the member's nickname if available, otherwise use their username
-        member_display_name = member.nick if member.nick else member.name
-        team["members"][member_display_name] = team["members"].get(member_display_name, 0)
-
-    save_game_state()
-    await ctx.send(f"Members assigned to {team_name}: {', '.join(team['members'].keys())}")
+    members = []
+    for member_name in member_names:
+        member = await resolve_member(ctx, member_name)
+        if member is None:
+            return
+        members.append(member)
 
+    # Use the member's nickname if available, otherwise use their username
+    async with engine.transaction(team):
+        engine.assign_members(team, [member.nick if member.nick else member.name for member in members])
+    await ctx.send(f"Members assigned to {team_name}: {', '.join(team.members.keys())}")
 
-# Global variable to track whether the game has started
-game_started = False
 
-# Load game state when the bot starts
-game_state = load_game_state()
+async def send_seed(ctx, text):
+    """
+    DM a seed to the admin who asked for it. Seeds predict waves, so they never go to the channel:
+    with DMs closed, a slash command gets it as an ephemeral reply and a prefix command a notice.
+    """
+    try:
+        await ctx.author.send(text)
+    except discord.Forbidden:
+        if ctx.interaction:
+            await ctx.send(text, ephemeral=True)
+        else:
+            await ctx.send(f"{ctx.author.mention}, I couldn't DM you the seed. Allow DMs from this server "
+                           f"and use `!seed`, or use `/seed` to see it privately.")
+        return
+    # A slash command must be answered even though the seed itself went by DM
+    if ctx.interaction:
+        await ctx.send("Sent you a DM.", ephemeral=True)
 
 
 @bot.command()
+@commands.has_permissions(administrator=True)
 async def start(ctx):
-    global game_started, game_state
-
-    if game_started:
-        await ctx.send("The game has already started! You cannot start it again.")
+    engine = ctx.game.engine
+    await ctx.game.backup("before !start")
+    try:
+        engine.start(GAME_SEED or secrets.token_hex(8))
+    except GameError as e:
+        await ctx.send(str(e))
         return
 
-    # Mark the game as started
-    game_started = True
+    for team in engine.teams.values():
+        start_wave_clock(ctx.game, team)
+    await ctx.send("Game has started! Wave 1 has begun for all teams!")
+    await outbox.send(ctx, "\n".join(
+        wave_tasks_message(f"**{team_name}, here are your tasks for Wave 1:**\n", team.wave.tasks)
+        for team_name, team in engine.teams.items()
+    ))
+    # The seed predicts every wave, so only the admin who started the game gets it
+    await send_seed(ctx, f"Game seed: `{engine.game_seed}`. Use `!seed <team> <wave>` to look up a team's wave stream.")
+
+@start.error
+async def start_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
 
-    for team_name, team in game_state.items():
-        team["wave"] = 1
-        team["tasks"] = generate_tasks(team["wave"], team)
 
-    save_game_state()
+@bot.hybrid_command()
+@commands.has_permissions(administrator=True)
+@app_commands.autocomplete(team_name=team_autocomplete)
+async def seed(ctx, team_name: str = None, wave: int = None):
+    """DM the game seed, or the stream seed a team's wave was drawn from."""
+    engine = ctx.game.engine
+    game_seed = engine.game_seed
+    if game_seed is None:
+        await ctx.send("No game seed has been set yet. It is picked when the game starts.")
+        return
 
-    await ctx.send("Game has started! Wave 1 has begun for all teams!")
+    if not team_name:
+        await send_seed(ctx, f"Game seed: `{game_seed}`")
+    else:
+        team = engine.lookup(team_name)
+        if not team:
+            await ctx.send(f"Team {team_name} does not exist.")
+            return
+
+        wave = wave or team.wave.number
+        await send_seed(
+            ctx,
+            f"Wave {wave} of {team.display_name} is drawn from `random.Random(\"{game_seed}:{team.key}:{wave}\")`, "
+            f"against the team's completed tasks at the time."
+        )
 
-    number_emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
-    for team_name, team in game_state.items():
-        tasks_message = f"**{team_name}, here are your tasks for Wave 1:**\n"
-        for i, task in enumerate(team["tasks"], 1):
-            tasks_message += f"{number_emojis[i - 1]} {task[1]} (Points: {task[2]})\n"
-        await ctx.send(tasks_message)
+@seed.error
+async def seed_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
 
 
 async def continue_wave(ctx, team_name: str):
-    global game_state
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
+    engine = ctx.game.engine
+    team = engine.lookup(team_name)
 
     if not team:
         await ctx.send(f"Team {team_name} does not exist.")
         return
 
-    team["wave"] += 1
-    team["tasks"] = generate_tasks(team["wave"], team)
-    save_game_state()
-    await ctx.send(f"{team_name} has moved to Wave {team['wave']}!")
+    async with engine.transaction(team):
+        wave = engine.advance_wave(team, shop_accessed=team.shop_accessed)
+    await ctx.send(f"{team_name} has moved to Wave {wave.number}!")
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.autocomplete(team_name=team_autocomplete)
 async def points(ctx, team_name: str = None):
-    global game_state
+    engine = ctx.game.engine
+    render_cache = ctx.game.render_cache
     if team_name:
-        team = next(
-            (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-            None
-        )
+        team = engine.lookup(team_name)
 
         if not team:
             await ctx.send(f"Team {team_name} does not exist.")
             return
 
-        original_name = next(key for key, data in game_state.items() if data == team)
-        display_name = f"{original_name} ({team['custom_name']})" if team['custom_name'] else original_name
-        response = f"{display_name} - Wave {team['wave']}:\n"
-
-        for task in team["tasks"]:
-            status = "~~" if "completed" in task else ""
-            response += f"{status}{task[1]} (Points: {task[2]}){status}\n"
+        response = render_cache.block("points", team, render_points)
     else:
-        response = "All Teams:\n"
-        for name, team_data in game_state.items():
-            display_name = f"{name} ({team_data['custom_name']})" if team_data['custom_name'] else name
-            response += f"{display_name} - Wave {team_data['wave']} - Points: {team_data['points']}\n"
+        response = render_cache.view("points_all", render_points_summary, header="All Teams:\n")
 
-    await ctx.send(response)
+    await outbox.send(ctx, response)
 
-import logging
 
-@bot.command()
-async def current(ctx, team_name: str = None):
-    global game_state
-    response = ""
+def render_points(team):
+    lines = [f"{team.display_name} - Wave {team.wave.number}:\n"]
+    for task in team.wave.tasks:
+        status = "~~" if task.completed else ""
+        lines.append(f"{status}{task.description} (Points: {task.points}){status}\n")
+    return "".join(lines)
+
 
-    number_emojis = ["1️⃣", "2️⃣", "3️⃣"]
+def render_points_summary(team):
+    return f"{team.display_name} - Wave {team.wave.number} - Points: {team.points}\n"
 
+import logging
+
+@bot.hybrid_command()
+@app_commands.autocomplete(team_name=team_autocomplete)
+async def current(ctx, team_name: str = None):
+    engine = ctx.game.engine
+    render_cache = ctx.game.render_cache
     if team_name:
-        team = next(
-            (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-            None
-        )
+        team = engine.lookup(team_name)
         if not team:
             await ctx.send(f"Team {team_name} does not exist.")
             return
+        response = render_cache.block("current", team, lambda team: render_current(engine, team))
+    else:
+        response = render_cache.view("current", lambda team: render_current(engine, team), separator="\n")
 
-        original_name = next(key for key, data in game_state.items() if data == team)
-        display_name = f"{original_name} ({team['custom_name']})" if team['custom_name'] else original_name
-
-        response += f"**{display_name}** - **Wave {team['wave']}**:\n"
-        if team["tasks"]:
-            is_boss_wave = any(task[0] == "boss" for task in team["tasks"])
+    # Check if response is empty and handle it
+    if not response.strip():
+        response = "No information available to display."
 
-            if is_boss_wave:
-                response += "  **Boss Wave:** Complete the boss task to proceed!\n"
-            else:
-                completed_count = sum(1 for task in team["tasks"] if "completed" in task)
-                response += f"  **Progress:** {completed_count}/2 tasks completed to continue\n"
-
-                # Auto-correct the shop_accessed flag if necessary
-                if completed_count < 2 and team.get("shop_accessed", False):
-                    team["shop_accessed"] = False
-                    save_game_state()
-                    logging.debug(f"Shop access reset for team {display_name}.")
-
-                for idx, task in enumerate(team["tasks"], 1):
-                    status = "~~" if "completed" in task else ""
-                    emoji = number_emojis[idx - 1] if idx <= len(number_emojis) else f"{idx}."
-                    response += f"  {emoji} {status}**{task[1]}** (Points: {task[2]}){status}\n"
-        else:
-            response += "  No tasks assigned yet.\n"
+    await outbox.send(ctx, response)
 
-    else:
-        for name, team_data in game_state.items():
-            display_name = f"{name} ({team_data['custom_name']})" if team_data['custom_name'] else name
-            response += f"**{display_name}** - **Wave {team_data['wave']}**:\n"
 
-            if team_data["tasks"]:
-                is_boss_wave = any(task[0] == "boss" for task in team_data["tasks"])
+def render_current(engine, team):
+    lines = [f"**{team.display_name}** - **Wave {team.wave.number}**:\n"]
 
-                if is_boss_wave:
-                    response += "  **Boss Wave:** Complete the boss task to proceed!\n"
-                else:
-                    completed_count = sum(1 for task in team_data["tasks"] if "completed" in task)
-                    response += f"  **Progress:** {completed_count}/2 tasks completed to continue\n"
-
-                    # Auto-correct the shop_accessed flag if necessary
-                    if completed_count < 2 and team_data.get("shop_accessed", False):
-                        team_data["shop_accessed"] = False
-                        save_game_state()
-                        logging.debug(f"Shop access reset for team {display_name}.")
-
-                    for idx, task in enumerate(team_data["tasks"], 1):
-                        status = "~~" if "completed" in task else ""
-                        emoji = number_emojis[idx - 1] if idx <= len(number_emojis) else f"{idx}."
-                        response += f"  {emoji} {status}**{task[1]}** (Points: {task[2]}){status}\n"
-            else:
-                response += "  No tasks assigned yet.\n"
+    if team.wave.tasks:
+        if team.wave.is_boss:
+            lines.append("  **Boss Wave:** Complete the boss task to proceed!\n")
+        else:
+            completed_count = team.wave.completed_count
+            lines.append(f"  **Progress:** {completed_count}/{team.wave.required} tasks completed to continue\n")
 
-            response += "\n"
+            # Auto-correct the shop_accessed flag if necessary
+            if completed_count < team.wave.required and engine.reset_shop_access(team):
+                logging.debug(f"Shop access reset for team {team.display_name}.")
 
-    # Check if response is empty and handle it
-    if not response.strip():
-        response = "No information available to display."
+            for idx, task in enumerate(team.wave.tasks, 1):
+                status = "~~" if task.completed else ""
+                emoji = NUMBER_EMOJIS[idx - 1] if idx <= 3 else f"{idx}."
+                lines.append(f"  {emoji} {status}**{task.description}** (Points: {task.points}){status}\n")
+    else:
+        lines.append("  No tasks assigned yet.\n")
 
-    await ctx.send(response)
+    return "".join(lines)
 
 @bot.command()
 async def members(ctx):
-    global game_state
+    engine = ctx.game.engine
     response = "### **Teams and their Members** ###\n\n"
 
-    for team_name, team_data in game_state.items():
+    for team in engine.teams.values():
         # Display the team name, with custom name if available
-        display_name = f"{team_name} ({team_data['custom_name']})" if team_data['custom_name'] else team_name
-        response += f"**{display_name}**\n"
+        response += f"**{team.display_name}**\n"
 
-        if team_data["members"]:
+        if team.members:
             response += "```\n"  # Start a code block for the member list
-            for member_name in team_data["members"]:
+            for member_name in team.members:
                 # Attempt to find the member by their username
-                member = discord.utils.get(ctx.guild.members, name=member_name)
+                member = member_index.by_username(ctx.guild, member_name)
                 if member:
                     member_display_name = member.nick if member.nick else member.name
                     response += f"{member_display_name}\n"
@@ -1014,58 +1078,226 @@ async def members(ctx):
 
         response += "\n"  # Add some space between teams
 
-    await ctx.send(response)
+    await outbox.send(ctx, response)
 
 
 @bot.command()
 async def gp(ctx):
-    global game_state
+    reads = ctx.game.reads
     gp_message = "**Total GP Earned by Teams:**\n"
-    for team_name, team_data in game_state.items():
-        display_name = f"{team_name} ({team_data['custom_name']})" if team_data['custom_name'] else team_name
-        gp_message += f"{display_name}: {team_data['gp']} GP\n"
-    await ctx.send(gp_message)
+    for team_name, custom_name, _, _, team_gp in reads.team_summaries():
+        display_name = f"{team_name} ({custom_name})" if custom_name else team_name
+        gp_message += f"{display_name}: {team_gp} GP\n"
+    await outbox.send(ctx, gp_message)
 
 from discord.ext import commands
 
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(administrator=True)
+@app_commands.autocomplete(team_name=team_autocomplete)
 async def reset_tasks(ctx, team_name: str):
-    global game_state
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
+    engine = ctx.game.engine
+    team = engine.lookup(team_name)
     if not team:
         await ctx.send(f"Team {team_name} does not exist.")
         return
 
-    # Track the total points to remove
-    points_to_remove = 0
+    await ctx.game.backup(f"before !reset_tasks {team.key}")
+    # Mark completed tasks as incomplete, removing their points and the completion history
+    async with engine.transaction(team):
+        points_to_remove = engine.reset_tasks(team)
 
-    # Iterate through tasks and mark completed tasks as incomplete, removing points
-    for task in team["tasks"]:
-        if "completed" in task:
-            # Subtract the points from the team
-            points_to_remove += task[2]
-            # Remove the "completed" status from the task
-            task.remove("completed")
+    await ctx.send(f"Tasks for {team_name} have been reset. {points_to_remove} points were removed. You can now complete tasks or use !progress.")
 
-    # Subtract the points from the team's total points
-    team["points"] -= points_to_remove
+@reset_tasks.error
+async def reset_tasks_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
 
-    # Ensure the team's points do not go below zero
-    team["points"] = max(0, team["points"])
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def reload_catalog(ctx):
+    """Re-read the task and shop catalog file without restarting the bot."""
+    try:
+        # Parsing and validating a large catalog happens off the event loop; the swap itself is instant
+        catalog = await asyncio.get_running_loop().run_in_executor(None, load_catalog, CATALOG_FILE)
+        # The catalog is shared by every game in this process
+        await games.reload_catalog(catalog)
+    except (CatalogError, GameError) as e:
+        await outbox.send(ctx, f"The catalog was not reloaded. {e}")
+        return
 
-    # Update the completed tasks tracking
-    team["completed_tasks"] = {difficulty: {} for difficulty in task_sets.keys()}
+    await ctx.send(f"Loaded {catalog.summary()}.")
 
-    save_game_state()
+@reload_catalog.error
+async def reload_catalog_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
 
-    await ctx.send(f"Tasks for {team_name} have been reset. {points_to_remove} points were removed. You can now complete tasks or use !progress.")
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def bind_game(ctx, game_id: str, role: str = "chat"):
+    """Make this channel one of a game's channels (chat, channel or announcements); commands here play that game."""
+    try:
+        games.bind(ctx.guild.id, game_id, ctx.channel.id, role)
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
 
-@reset_tasks.error
-async def reset_tasks_error(ctx, error):
+    await ctx.send(f"This channel is now the {role} channel of game '{game_id}'. Commands used here play that game.")
+
+@bind_game.error
+async def bind_game_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def restore_points(ctx):
+    """List this game's restore points, newest first."""
+    if ctx.game.backups is None:
+        await ctx.send("Backups are turned off.")
+        return
+    points = await asyncio.to_thread(ctx.game.backups.points)
+    if not points:
+        await ctx.send(f"Game '{ctx.game.game_id}' has no restore points yet.")
+        return
+    lines = [f"**Restore points of game '{ctx.game.game_id}'** (use `!restore <number>`):", "```"]
+    for point in reversed(points):
+        lines.append(f"#{point.id:<5} {point.created.replace('T', ' ')} UTC  {point.reason:<28} "
+                     f"{point.teams} teams, {point.new_objects} changed ({point.new_bytes / 1024:.1f} KiB)")
+    lines.append("```")
+    await outbox.send(ctx, "\n".join(lines))
+
+@restore_points.error
+async def restore_points_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def restore(ctx, point_id: int):
+    """Roll this game back to a restore point from !restore_points. The game as it is now is backed up first."""
+    try:
+        before = await ctx.game.restore(point_id)
+    except KeyError:
+        await ctx.send(f"There is no restore point #{point_id}. Use `!restore_points` to list them.")
+        return
+    except GameError as e:
+        await ctx.send(str(e))
+        return
+
+    undo = f" To undo this, `!restore {before.id}`." if before else ""
+    await ctx.send(f"Game '{ctx.game.game_id}' has been rolled back to restore point #{point_id}.{undo}")
+
+@restore.error
+async def restore_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
+
+@bot.command(name="export")
+@commands.has_permissions(administrator=True)
+async def export_results(ctx, kind: str = "all", fmt: str = "csv"):
+    """
+    Export this game's teams, members and/or completions as gzip-compressed CSV or JSON lines
+    (`!export completions jsonl`), attached to the reply.
+    """
+    kind, fmt = kind.lower(), fmt.lower()
+    if kind not in EXPORT_KINDS + ("all",) or fmt not in EXPORT_FORMATS:
+        await ctx.send(f"Usage: `!export [{'|'.join(EXPORT_KINDS)}|all] [{'|'.join(EXPORT_FORMATS)}]`")
+        return
+
+    files = []
+    summary = []
+    with contextlib.ExitStack() as stack:
+        for kind in EXPORT_KINDS if kind == "all" else (kind,):
+            # Spooled to disk as it is written, so nothing the size of the export is held in memory
+            file = stack.enter_context(tempfile.TemporaryFile())
+            rows = await export_async(ctx.game.engine.teams.values(), kind, fmt, file)
+            size = file.tell()
+            if size > ctx.guild.filesize_limit:
+                await ctx.send(f"The {kind} export is {size / 2**20:.1f} MiB, more than this server's attachment limit. "
+                               f"Use `python export.py` on the bot's host instead.")
+                return
+            file.seek(0)
+            files.append(discord.File(file, filename=f"{ctx.game.game_id}-{kind}.{fmt}.gz"))
+            summary.append(f"{kind}: {rows} rows")
+        await ctx.send(f"Export of game '{ctx.game.game_id}' ({', '.join(summary)}).", files=files)
+
+@export_results.error
+async def export_results_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
+
+@bot.command(name="games")
+async def list_games(ctx):
+    """List this server's games and their channels."""
+    lines = [f"**Games in this server** (this channel plays '{ctx.game.game_id}'):"]
+    for game_id in games.games_in(ctx.guild.id):
+        channels = games.channels(ctx.guild.id, game_id)
+        described = ", ".join(f"{role} <#{channel_id}>" for role, channel_id in channels.items()) or "every unbound channel"
+        lines.append(f"• **{game_id}**: {described}")
+    await outbox.send(ctx, "\n".join(lines))
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def profile(ctx, target: str, amount: float = None):
+    """
+    Profile the next `amount` (10) invocations of a command, or everything the bot does for
+    `amount` seconds (30) with `!profile window`. `!profile stop` ends a session early.
+    """
+    if target.lower() == "stop":
+        session = profiler.finish()
+        if session is None:
+            await ctx.send("Nothing is being profiled.")
+        else:
+            await send_profile(session)
+        return
+
+    try:
+        if target.lower() == "window":
+            seconds = min(amount or 30, 600)
+            profiler.profile_window(ctx.channel)
+            # Held by the session so the timer isn't garbage collected
+            profiler.session.timer = asyncio.create_task(end_profile_window(profiler.session, seconds))
+            await ctx.send(f"Profiling everything for {seconds:g} seconds.")
+            return
+
+        command = bot.get_command(target.lstrip('!'))
+        if command is None:
+            await ctx.send(f"There is no command called {target}.")
+            return
+        count = max(1, int(amount or 10))
+        profiler.profile_command(command.qualified_name, count, ctx.channel)
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
+
+    await ctx.send(f"Profiling the next {count} invocation(s) of !{command.qualified_name}.")
+
+
+async def end_profile_window(session, seconds):
+    await asyncio.sleep(seconds)
+    # Unless it was stopped early
+    if profiler.session is session:
+        profiler.finish()
+        await send_profile(session)
+
+@profile.error
+async def profile_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("You do not have the required permissions to use this command.")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def sync_commands(ctx):
+    """Register the slash versions of the commands with this server; they show up right away."""
+    bot.tree.copy_global_to(guild=ctx.guild)
+    synced = await bot.tree.sync(guild=ctx.guild)
+    await ctx.send(f"Synced {len(synced)} slash commands to this server.")
+
+@sync_commands.error
+async def sync_commands_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
         await ctx.send("You do not have the required permissions to use this command.")
 
@@ -1078,14 +1310,17 @@ async def commandlist(ctx):
         "`!current <team_name>` - Show the current tasks and their completion status for a team.",
         "`!completed <team_name> [<member_name>]` - Show completed tasks for a team or a specific member.",
         "`!completed_all` - Show completed tasks for all teams.",
-        "`!mvp` - Show the top 3 players who have earned the most points.",
-        "`!points <team_name>` - View the wave number and tasks for a specific team."
+        "`!mvp [<count>]` - Show the top 3 (or count) players who have earned the most points.",
+        "`!rank <member_name>` - Show a player's rank and points.",
+        "`!points <team_name>` - View the wave number and tasks for a specific team.",
+        "`!games` - List this server's games and the channels that play them."
     ]
 
     captain_commands = [
         "`!progress <team_name>` - Progress to the next wave after completing 2 tasks.",
         "`!complete <team_name> <task_number> <member_name>` - Mark a task as completed.",
-        "`!use <team_name> <item_number>` - Use an item from the team's inventory.",
+        "`!complete_bulk` - Complete many tasks at once: `team, task, member` lines after the command or a CSV attachment.",
+        "`!use <team_name> <item_number> [task_number]` - Use an item from the team's inventory (DoubleDipping Brew needs the task to double).",
         "`!set_name <team> <name>` - Set a custom name for your team.",
         "`!assign_members <team_name> <members...>` - Assign members to a team."
     ]
@@ -1093,7 +1328,15 @@ async def commandlist(ctx):
     admin_commands = [
         "`!set_teams <num_teams>` - Initialize the game with a specified number of teams.",
         "`!reset_tasks <team_name>` - Reset the tasks for a team, removing their progress.",
-        "`!start` - Start the game, initializing the first wave of tasks."
+        "`!restore_points` - List the game's restore points.",
+        "`!restore <number>` - Roll the game back to a restore point.",
+        "`!start` - Start the game, initializing the first wave of tasks.",
+        "`!seed [<team_name> <wave>]` - DM the game seed, or the seed of a team's wave.",
+        "`!reload_catalog` - Reload the task and shop catalog file.",
+        "`!bind_game <game_id> [chat|channel|announcements]` - Play another game in this channel.",
+        "`!profile <command> [<count>]`, `!profile window [<seconds>]`, `!profile stop` - Profile commands and report the hottest functions.",
+        "`!export [teams|members|completions|all] [csv|jsonl]` - Export the game's results as compressed attachments.",
+        "`!sync_commands` - Register the slash commands with this server."
     ]
 
     embed = discord.Embed(
@@ -1110,194 +1353,143 @@ async def commandlist(ctx):
 
     await ctx.send(embed=embed)
 
-@bot.command()
-async def mvp(ctx):
-    """Show the top 3 players who have earned the most points."""
-    if not game_started:
+def player_label(player_name):
+    # Extra safety: Remove @ from the start if it exists, and escape markdown special characters to avoid mentions
+    return discord.utils.escape_markdown(player_name.lstrip('@'))
+
+
+@bot.hybrid_command()
+async def mvp(ctx, count: int = 3):
+    """Show the top players who have earned the most points (3 unless a number is given)."""
+    engine = ctx.game.engine
+    if not engine.game_started:
         await ctx.send("The game has not started yet. Please use !start to start the game.")
         return
 
     try:
-        # Calculate points for each player
-        player_points = defaultdict(int)
-        for team in game_state.values():
-            for member_name, points in team["members"].items():
-                # Prefer using display names consistently
-                player_points[member_name] += points
+        # Groups of tied players, best first
+        groups = engine.leaderboard.top(max(1, count))
 
-        # Find the top players based on total points
-        top_players = sorted(player_points.items(), key=lambda x: x[1], reverse=True)[:3]
-
-        if not top_players:
+        if not groups:
             await ctx.send("No players have earned any points yet.")
             return
 
         # Prepare response
-        response = "🏆🌟 **Top 3 MVPs of the Game** 🌟🏆\n\n"
+        response = f"🏆🌟 **Top {count} MVPs of the Game** 🌟🏆\n\n"
 
         medals = ["🥇", "🥈", "🥉"]
-        previous_points = None
-        medal_index = 0
         lines = []
-        tied_players = []
-
-        for i, (player_name, points) in enumerate(top_players):
-            # Extra safety: Remove @ from the start if it exists
-            player_name = player_name.lstrip('@')
 
-            # Escape markdown special characters to avoid mentions
-            player_name = discord.utils.escape_markdown(player_name)
-
-            if previous_points is not None and points == previous_points:
-                tied_players.append(player_name)
-            else:
-                if tied_players:
-                    if len(tied_players) > 1:
-                        lines.append(
-                            f"{current_medal} **{'** and **'.join(tied_players)}** have all earned {previous_points:.2f} points and are tied!")
-                    else:
-                        lines.append(f"{current_medal} **{tied_players[0]}**: {previous_points:.2f} points")
-                    tied_players = []
-
-                if medal_index >= len(medals):
-                    break
-
-                current_medal = medals[medal_index]
-                tied_players.append(player_name)
-                previous_points = points
-                medal_index += 1
-
-        if tied_players:
+        for i, (rank, points, names) in enumerate(groups):
+            current_medal = medals[i] if i < len(medals) else f"**#{rank}**"
+            tied_players = [player_label(name) for name in names]
             if len(tied_players) > 1:
                 lines.append(
-                    f"{current_medal} **{'** and **'.join(tied_players)}** have all earned {previous_points:.2f} points and are tied!")
+                    f"{current_medal} **{'** and **'.join(tied_players)}** have all earned {points:.2f} points and are tied!")
             else:
-                lines.append(f"{current_medal} **{tied_players[0]}**: {previous_points:.2f} points")
+                lines.append(f"{current_medal} **{tied_players[0]}**: {points:.2f} points")
 
         response += "\n\n".join(lines)
-        await ctx.send(response)
+        await outbox.send(ctx, response)
     except Exception as e:
         logging.error(f"Error in mvp command: {e}")
         await ctx.send(f"An error occurred while processing the command: {str(e)}")
 
 
-@bot.command()
-async def completed(ctx, team_name: str, member: str = None):
-    global game_state, task_sets
+@bot.hybrid_command()
+@app_commands.autocomplete(member=member_autocomplete)
+async def rank(ctx, *, member: str):
+    """Show where a player stands on the leaderboard."""
+    engine = ctx.game.engine
+    player_name = engine.leaderboard.find(member.lstrip('@'))
+    if not player_name:
+        await ctx.send(f"Player '{member}' has not been assigned to a team.")
+        return
 
-    team = next(
-        (data for key, data in game_state.items() if key.lower() == team_name.lower() or (data['custom_name'] and data['custom_name'].lower() == team_name.lower())),
-        None
-    )
+    position, points = engine.leaderboard.rank(player_name)
+    tied = " (tied)" if engine.leaderboard.ties(player_name) else ""
+    await ctx.send(f"**{player_label(player_name)}** is ranked #{position}{tied} "
+                   f"of {len(engine.leaderboard)} players with {points:.2f} points.")
+
+
+@bot.hybrid_command()
+@app_commands.autocomplete(team_name=team_autocomplete, member=member_autocomplete)
+async def completed(ctx, team_name: str, member: str = None):
+    engine = ctx.game.engine
+    reads = ctx.game.reads
+    render_cache = ctx.game.render_cache
+    team = engine.lookup(team_name)
 
     if not team:
         await ctx.send(f"Team '{team_name}' not found.")
         return
 
     response = f"### **Completed Tasks for {team_name}** ###\n\n"
-    display_name = f"{team_name} ({team['custom_name']})" if team['custom_name'] else team_name
-    team_points = team.get("points", 0)
-
-    response += f"**Total Points: {team_points}**\n"
 
     if member:
-        member_display_name = None
-        for m_name in team['members'].keys():
-            if member.lower() in m_name.lower():
-                member_display_name = m_name
-                break
-
-        if not member_display_name:
-            await ctx.send(f"Member '{member}' not found in team '{team_name}'.")
+        try:
+            member_display_name = engine.resolve_member(team, member)
+        except GameError as e:
+            await ctx.send(str(e))
             return
 
-        member_completed_tasks = []
+        response += render_cache.block(("completed", member_display_name), team,
+                                       lambda team: render_member_completed(reads, team, member_display_name))
+    else:
+        response += render_cache.block("completed", team, lambda team: render_completed(reads, team))
 
-        for difficulty, tasks in team['completed_tasks'].items():
-            for task_id_str, task_levels in tasks.items():
-                task_id = int(task_id_str)
-                for level_index, completed_by in enumerate(task_levels):
-                    if completed_by == member_display_name:
-                        task_details = task_sets[difficulty][task_id - 1]["tasks"][level_index]
-                        task_description = task_details["description"]
-                        task_points = task_details["points"]
-                        member_completed_tasks.append(f"• {task_description} (Points: {task_points})")
+    await outbox.send(ctx, response)
 
-        member_points = team["members"].get(member_display_name, 0)
-        response += f"**Points for {member_display_name}: {member_points}**\n"
-        response += "```\n"
 
-        if member_completed_tasks:
-            response += "\n".join(member_completed_tasks)
-        else:
-            response += f"No completed tasks found for {member_display_name}."
-        response += "\n```"
+def render_completed(reads, team):
+    """A team's points and completed task levels, as a code block."""
+    completed_tasks = []
+    for difficulty, task_id, level_index, completed_by in reads.completed_levels(team.key):
+        details = task_details(difficulty, task_id, level_index)
+        completed_tasks.append(f"• {details['description']} (Points: {details['points']}) - Completed by {completed_by}")
 
-    else:
-        completed_tasks = []
-
-        for difficulty, tasks in team['completed_tasks'].items():
-            for task_id_str, task_levels in tasks.items():
-                task_id = int(task_id_str)
-                for level_index, completed_by in enumerate(task_levels):
-                    if completed_by:
-                        task_details = task_sets[difficulty][task_id - 1]["tasks"][level_index]
-                        task_description = task_details["description"]
-                        task_points = task_details["points"]
-                        completed_tasks.append(f"• {task_description} (Points: {task_points}) - Completed by {completed_by}")
-
-        response += "```\n"
-        if completed_tasks:
-            response += "\n".join(completed_tasks)
-        else:
-            response += "No completed tasks found."
-        response += "\n```"
+    return (f"**Total Points: {team.points}**\n"
+            "```\n"  # Start a code block for better formatting
+            + ("\n".join(completed_tasks) if completed_tasks else "No completed tasks found.")
+            + "\n```")  # End the code block
 
-    if len(response) > 2000:
-        for i in range(0, len(response), 2000):
-            await ctx.send(response[i:i + 2000])
-    else:
-        await ctx.send(response)
 
-@bot.command()
-async def completed_all(ctx):
-    global game_state, task_sets
-
-    for team_name, team_data in game_state.items():
-        response = f"### **Completed Tasks for {team_name}** ###\n\n"
-        display_name = f"{team_name} ({team_data['custom_name']})" if team_data['custom_name'] else team_name
-        team_points = team_data.get("points", 0)
-
-        response += f"**Total Points: {team_points}**\n"
-        response += "```\n"  # Start a code block for better formatting
-        completed_tasks = []
-
-        # Iterate through the team's completed tasks
-        for difficulty, tasks in team_data['completed_tasks'].items():
-            for task_id_str, task_levels in tasks.items():
-                task_id = int(task_id_str)  # Convert task_id to integer
-                for level_index, completed_by in enumerate(task_levels):
-                    if completed_by:  # Check if the task was completed
-                        task_details = task_sets[difficulty][task_id - 1]["tasks"][level_index]
-                        task_description = task_details["description"]
-                        task_points = task_details["points"]
-                        completed_tasks.append(f"• {task_description} (Points: {task_points}) - Completed by {completed_by}")
-
-        # Append completed tasks to the response
-        if completed_tasks:
-            response += "\n".join(completed_tasks)
-        else:
-            response += "No completed tasks found."
-        response += "\n```"  # End the code block
+def render_member_completed(reads, team, member_name):
+    member_completed_tasks = []
+    for difficulty, task_id, level_index, completed_by in reads.completed_levels(team.key, member_name):
+        details = task_details(difficulty, task_id, level_index)
+        member_completed_tasks.append(f"• {details['description']} (Points: {details['points']})")
 
-        # Send the response in chunks if it's too long
-        if len(response) > 2000:
-            for i in range(0, len(response), 2000):
-                await ctx.send(response[i:i+2000])
-        else:
-            await ctx.send(response)
+    return (f"**Total Points: {team.points}**\n"
+            f"**Points for {member_name}: {team.members.get(member_name, 0)}**\n"
+            "```\n"
+            + ("\n".join(member_completed_tasks) if member_completed_tasks else f"No completed tasks found for {member_name}.")
+            + "\n```")
 
-        await ctx.send(".")
 
-# Run the bot
-bot.run(DISCORD_BOT_TOKEN)
+@bot.command()
+async def completed_all(ctx):
+    engine = ctx.game.engine
+    reads = ctx.game.reads
+    render_cache = ctx.game.render_cache
+    await outbox.send(ctx, "\n\n".join(
+        f"### **Completed Tasks for {team_name}** ###\n\n" + render_cache.block("completed", team, lambda team: render_completed(reads, team))
+        for team_name, team in engine.teams.items()
+    ))
+
+if __name__ == "__main__":
+    # A game saved before games were kept per guild only belongs to GUILD_ID's default game;
+    # without GUILD_ID it would be ignored and every guild would start from scratch
+    if GUILD_ID is None and has_saved_game(STORAGE_BACKEND, SAVE_FILE, JOURNAL_FILE, SQLITE_FILE, SEASON,
+                                           legacy_file=LEGACY_SAVE_FILE):
+        logging.error(f"Found a game saved by an earlier version of the bot ({SAVE_FILE}, {LEGACY_SAVE_FILE}, "
+                      f"{JOURNAL_FILE} or season {SEASON!r} of {SQLITE_FILE}). Set GUILD_ID to the guild it "
+                      f"belongs to, or move it away to start without it.")
+        raise SystemExit(1)
+
+    # Run the bot
+    bot.run(DISCORD_BOT_TOKEN)
+
+    # Write out anything still pending
+    games.close()
+    scheduler.persister.flush_now()
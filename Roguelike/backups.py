@@ -0,0 +1,150 @@
+"""
+Rotating, content-addressed backups of a game, for rolling it back without a restart.
+
+Every team is stored once per distinct content, as a zlib-compressed object named after the
+SHA-256 of its saved form; a restore point is a small manifest listing each team's object.
+A backup taken after a few completions only writes the teams that changed, and objects no
+manifest refers to any more are deleted when old restore points are rotated out.
+
+    <directory>/manifests/00000042.json
+    <directory>/objects/3f/3fa4...
+"""
+import hashlib
+import json
+import os
+import threading
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+
+from persistence import write_atomic
+from snapshot import pack_team, unpack_team
+
+
+@dataclass(frozen=True, slots=True)
+class RestorePoint:
+    id: int
+    created: str  # ISO timestamp
+    reason: str
+    teams: int
+    # Objects this restore point added, and their compressed size
+    new_objects: int
+    new_bytes: int
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8')
+
+
+class BackupStore:
+    """
+    One game's restore points, newest last, keeping at most `keep` of them.
+
+    Every method does file I/O and is meant to run in a worker thread; a lock keeps backups
+    and restores of the same game from interleaving.
+    """
+
+    def __init__(self, directory, keep=48):
+        self.directory = directory
+        self.keep = keep
+        self._manifests = os.path.join(directory, "manifests")
+        self._objects = os.path.join(directory, "objects")
+        self._lock = threading.Lock()
+
+    def _manifest_path(self, point_id):
+        return os.path.join(self._manifests, f"{point_id:08d}.json")
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def _ids(self):
+        if not os.path.isdir(self._manifests):
+            return []
+        return sorted(int(name[:-5]) for name in os.listdir(self._manifests)
+                      if name.endswith(".json") and name[:-5].isdigit())
+
+    def _read_manifest(self, point_id):
+        with open(self._manifest_path(point_id), 'rb') as file:
+            return json.loads(file.read())
+
+    @staticmethod
+    def _point(manifest):
+        return RestorePoint(manifest["id"], manifest["created"], manifest["reason"], len(manifest["teams"]),
+                            manifest["new_objects"], manifest["new_bytes"])
+
+    def save(self, data, reason):
+        """
+        Back up `data` ({"game_state", "game_started", "game_seed"}, as the engine's snapshot).
+        Returns the new RestorePoint, or None if nothing changed since the latest one.
+        """
+        with self._lock:
+            teams = []
+            objects = {}
+            for key, team in data["game_state"].items():
+                encoded = _encode(pack_team(team))
+                digest = hashlib.sha256(encoded).hexdigest()
+                teams.append([key, digest])
+                objects[digest] = encoded
+
+            ids = self._ids()
+            if ids:
+                latest = self._read_manifest(ids[-1])
+                if (latest["teams"] == teams and latest["game_started"] == data["game_started"]
+                        and latest["game_seed"] == data["game_seed"]):
+                    return None
+
+            new_objects = new_bytes = 0
+            for digest, encoded in objects.items():
+                path = self._object_path(digest)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    compressed = zlib.compress(encoded, 6)
+                    write_atomic(path, compressed)
+                    new_objects += 1
+                    new_bytes += len(compressed)
+
+            point_id = ids[-1] + 1 if ids else 1
+            manifest = {
+                "id": point_id,
+                "created": datetime.utcnow().isoformat(timespec="seconds"),
+                "reason": reason,
+                "game_started": data["game_started"],
+                "game_seed": data["game_seed"],
+                "teams": teams,
+                "new_objects": new_objects,
+                "new_bytes": new_bytes,
+            }
+            os.makedirs(self._manifests, exist_ok=True)
+            # Written after its objects, so a crash never leaves a manifest pointing at nothing
+            write_atomic(self._manifest_path(point_id), _encode(manifest))
+            self._rotate(ids + [point_id])
+            return self._point(manifest)
+
+    def _rotate(self, ids):
+        if len(ids) <= self.keep:
+            return
+        for point_id in ids[:-self.keep]:
+            os.remove(self._manifest_path(point_id))
+        referenced = {digest for point_id in ids[-self.keep:] for _, digest in self._read_manifest(point_id)["teams"]}
+        for prefix in os.listdir(self._objects):
+            for digest in os.listdir(os.path.join(self._objects, prefix)):
+                if digest not in referenced:
+                    os.remove(os.path.join(self._objects, prefix, digest))
+
+    def points(self):
+        """Every restore point, oldest first."""
+        with self._lock:
+            return [self._point(self._read_manifest(point_id)) for point_id in self._ids()]
+
+    def load(self, point_id):
+        """The game as it was at a restore point, in the form save() takes. Raises KeyError for an unknown ID."""
+        with self._lock:
+            if point_id not in self._ids():
+                raise KeyError(point_id)
+            manifest = self._read_manifest(point_id)
+            game_state = {}
+            for key, digest in manifest["teams"]:
+                with open(self._object_path(digest), 'rb') as file:
+                    game_state[key] = unpack_team(json.loads(zlib.decompress(file.read())))
+            return {"game_state": game_state, "game_started": manifest["game_started"],
+                    "game_seed": manifest["game_seed"]}
@@ -0,0 +1,195 @@
+"""
+The task and shop catalog, loaded from a JSON data file.
+
+    {
+        "tasks": {"easy": [{"id": 1, "tasks": [{"description": ..., "points": 1}, ...]}, ...], ...},
+        "boss": [{"id": 1, "description": ..., "points": 15}, ...],
+        "shop": [{"id": 1, "name": ..., "description": ..., "cost": 10, "weight": 10}, ...]
+    }
+
+Each family in "tasks" lists its levels in order. load_catalog() validates the file and
+compiles it into a Catalog; the running catalog is swapped as a whole with set_catalog().
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+# The catalog shipped next to the bot
+DEFAULT_CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")
+
+# The difficulties the wave weights in tasks.py are defined for
+DIFFICULTIES = ("easy", "medium", "hard")
+
+
+class CatalogError(ValueError):
+    """The catalog file is unreadable or invalid; the message lists every problem found."""
+
+
+@dataclass(frozen=True, slots=True)
+class Catalog:
+    # {difficulty: {task_id: ({"description", "points"} per level, ...)}}
+    families: dict
+    # {task_id: (description, points)}
+    boss: dict
+    # {item_id: {"name", "description", "cost", "weight"}}
+    shop_items: dict
+    # Sampling tables
+    boss_tasks: tuple
+    shop_ids: tuple
+    shop_weights: tuple
+    source: str = ""
+    digest: str = ""
+
+    @property
+    def difficulties(self):
+        return tuple(self.families)
+
+    def summary(self):
+        counts = ", ".join(f"{len(families)} {difficulty}" for difficulty, families in self.families.items())
+        return (f"catalog {self.digest[:12]}: {counts} task families, {len(self.boss)} boss tasks, "
+                f"{len(self.shop_items)} shop items")
+
+
+def _problems(data):
+    """Every validation problem in the parsed file, as readable strings."""
+    problems = []
+    if not isinstance(data, dict):
+        return ["the catalog must be a JSON object"]
+
+    task_sets = data.get("tasks")
+    if not isinstance(task_sets, dict) or not task_sets:
+        problems.append('"tasks" must map each difficulty to a list of task families')
+        task_sets = {}
+    elif sorted(task_sets) != sorted(DIFFICULTIES):
+        problems.append(f'"tasks" must have exactly the difficulties {", ".join(DIFFICULTIES)}')
+    for difficulty, families in task_sets.items():
+        if not isinstance(families, list) or not families:
+            problems.append(f"{difficulty}: expected a non-empty list of task families")
+            continue
+        seen = set()
+        for position, family in enumerate(families, 1):
+            where = f"{difficulty} family #{position}"
+            task_id = family.get("id") if isinstance(family, dict) else None
+            if not isinstance(task_id, int) or isinstance(task_id, bool) or task_id < 1:
+                problems.append(f"{where}: id must be a positive integer")
+                continue
+            where = f"{difficulty} family {task_id}"
+            if task_id in seen:
+                problems.append(f"{where}: duplicate id")
+            seen.add(task_id)
+            levels = family.get("tasks")
+            if not isinstance(levels, list) or not levels:
+                problems.append(f"{where}: needs at least one level in \"tasks\"")
+                continue
+            previous_points = None
+            for level, entry in enumerate(levels):
+                if not isinstance(entry, dict) or not isinstance(entry.get("description"), str) or not entry["description"].strip():
+                    problems.append(f"{where} level {level + 1}: missing description")
+                    continue
+                points = entry.get("points")
+                if not isinstance(points, int) or isinstance(points, bool) or points < 0:
+                    problems.append(f"{where} level {level + 1}: points must be a non-negative integer")
+                    continue
+                if previous_points is not None and points < previous_points:
+                    problems.append(f"{where} level {level + 1}: points go down from {previous_points} to {points}")
+                previous_points = points
+
+    seen = set()
+    for position, task in enumerate(data.get("boss", []), 1):
+        task_id = task.get("id") if isinstance(task, dict) else None
+        if not isinstance(task_id, int) or isinstance(task_id, bool) or task_id < 1:
+            problems.append(f"boss task #{position}: id must be a positive integer")
+            continue
+        if task_id in seen:
+            problems.append(f"boss task {task_id}: duplicate id")
+        seen.add(task_id)
+        if not isinstance(task.get("description"), str) or not task["description"].strip():
+            problems.append(f"boss task {task_id}: missing description")
+        if not isinstance(task.get("points"), int) or task["points"] < 0:
+            problems.append(f"boss task {task_id}: points must be a non-negative integer")
+    if not seen:
+        problems.append('"boss" needs at least one boss task')
+
+    seen_ids, seen_names = set(), set()
+    for position, item in enumerate(data.get("shop", []), 1):
+        item_id = item.get("id") if isinstance(item, dict) else None
+        if not isinstance(item_id, int) or isinstance(item_id, bool) or item_id < 1:
+            problems.append(f"shop item #{position}: id must be a positive integer")
+            continue
+        if item_id in seen_ids:
+            problems.append(f"shop item {item_id}: duplicate id")
+        seen_ids.add(item_id)
+        name = item.get("name")
+        if not isinstance(name, str) or not name.strip():
+            problems.append(f"shop item {item_id}: missing name")
+        elif name.lower() in seen_names:
+            problems.append(f"shop item {item_id}: duplicate name {name!r}")
+        else:
+            seen_names.add(name.lower())
+        if not isinstance(item.get("cost"), int) or item["cost"] < 0:
+            problems.append(f"shop item {item_id}: cost must be a non-negative integer")
+        if not isinstance(item.get("weight"), (int, float)) or item["weight"] <= 0:
+            problems.append(f"shop item {item_id}: weight must be positive")
+    if len(seen_ids) < 2:
+        problems.append('"shop" needs at least two items')
+
+    return problems
+
+
+def compile_catalog(data, source="", digest=""):
+    """Validate parsed catalog data and build its lookup and sampling tables."""
+    problems = _problems(data)
+    if problems:
+        raise CatalogError(f"{len(problems)} problem(s) in {source or 'the catalog'}:\n" + "\n".join(problems))
+
+    families = {
+        difficulty: {
+            family["id"]: tuple({"description": level["description"], "points": level["points"]} for level in family["tasks"])
+            for family in task_set
+        }
+        for difficulty, task_set in data["tasks"].items()
+    }
+    boss = {task["id"]: (task["description"], task["points"]) for task in data["boss"]}
+    shop_items = {
+        item["id"]: {key: item[key] for key in ("name", "description", "cost", "weight")}
+        for item in data["shop"]
+    }
+    return Catalog(
+        families=families,
+        boss=boss,
+        shop_items=shop_items,
+        boss_tasks=tuple(("boss", description, points, task_id, 0) for task_id, (description, points) in boss.items()),
+        shop_ids=tuple(shop_items),
+        shop_weights=tuple(item["weight"] for item in shop_items.values()),
+        source=source,
+        digest=digest,
+    )
+
+
+def load_catalog(path=DEFAULT_CATALOG_FILE):
+    """Read, validate and compile a catalog file. Raises CatalogError if it can't be used."""
+    try:
+        with open(path, 'rb') as file:
+            raw = file.read()
+        data = json.loads(raw)
+    except (OSError, ValueError) as e:
+        raise CatalogError(f"Could not read {path}: {e}") from e
+    return compile_catalog(data, source=path, digest=hashlib.sha256(raw).hexdigest())
+
+
+_catalog = None
+
+
+def get_catalog():
+    """The catalog in use, loading the default file on first use."""
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
+
+
+def set_catalog(catalog):
+    """Swap in a new catalog. Task indexes built from the old one must be rebuilt."""
+    global _catalog
+    _catalog = catalog
@@ -0,0 +1,632 @@
+"""
+Game rules, independent of Discord.
+
+Bot.py resolves Discord members and permissions and formats replies; everything that
+changes the game goes through GameEngine, which emits the journal events for each change.
+"""
+import asyncio
+import contextlib
+import random
+import secrets
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from history import MemberHistory
+from leaderboard import Leaderboard
+from registry import TeamRegistry
+from catalog import get_catalog, set_catalog
+from tasks import (generate_tasks, generate_wave, team_rng, select_task, TaskIndexCache, level_count, next_level,
+                   tasks_required, HARDER_TASK_WEIGHTS)
+
+
+# How long a DoubleDipping Brew doubles its task's points
+DOUBLE_POINTS_WINDOW = timedelta(hours=4)
+
+# GP the "GP" item awards to each team member
+GP_PER_MEMBER = 1_000_000
+
+
+class GameError(Exception):
+    """A command that breaks the rules; the message is shown to the player as-is."""
+
+
+class StaleTeamError(GameError):
+    """The team changed while a command was waiting on a player, so the command was abandoned."""
+
+
+@dataclass(slots=True)
+class Task:
+    difficulty: str
+    description: str
+    points: int
+    task_id: int
+    level: int
+    completed_by: Optional[str] = None
+
+    @property
+    def completed(self):
+        return self.completed_by is not None
+
+    @property
+    def is_boss(self):
+        return self.difficulty == "boss"
+
+    @classmethod
+    def from_list(cls, data):
+        """Read the saved list form: [difficulty, description, points, task_id, level, "completed", member]."""
+        difficulty, description, points, task_id, level = data[:5]
+        extra = list(data[5:])
+        completed_by = None
+        if "completed" in extra:
+            position = extra.index("completed")
+            completed_by = extra[position + 1] if position + 1 < len(extra) else ""
+        return cls(difficulty, description, points, task_id, level, completed_by)
+
+    def to_list(self):
+        data = [self.difficulty, self.description, self.points, self.task_id, self.level]
+        if self.completed:
+            data += ["completed", self.completed_by]
+        return data
+
+
+@dataclass(slots=True)
+class Wave:
+    number: int
+    tasks: list = field(default_factory=list)
+
+    @property
+    def is_boss(self):
+        return any(task.is_boss for task in self.tasks)
+
+    @property
+    def completed_count(self):
+        return sum(1 for task in self.tasks if task.completed)
+
+    @property
+    def required(self):
+        return tasks_required(self.tasks)
+
+    @property
+    def cleared(self):
+        return self.completed_count >= self.required or self.is_boss
+
+
+@dataclass(slots=True)
+class Team:
+    key: str
+    wave: Wave
+    points: int = 0
+    gp: int = 0
+    members: dict = field(default_factory=dict)
+    purchases: list = field(default_factory=list)
+    # {difficulty: {task_id: [member who completed each level, or None]}}
+    completed_tasks: dict = field(default_factory=dict)
+    # Same shape, with the ISO time each level was completed
+    completed_at: dict = field(default_factory=dict)
+    # Same shape, with the wave each level was completed in
+    completed_wave: dict = field(default_factory=dict)
+    custom_name: Optional[str] = None
+    shop_accessed: bool = False
+    double_points_task: Optional[dict] = None
+    # GameEngine.version as of this team's last change; not saved
+    version: int = 0
+    # Built from completed_tasks; not saved
+    history: MemberHistory = field(default_factory=MemberHistory)
+
+    @property
+    def name(self):
+        return self.custom_name or self.key
+
+    @property
+    def display_name(self):
+        return f"{self.key} ({self.custom_name})" if self.custom_name else self.key
+
+    @classmethod
+    def from_dict(cls, key, data):
+        completed_tasks, completed_at, completed_wave = (
+            {
+                difficulty: {int(task_id): list(task_levels) for task_id, task_levels in tasks.items()}
+                for difficulty, tasks in data.get(field_name, {}).items()
+            }
+            for field_name in ("completed_tasks", "completed_at", "completed_wave")
+        )
+        team = cls(
+            key=key,
+            wave=Wave(data.get("wave", 1), [Task.from_list(task) for task in data.get("tasks", []) if task]),
+            points=data.get("points", 0),
+            gp=data.get("gp", 0),
+            members=dict(data.get("members", {})),
+            purchases=list(data.get("purchases", [])),
+            completed_tasks=completed_tasks,
+            completed_at=completed_at,
+            completed_wave=completed_wave,
+            custom_name=data.get("custom_name"),
+            shop_accessed=data.get("shop_accessed", False),
+            double_points_task=data.get("double_points_task"),
+        )
+        team.history.rebuild(team.members, team.completed_tasks, team.completed_at, team.completed_wave)
+        return team
+
+    def to_dict(self):
+        """The saved form. Containers are copied so the result can be serialized off the event loop."""
+        data = {
+            "wave": self.wave.number,
+            "tasks": [task.to_list() for task in self.wave.tasks],
+            "points": self.points,
+            "gp": self.gp,
+            "members": dict(self.members),
+            "purchases": list(self.purchases),
+            "completed_tasks": {
+                difficulty: {task_id: list(task_levels) for task_id, task_levels in tasks.items()}
+                for difficulty, tasks in self.completed_tasks.items()
+            },
+            "completed_at": {
+                difficulty: {task_id: list(timestamps) for task_id, timestamps in tasks.items()}
+                for difficulty, tasks in self.completed_at.items()
+            },
+            "completed_wave": {
+                difficulty: {task_id: list(waves) for task_id, waves in tasks.items()}
+                for difficulty, tasks in self.completed_wave.items()
+            },
+            "custom_name": self.custom_name,
+            "shop_accessed": self.shop_accessed,
+        }
+        if self.double_points_task:
+            data["double_points_task"] = dict(self.double_points_task)
+        return data
+
+
+@dataclass(slots=True)
+class Completion:
+    task: Task
+    points: int
+    doubled: bool
+    completed_count: int
+    required: int
+    wave_cleared: bool
+
+
+@dataclass(slots=True)
+class ItemUse:
+    item: str
+    # (task number, old task, new task or None when nothing was left to re-roll into)
+    rerolls: list = field(default_factory=list)
+    # The task a DoubleDipping Brew doubles and until when
+    doubled_task: Optional[Task] = None
+    deadline: Optional[datetime] = None
+    # GP a "GP" item awarded
+    gp: int = 0
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+class GameEngine:
+    """
+    One game: its teams, the team registry, the per-team task indexes and the player leaderboard.
+
+    `record(event_type, team_key, **data)` is called for every change with the journal event
+    describing it, and `save()` when the whole game changed (!set_teams, !start). Changes made
+    inside batch() are handed to `record_many([(event_type, team_key, data), ...])` at its end instead.
+
+    `version` goes up on every change, and each team keeps the version of its own last change,
+    so rendered views can be reused until the teams they show have changed.
+
+    The methods themselves never await, so each one is atomic on the event loop. Commands that
+    await between steps use transaction(), which serializes them per team.
+    """
+
+    def __init__(self, record=_noop, checkpoint=_noop, record_many=None):
+        self.teams = {}
+        self.game_started = False
+        self.game_seed = None
+        self.version = 0
+        self.registry = TeamRegistry(self.teams)
+        self.task_indexes = TaskIndexCache()
+        self.leaderboard = Leaderboard()
+        self.record = record
+        self.record_many = record_many or self._record_each
+        # Whole-game changes aren't events, so they are written out before the next event is journaled
+        self.checkpoint = checkpoint
+        self._locks = {}
+        self._batch = None
+
+    # Loading and saving
+
+    def load(self, state, meta):
+        self.teams = {key: Team.from_dict(key, data) for key, data in state.items()}
+        self.game_started = meta.get("game_started", False)
+        self.game_seed = meta.get("game_seed")
+        self.registry.rebuild(self.teams)
+        self.task_indexes.invalidate()
+        self.leaderboard.rebuild(self.teams.values())
+        self._changed(*self.teams.values())
+
+    def snapshot(self):
+        return {
+            "game_state": {key: team.to_dict() for key, team in self.teams.items()},
+            "game_started": self.game_started,
+            "game_seed": self.game_seed,
+        }
+
+    def _changed(self, *teams):
+        self.version += 1
+        for team in teams:
+            team.version = self.version
+
+    def _record(self, event_type, team, **data):
+        self._changed(team)
+        if self._batch is not None:
+            self._batch.append((event_type, team.key, data))
+        else:
+            self.record(event_type, team.key, **data)
+
+    def _record_each(self, events):
+        for event_type, team_key, data in events:
+            self.record(event_type, team_key, **data)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Record every change made inside with one record_many() call, so storage writes them together."""
+        self._batch = []
+        try:
+            yield
+        finally:
+            events, self._batch = self._batch, None
+            if events:
+                self.record_many(events)
+
+    def _record_team(self, team):
+        """Record a team's full data, for the less common changes that don't have their own event."""
+        self._record("team_updated", team, data=team.to_dict())
+
+    # Transactions
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, team, expect_wave=None):
+        """
+        Hold the team's lock, so other commands for the same team wait while commands for
+        other teams carry on. With `expect_wave` (the wave a button was posted for), raise
+        StaleTeamError if the team has moved on from that wave.
+        """
+        lock = self._locks.get(team.key)
+        if lock is None:
+            lock = self._locks[team.key] = asyncio.Lock()
+        async with lock:
+            if (self.teams.get(team.key) is not team
+                    or (expect_wave is not None and team.wave.number != expect_wave)):
+                raise StaleTeamError(f"{team.name} changed while you were deciding, so nothing was done. "
+                                     f"Check `!current {team.name}` and try again.")
+            yield team
+
+    @contextlib.asynccontextmanager
+    async def transaction_many(self, teams):
+        """Hold the locks of several teams, taken in key order so two batches can't deadlock."""
+        async with contextlib.AsyncExitStack() as stack:
+            for _, team in sorted({team.key: team for team in teams}.items()):
+                await stack.enter_async_context(self.transaction(team))
+            yield
+
+    @property
+    def busy(self):
+        """Whether a command is inside a transaction right now."""
+        return any(lock.locked() for lock in self._locks.values())
+
+    # Teams
+
+    def lookup(self, name):
+        """The team with this key or custom name (any case), or None."""
+        return self.registry.lookup(name)[1]
+
+    def set_teams(self, num_teams):
+        if self.game_started:
+            raise GameError("The game has already started! You cannot set teams after the game has started.")
+        self.teams = {f"Team{i + 1}": Team(key=f"Team{i + 1}", wave=Wave(1)) for i in range(num_teams)}
+        self.registry.rebuild(self.teams)
+        self.task_indexes.invalidate()
+        self.leaderboard.clear()
+        self._changed(*self.teams.values())
+        self.checkpoint()
+        return list(self.teams)
+
+    def rename(self, team, name):
+        if self.registry.is_taken(name):
+            raise GameError(f"The name '{name}' is already taken. Please choose a different name.")
+        self.registry.rename(team.key, name)
+        self._record("team_renamed", team, name=name)
+
+    def assign_members(self, team, member_names):
+        for member_name in member_names:
+            team.members.setdefault(member_name, 0)
+            team.history.add_member(member_name)
+            # Lists the player for !rank and autocomplete before they score
+            self.leaderboard.add(member_name, 0)
+        self._record_team(team)
+
+    # Waves
+
+    def _index(self, team):
+        return self.task_indexes.get(team.key, team.completed_tasks)
+
+    def _wave_tasks(self, team):
+        """Seeded tasks for the team's current wave."""
+        if self.game_seed is None:
+            # Games started before seeds were recorded get one now
+            self.game_seed = secrets.token_hex(8)
+            self.checkpoint()
+        rng = team_rng(self.game_seed, team.key, team.wave.number)
+        return [Task(*task) for task in generate_tasks(team.wave.number, self._index(team), rng)]
+
+    def start(self, game_seed):
+        if self.game_started:
+            raise GameError("The game has already started! You cannot start it again.")
+        self.game_started = True
+        self.game_seed = game_seed
+        wave_tasks = generate_wave(1, {key: team.completed_tasks for key, team in self.teams.items()},
+                                   game_seed, self.task_indexes)
+        for key, team in self.teams.items():
+            team.wave = Wave(1, [Task(*task) for task in wave_tasks[key]])
+        self._changed(*self.teams.values())
+        self.checkpoint()
+
+    def reset_shop_access(self, team):
+        """Clear a stale shop flag; returns whether it was set."""
+        if not team.shop_accessed:
+            return False
+        team.shop_accessed = False
+        self._record_team(team)
+        return True
+
+    def purchase(self, team, item_name, cost, by=None):
+        """Buy a shop item; returns False if the team can't afford it."""
+        if team.points < cost:
+            return False
+        team.points -= cost
+        team.purchases.append(item_name)
+        self._record("item_purchased", team, item=item_name, cost=cost, team_points=team.points,
+                     purchases=list(team.purchases), by=by)
+        return True
+
+    def advance_wave(self, team, shop_accessed=True):
+        team.shop_accessed = shop_accessed
+        team.wave = Wave(team.wave.number + 1)
+        team.wave.tasks = self._wave_tasks(team)
+        # A DoubleDipping Brew is for a task of the wave it was used in
+        team.double_points_task = None
+        self._record("wave_advanced", team, wave=team.wave.number,
+                     tasks=[task.to_list() for task in team.wave.tasks], shop_accessed=team.shop_accessed,
+                     double_points_task=None)
+        return team.wave
+
+    # Tasks
+
+    def resolve_member(self, team, query):
+        """The team member a typed name means: an exact match, else any case, else a unique prefix."""
+        matches = team.history.resolve(query)
+        if not matches:
+            raise GameError(f"Member '{query}' not found in team '{team.name}'.")
+        if len(matches) > 1:
+            raise GameError(f"'{query}' matches several members of {team.name}: {', '.join(matches)}.")
+        return matches[0]
+
+    def complete(self, team, task_number, member_name, by=None, now=None):
+        now = now or datetime.utcnow()
+        wave = team.wave
+        if task_number < 1 or task_number > len(wave.tasks):
+            raise GameError(f"Invalid task number. Please choose a number between 1 and {len(wave.tasks)}.")
+        task = wave.tasks[task_number - 1]
+
+        completed_count = wave.completed_count
+        if completed_count >= wave.required and not task.is_boss:
+            raise GameError(f"{team.name} has already completed {wave.required} tasks this wave. "
+                            f"Progress: Complete {completed_count}/{wave.required} tasks to continue.")
+        if task.completed:
+            raise GameError(f"Task '{task.description}' has already been completed.")
+
+        points = task.points
+        doubled = False
+        double_points_info = team.double_points_task
+        if double_points_info:
+            deadline = datetime.fromisoformat(double_points_info["deadline"])
+            if task_number - 1 == double_points_info["task_index"] and now <= deadline:
+                points *= 2
+                doubled = True
+                team.double_points_task = None
+
+        task.completed_by = member_name
+        team.points += points
+        team.members[member_name] = team.members.get(member_name, 0) + points
+        self.leaderboard.add(member_name, points)
+
+        task_levels = team.completed_tasks.setdefault(task.difficulty, {}).setdefault(
+            task.task_id, [None] * level_count(task.difficulty, task.task_id))
+        task_levels[task.level] = member_name
+        timestamps = team.completed_at.setdefault(task.difficulty, {}).setdefault(task.task_id, [None] * len(task_levels))
+        timestamps[task.level] = now.isoformat()
+        waves = team.completed_wave.setdefault(task.difficulty, {}).setdefault(task.task_id, [None] * len(task_levels))
+        waves[task.level] = wave.number
+        team.history.record(member_name, task.difficulty, task.task_id, task.level, timestamps[task.level], wave.number)
+        self._index(team).record(task.difficulty, task.task_id, task.level)
+
+        self._record(
+            "task_completed", team,
+            index=task_number - 1, task=task.to_list(), points=points, team_points=team.points,
+            member=member_name, member_points=team.members[member_name],
+            difficulty=task.difficulty, task_id=task.task_id, completed=list(task_levels),
+            completed_at=timestamps[task.level], wave=wave.number, double_points_used=doubled, by=by
+        )
+        completed_count += 1
+        return Completion(task, points, doubled, completed_count, wave.required,
+                          completed_count >= wave.required or task.is_boss)
+
+    def complete_many(self, entries, by=None, now=None):
+        """
+        Complete (team, task_number, member_name) entries in order, as one batch. Each entry is
+        checked against the game as the entries before it left it, so a task listed twice is
+        rejected the second time. Returns ([(position, Completion)], [(position, reason)]).
+        """
+        completions, rejects = [], []
+        with self.batch():
+            for position, (team, task_number, member_name) in enumerate(entries):
+                try:
+                    completions.append((position, self.complete(team, task_number, member_name, by=by, now=now)))
+                except GameError as e:
+                    rejects.append((position, str(e)))
+        return completions, rejects
+
+    def reroll(self, team, task_numbers, weights=None, rng=random):
+        """
+        Re-roll the given tasks, avoiding families already on offer. With `weights`, each new
+        task's difficulty is drawn from them; otherwise it keeps the old task's difficulty.
+        Returns (task number, old task, new task or None) for each.
+        """
+        index = self._index(team)
+        tasks = team.wave.tasks
+        taken = {(task.difficulty, task.task_id) for task in tasks}
+        rerolls = []
+        for task_number in task_numbers:
+            old_task = tasks[task_number - 1]
+            if weights:
+                difficulty = rng.choices(list(weights), weights=list(weights.values()))[0]
+            else:
+                difficulty = old_task.difficulty
+            new_task = select_task(index, difficulty, rng, exclude=taken, weights=weights)
+            if new_task:
+                new_task = Task(*new_task)
+                tasks[task_number - 1] = new_task
+                taken.add((new_task.difficulty, new_task.task_id))
+            rerolls.append((task_number, old_task, new_task))
+        self._changed(team)
+        return rerolls
+
+    def use_item(self, team, item_number, by=None, rng=random, task_number=None, now=None):
+        """Use an inventory item. A DoubleDipping Brew needs the number of the task it doubles."""
+        if not team.purchases:
+            raise GameError(f"{team.name} has no items in their inventory.")
+        if item_number < 1 or item_number > len(team.purchases):
+            raise GameError(f"Invalid item number. Please choose a number between 1 and {len(team.purchases)}.")
+
+        item = team.purchases[item_number - 1]
+        result = ItemUse(item)
+        if item.lower() == "doubledipping brew":
+            tasks = team.wave.tasks
+            if task_number is None:
+                raise GameError(f"Choose the task to double: `!use {team.key} {item_number} <task number>`.")
+            if task_number < 1 or task_number > len(tasks):
+                raise GameError(f"Invalid task number. Please choose a number between 1 and {len(tasks)}.")
+            if tasks[task_number - 1].completed:
+                raise GameError(f"Task '{tasks[task_number - 1].description}' has already been completed.")
+            result.doubled_task = tasks[task_number - 1]
+            result.deadline = (now or datetime.utcnow()) + DOUBLE_POINTS_WINDOW
+            team.double_points_task = {"task_index": task_number - 1, "deadline": result.deadline.isoformat()}
+        elif item.lower() == "gp":
+            result.gp = GP_PER_MEMBER * len(team.members)
+            team.gp += result.gp
+        elif item.lower() == "monkey's paw":
+            # Re-roll all tasks with a higher weight for harder tasks
+            result.rerolls = self.reroll(team, range(1, len(team.wave.tasks) + 1), HARDER_TASK_WEIGHTS, rng)
+        elif item.lower() == "rickrolling stew" and team.wave.tasks:
+            result.rerolls = self.reroll(team, [rng.randint(1, len(team.wave.tasks))], rng=rng)
+
+        team.purchases.pop(item_number - 1)
+        self._record("item_used", team, item=item, purchases=list(team.purchases),
+                     tasks=[task.to_list() for task in team.wave.tasks], gp=team.gp,
+                     double_points_task=dict(team.double_points_task) if team.double_points_task else None, by=by)
+        return result
+
+    def expire_double_points(self, team, deadline):
+        """End a DoubleDipping Brew whose window closed at `deadline` (ISO); False if it was used or replaced."""
+        if not team.double_points_task or team.double_points_task["deadline"] != deadline:
+            return False
+        task_index = team.double_points_task["task_index"]
+        team.double_points_task = None
+        self._record("double_points_expired", team, task_index=task_index, double_points_task=None)
+        return True
+
+    def reset_tasks(self, team):
+        """Un-complete the current wave's tasks and clear completion history; returns the points removed."""
+        points_to_remove = 0
+        for task in team.wave.tasks:
+            if task.completed:
+                points_to_remove += task.points
+                # Take the points back from the member who completed it as well
+                member_name = task.completed_by
+                if member_name in team.members:
+                    member_points = max(0, team.members[member_name] - task.points)
+                    self.leaderboard.add(member_name, member_points - team.members[member_name])
+                    team.members[member_name] = member_points
+                task.completed_by = None
+        team.points = max(0, team.points - points_to_remove)
+        team.completed_tasks = {difficulty: {} for difficulty in get_catalog().difficulties}
+        team.completed_at = {}
+        team.completed_wave = {}
+        team.history.clear_levels()
+        self.task_indexes.invalidate(team.key)
+        self._record_team(team)
+        return points_to_remove
+
+    # Catalog
+
+    def catalog_conflicts(self, catalog):
+        """Progress the game has recorded that the catalog no longer has room for."""
+        conflicts = []
+        for team in self.teams.values():
+            for difficulty, tasks in team.completed_tasks.items():
+                for task_id, task_levels in tasks.items():
+                    if difficulty == "boss":
+                        levels = (catalog.boss[int(task_id)],) if int(task_id) in catalog.boss else None
+                    else:
+                        levels = catalog.families.get(difficulty, {}).get(int(task_id))
+                    # The highest level completed, not the list length: lists in saves from before the
+                    # catalog file were sized by the difficulty's family count
+                    completed_levels = next_level(task_levels)
+                    if levels is None:
+                        conflicts.append(f"{team.key} has completed {difficulty} family {task_id}, which is missing")
+                    elif len(levels) < completed_levels:
+                        conflicts.append(f"{team.key} has completed level {completed_levels} of {difficulty} family "
+                                         f"{task_id}, the catalog only has {len(levels)}")
+            for task in team.wave.tasks:
+                if task.is_boss:
+                    if task.task_id not in catalog.boss:
+                        conflicts.append(f"{team.key} is on boss task {task.task_id}, which is missing")
+                elif len(catalog.families.get(task.difficulty, {}).get(task.task_id, ())) <= task.level:
+                    conflicts.append(f"{team.key} is on {task.difficulty} family {task.task_id} "
+                                     f"level {task.level + 1}, which is missing")
+        return conflicts
+
+    def reload_catalog(self, catalog):
+        """
+        Swap in a new catalog. Refused (GameError) if teams have progress it can't describe;
+        tasks already on offer keep the wording they were drawn with.
+        """
+        conflicts = self.catalog_conflicts(catalog)
+        if conflicts:
+            more = f"\n...and {len(conflicts) - 5} more" if len(conflicts) > 5 else ""
+            raise GameError("The new catalog doesn't fit the game in progress:\n" + "\n".join(conflicts[:5]) + more)
+        set_catalog(catalog)
+        self.task_indexes.invalidate()
+        for team in self.teams.values():
+            team.history.rebuild(team.members, team.completed_tasks, team.completed_at, team.completed_wave)
+        self._changed(*self.teams.values())
+
+    # Queries
+
+    def team_summaries(self):
+        """(team_key, custom_name, wave, points, gp) for every team, in team order."""
+        return [(key, team.custom_name, team.wave.number, team.points, team.gp) for key, team in self.teams.items()]
+
+    def completed_levels(self, team_key, member=None):
+        """(difficulty, task_id, level, completed_by) for a team's completed task levels."""
+        if member is not None:
+            # In the order they were completed, from the member's own index
+            return [(level.difficulty, level.task_id, level.level, member)
+                    for level in self.teams[team_key].history.levels(member)]
+        rows = []
+        for difficulty, tasks in self.teams[team_key].completed_tasks.items():
+            for task_id, task_levels in tasks.items():
+                for level_index, completed_by in enumerate(task_levels):
+                    if completed_by:
+                        rows.append((difficulty, task_id, level_index, completed_by))
+        return rows
@@ -0,0 +1,161 @@
+"""
+Streaming export of a game's results for analysis after an event.
+
+Rows are generated one team at a time and written as CSV or JSON lines through gzip, so
+memory use doesn't grow with the size of the history being exported. !export sends the
+files as attachments; offline, the saved game can be exported without the bot:
+
+    python export.py completions --format jsonl --save-file game_state.snap --journal-file game_state.journal
+    python export.py teams --backend sqlite --sqlite-file game_state.db --season default
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+# What each export has a row per, and its columns
+COLUMNS = {
+    "teams": ("team", "name", "wave", "points", "gp", "members", "completions", "purchases"),
+    "members": ("team", "member", "points", "completions"),
+    "completions": ("team", "member", "wave", "difficulty", "task_id", "level", "points", "completed_at"),
+}
+
+KINDS = tuple(COLUMNS)
+
+FORMATS = ("csv", "jsonl")
+
+
+def team_rows(team):
+    yield {
+        "team": team.key,
+        "name": team.custom_name or "",
+        "wave": team.wave.number,
+        "points": team.points,
+        "gp": team.gp,
+        "members": len(team.members),
+        "completions": sum(1 for _ in team.history.completions()),
+        "purchases": "; ".join(team.purchases),
+    }
+
+
+def member_rows(team):
+    for member_name, points in team.members.items():
+        yield {"team": team.key, "member": member_name, "points": points,
+               "completions": len(team.history.levels(member_name))}
+
+
+def completion_rows(team):
+    # Completions saved before their wave was recorded only have one if they are in the wave the team is on
+    current_wave = {(task.difficulty, task.task_id, task.level) for task in team.wave.tasks if task.completed}
+    for member_name, level in team.history.completions():
+        wave = level.completed_wave
+        if wave is None and (level.difficulty, level.task_id, level.level) in current_wave:
+            wave = team.wave.number
+        yield {
+            "team": team.key,
+            "member": member_name,
+            "wave": wave if wave is not None else "",
+            "difficulty": level.difficulty,
+            "task_id": level.task_id,
+            "level": level.level + 1,
+            "points": level.points,
+            "completed_at": level.completed_at or "",
+        }
+
+
+ROWS = {"teams": team_rows, "members": member_rows, "completions": completion_rows}
+
+
+class ExportWriter:
+    """Writes rows of one kind as gzip-compressed CSV or JSON lines to a binary file object."""
+
+    def __init__(self, file, kind, fmt="csv"):
+        if kind not in COLUMNS:
+            raise ValueError(f"Unknown export {kind!r}; choose from {', '.join(KINDS)}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}; choose from {', '.join(FORMATS)}")
+        self.fmt = fmt
+        self.rows = 0
+        self._gzip = gzip.GzipFile(fileobj=file, mode='wb', mtime=0)
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8', newline='')
+        if fmt == "csv":
+            self._csv = csv.DictWriter(self._text, COLUMNS[kind])
+            self._csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == "csv":
+                self._csv.writerow(row)
+            else:
+                self._text.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.rows += 1
+
+    def close(self):
+        """Finish the gzip stream; the file object itself is left open."""
+        self._text.flush()
+        self._text.detach()
+        self._gzip.close()
+
+
+def export(teams, kind, fmt, file):
+    """Write every team's rows of one kind to file; returns the number of rows."""
+    writer = ExportWriter(file, kind, fmt)
+    for team in teams:
+        writer.write(ROWS[kind](team))
+    writer.close()
+    return writer.rows
+
+
+async def export_async(teams, kind, fmt, file, chunk_rows=1000):
+    """
+    export() for a game that is being played: rows are generated on the event loop a team at a
+    time and written in chunks by a worker thread, so neither the game nor the loop is held up.
+    Each team's rows are consistent; teams that change while the export runs may not be.
+    """
+    writer = await asyncio.to_thread(ExportWriter, file, kind, fmt)
+    chunk = []
+    for team in list(teams):
+        chunk.extend(ROWS[kind](team))
+        if len(chunk) >= chunk_rows:
+            await asyncio.to_thread(writer.write, chunk)
+            chunk = []
+    await asyncio.to_thread(writer.write, chunk)
+    await asyncio.to_thread(writer.close)
+    return writer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a saved game's results as gzip-compressed CSV or JSON lines.")
+    parser.add_argument("kind", choices=KINDS + ("all",))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--save-file", default="game_state.snap", help="snapshot (or old JSON save) of the json backend")
+    parser.add_argument("--journal-file", default="game_state.journal")
+    parser.add_argument("--sqlite-file", default="game_state.db")
+    parser.add_argument("--season", default="default")
+    parser.add_argument("--catalog", help="catalog file the game was played with (default: the bundled one)")
+    parser.add_argument("--output-prefix", default="", help="written to <prefix><kind>.<format>.gz")
+    args = parser.parse_args()
+
+    from catalog import load_catalog, set_catalog
+    from engine import GameEngine
+    from storage import open_storage
+
+    if args.catalog:
+        set_catalog(load_catalog(args.catalog))
+    engine = GameEngine()
+    # Read-only: the storage is never saved or closed, so the game's files are left as they are
+    storage = open_storage(args.backend, engine.snapshot, args.save_file, args.journal_file, args.sqlite_file, args.season)
+    engine.load(*storage.load())
+
+    for kind in KINDS if args.kind == "all" else (args.kind,):
+        path = f"{args.output_prefix}{kind}.{args.format}.gz"
+        with open(path, 'wb') as file:
+            rows = export(engine.teams.values(), kind, args.format, file)
+        print(f"{path}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Every game the bot is running, keyed by (guild ID, game ID).
+
+A guild plays its "default" game unless a channel has been bound to another one, so one
+process can host several events at once. A game is loaded from its storage the first time a
+command needs it, and written out and dropped from memory once it has been idle for a while.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+from catalog import set_catalog
+from engine import GameEngine, GameError
+from persistence import write_atomic
+from render import RenderCache
+
+# The game a guild plays in channels that aren't bound to another one
+DEFAULT_GAME = "default"
+
+# Game IDs end up in file names, SQLite seasons and button custom_ids
+GAME_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+# The channels a game can have, as GAME_CHAT_ID, GAME_CHANNEL_ID and ANNOUNCEMENTS_ID did for the one game
+CHANNEL_ROLES = ("chat", "channel", "announcements")
+
+
+class Game:
+    """
+    One game: its engine, the storage it is saved to, read queries and rendered views.
+    `open_storage(key, snapshot)` opens the game's storage for the engine's snapshot method,
+    and `open_backups(key)` its BackupStore, if it has one.
+    """
+
+    def __init__(self, key, open_storage, storage_reads=False, open_backups=None):
+        self.key = key
+        self.engine = GameEngine(record=self._record, checkpoint=self._checkpoint, record_many=self._record_many)
+        self.storage = open_storage(key, self.engine.snapshot)
+        # Leaderboard and history queries; SQLite answers them with indexed queries
+        self.reads = self.storage if storage_reads else self.engine
+        self.render_cache = RenderCache(self.engine)
+        self.backups = open_backups(key) if open_backups else None
+        self.backed_up_version = None
+        self.last_used = time.monotonic()
+
+    @property
+    def guild_id(self):
+        return self.key[0]
+
+    @property
+    def game_id(self):
+        return self.key[1]
+
+    def _record(self, event_type, team_key, **data):
+        """Record one game event instead of rewriting the whole save."""
+        self.storage.record(event_type, team_key, **data)
+
+    def _record_many(self, events):
+        self.storage.record_many(events)
+
+    def _checkpoint(self):
+        self.storage.checkpoint()
+
+    def load(self):
+        self.engine.load(*self.storage.load())
+
+    def close(self):
+        """Write out anything still pending."""
+        self.storage.close()
+
+    async def backup(self, reason):
+        """Add a restore point unless nothing changed since the last one; returns it, or None."""
+        if self.backups is None:
+            return None
+        version = self.engine.version
+        # The snapshot is taken on the event loop; hashing and writing it happen in a worker thread
+        point = await asyncio.to_thread(self.backups.save, self.engine.snapshot(), reason)
+        self.backed_up_version = version
+        return point
+
+    async def restore(self, point_id):
+        """
+        Roll the game back to a restore point, after backing up the game as it is now; returns
+        that backup (None if it matched the latest restore point). Raises KeyError for an unknown restore point and GameError if the game can't take it.
+        """
+        if self.backups is None:
+            raise GameError("Backups are turned off.")
+        data = await asyncio.to_thread(self.backups.load, point_id)
+        # Build the restored teams once off the event loop, so a restore point that doesn't fit
+        # the current catalog fails here instead of half way through replacing the game
+        try:
+            await asyncio.to_thread(GameEngine().load, data["game_state"], data)
+        except KeyError as e:
+            raise GameError(f"Restore point #{point_id} uses task {e} that is not in the current catalog.") from e
+        before = await self.backup(f"before restoring #{point_id}")
+        if self.engine.busy:
+            raise GameError("A command is still changing this game; try again in a moment.")
+        self.engine.load(data["game_state"], data)
+        # Written now, with a fresh journal: the journal on disk holds the events of the game being replaced
+        self.engine.checkpoint()
+        self.render_cache.clear()
+        return before
+
+
+class GameManager:
+    """
+    The loaded games, and which game each channel plays.
+
+    Channel bindings are small and kept in `config_file` as {guild_id: {game_id: {role: channel_id}}};
+    games themselves are opened with `open_storage` (see Game) and loaded on first use.
+    """
+
+    def __init__(self, open_storage, config_file=None, storage_reads=False, idle_seconds=1800.0, open_backups=None):
+        self.open_storage = open_storage
+        self.config_file = config_file
+        self.storage_reads = storage_reads
+        self.idle_seconds = idle_seconds
+        self.open_backups = open_backups
+        self._games = {}
+        self._loading = {}
+        self._closing = {}
+        # Every game loaded since the bot started, evicted or not
+        self._known = set()
+        self._config = {}  # guild_id -> {game_id: {role: channel_id}}
+        self._channels = {}  # (guild_id, channel_id) -> game_id
+
+        # Counters for diagnostics
+        self.loads = 0
+        self.evictions = 0
+
+        if config_file and os.path.exists(config_file):
+            with open(config_file, 'r') as file:
+                for guild_id, guild_games in json.load(file).items():
+                    for game_id, channels in guild_games.items():
+                        for role, channel_id in channels.items():
+                            self._bind(int(guild_id), game_id, int(channel_id), role)
+
+    def __len__(self):
+        return len(self._games)
+
+    def loaded_games(self):
+        return list(self._games.values())
+
+    # Channel configuration
+
+    def game_id_for(self, guild_id, channel_id):
+        return self._channels.get((guild_id, channel_id), DEFAULT_GAME)
+
+    def channels(self, guild_id, game_id):
+        """{role: channel_id} for the channels bound to a game."""
+        return dict(self._config.get(guild_id, {}).get(game_id, {}))
+
+    def games_in(self, guild_id):
+        """The IDs of a guild's games: the default one and every game with channels."""
+        return sorted(set(self._config.get(guild_id, {})) | {DEFAULT_GAME})
+
+    def bind(self, guild_id, game_id, channel_id, role="chat"):
+        """Make a channel one of a game's channels; commands used there play that game."""
+        if not GAME_ID_PATTERN.fullmatch(game_id):
+            raise ValueError("Game IDs are 1-32 letters, digits, '-' or '_'.")
+        if role not in CHANNEL_ROLES:
+            raise ValueError(f"The channel role must be one of {', '.join(CHANNEL_ROLES)}.")
+        # A channel plays one game, so it leaves whatever game it belonged to
+        for channels in self._config.get(guild_id, {}).values():
+            for other_role, other_channel in list(channels.items()):
+                if other_channel == channel_id:
+                    del channels[other_role]
+        self._bind(guild_id, game_id, channel_id, role)
+        self._save_config()
+
+    def _bind(self, guild_id, game_id, channel_id, role):
+        channels = self._config.setdefault(guild_id, {}).setdefault(game_id, {})
+        old_channel = channels.get(role)
+        if old_channel is not None and self._channels.get((guild_id, old_channel)) == game_id:
+            del self._channels[(guild_id, old_channel)]
+        channels[role] = channel_id
+        self._channels[(guild_id, channel_id)] = game_id
+
+    def _save_config(self):
+        if self.config_file:
+            data = {str(guild_id): guild_games for guild_id, guild_games in self._config.items()}
+            write_atomic(self.config_file, json.dumps(data, indent=2).encode('utf-8'))
+
+    async def reload_catalog(self, catalog):
+        """
+        Swap in a new catalog for every game, or for none if any of them can't take it. Games
+        that were evicted, or have channels but aren't loaded, are loaded to be checked too:
+        once the catalog has dropped tasks a game uses, that game can't be loaded any more.
+        """
+        keys = list(self._known | set(self._games) | {
+            (guild_id, game_id) for guild_id, guild_games in self._config.items() for game_id in guild_games})
+        loaded = await asyncio.gather(*(self.get_game(*key) for key in keys), return_exceptions=True)
+        conflicts = []
+        for (_, game_id), game in zip(keys, loaded):
+            if isinstance(game, Exception):
+                conflicts.append(f"{game_id}: could not be loaded to check it ({game})")
+            else:
+                conflicts += [f"{game_id}: {conflict}" for conflict in game.engine.catalog_conflicts(catalog)]
+        if conflicts:
+            more = f"\n...and {len(conflicts) - 5} more" if len(conflicts) > 5 else ""
+            raise GameError("The new catalog doesn't fit the games in progress:\n" + "\n".join(conflicts[:5]) + more)
+        set_catalog(catalog)
+        for game in self._games.values():
+            game.engine.reload_catalog(catalog)
+
+    # Loading and eviction
+
+    def loaded(self, guild_id, channel_id):
+        """The game played in a channel if it is in memory, else None. Never loads anything."""
+        game = self._games.get((guild_id, self.game_id_for(guild_id, channel_id)))
+        if game is not None:
+            game.last_used = time.monotonic()
+        return game
+
+    async def get(self, guild_id, channel_id):
+        """The game played in a channel, loading it first if needed."""
+        return await self.get_game(guild_id, self.game_id_for(guild_id, channel_id))
+
+    async def get_game(self, guild_id, game_id):
+        key = (guild_id, game_id)
+        game = self._games.get(key)
+        if game is None:
+            # Commands that arrive while the game is loading wait for the same load
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = asyncio.ensure_future(self._load(key))
+                loading.add_done_callback(lambda _: self._loading.pop(key, None))
+            game = await asyncio.shield(loading)
+        game.last_used = time.monotonic()
+        return game
+
+    async def load_configured(self):
+        """
+        Load every game that has channels bound to it, at startup, so the first commands after
+        a restart don't wait for a load. Returns their keys.
+        """
+        keys = [(guild_id, game_id) for guild_id, guild_games in self._config.items() for game_id in guild_games]
+        await asyncio.gather(*(self.get_game(*key) for key in keys))
+        return keys
+
+    async def _load(self, key):
+        closing = self._closing.get(key)
+        if closing is not None:
+            # Evicted a moment ago: load what it is writing, not what was on disk before
+            await asyncio.shield(closing)
+        start = time.perf_counter()
+        # Reading and replaying the save happens off the event loop; nothing else can see the game yet
+        game = await asyncio.to_thread(self._open, key)
+        self._games[key] = game
+        self._known.add(key)
+        self.loads += 1
+        logging.info(f"Loaded game {key} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return game
+
+    def _open(self, key):
+        game = Game(key, self.open_storage, self.storage_reads, self.open_backups)
+        game.load()
+        return game
+
+    async def evict_idle(self):
+        """Write out and forget games nobody has used for idle_seconds. Returns their keys."""
+        now = time.monotonic()
+        evicted = []
+        for key, game in list(self._games.items()):
+            if now - game.last_used < self.idle_seconds or game.engine.busy:
+                continue
+            # Gone from the table first, so a command arriving now loads it again from what we write
+            del self._games[key]
+            closing = self._closing[key] = asyncio.ensure_future(asyncio.to_thread(game.close))
+            try:
+                await closing
+            finally:
+                del self._closing[key]
+            evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
+
+    async def evict_forever(self, interval=60.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.evict_idle()
+                if evicted:
+                    logging.info(f"Evicted idle games: {evicted}")
+            except Exception as e:
+                logging.error(f"Error evicting idle games: {e}")
+
+    async def backup_changed(self, reason="scheduled"):
+        """Add a restore point to every loaded game that changed since its last one. Returns their keys."""
+        backed_up = []
+        for key, game in list(self._games.items()):
+            if game.engine.version != game.backed_up_version and await game.backup(reason):
+                backed_up.append(key)
+        return backed_up
+
+    async def backup_forever(self, interval=300.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                backed_up = await self.backup_changed()
+                if backed_up:
+                    logging.info(f"Backed up games: {backed_up}")
+            except Exception as e:
+                logging.error(f"Error backing up games: {e}")
+
+    def close(self):
+        """Write out every loaded game, on shutdown."""
+        for game in self._games.values():
+            game.close()
+        self._games.clear()
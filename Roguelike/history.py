@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from prefix import PrefixIndex
+from tasks import task_details
+
+
+@dataclass(slots=True)
+class CompletedLevel:
+    difficulty: str
+    task_id: int
+    level: int
+    points: int
+    completed_at: Optional[str] = None  # ISO timestamp; None for completions saved before timestamps were kept
+    completed_wave: Optional[int] = None  # None for completions saved before waves were kept
+
+
+class MemberHistory:
+    """
+    One team's completed task levels by member, so a member's history costs as much as its
+    length rather than a walk over the team's whole completed_tasks. Also resolves typed
+    member names: an exact match first, then any case, then a unique prefix.
+    """
+
+    def __init__(self):
+        self._levels = {}  # member -> {(difficulty, task_id, level): CompletedLevel}
+        self._names = PrefixIndex()
+
+    def rebuild(self, members, completed_tasks, completed_at, completed_wave):
+        self._levels = {}
+        self._names.clear()
+        for member_name in members:
+            self.add_member(member_name)
+        completions = []
+        for difficulty, tasks in completed_tasks.items():
+            for task_id, task_levels in tasks.items():
+                timestamps = completed_at.get(difficulty, {}).get(task_id) or []
+                waves = completed_wave.get(difficulty, {}).get(task_id) or []
+                for level, member_name in enumerate(task_levels):
+                    if member_name:
+                        timestamp = timestamps[level] if level < len(timestamps) else None
+                        wave = waves[level] if level < len(waves) else None
+                        completions.append((timestamp or "", member_name, difficulty, task_id, level, timestamp, wave))
+        completions.sort(key=lambda completion: completion[0])
+        for _, member_name, difficulty, task_id, level, timestamp, wave in completions:
+            self.record(member_name, difficulty, task_id, level, timestamp, wave)
+
+    def add_member(self, member_name):
+        if member_name not in self._levels:
+            self._levels[member_name] = {}
+            self._names.add(member_name)
+
+    def record(self, member_name, difficulty, task_id, level, completed_at=None, completed_wave=None):
+        self.add_member(member_name)
+        points = task_details(difficulty, task_id, level)["points"]
+        self._levels[member_name][(difficulty, task_id, level)] = CompletedLevel(
+            difficulty, task_id, level, points, completed_at, completed_wave)
+
+    def clear_levels(self):
+        """Forget every completion but keep the members."""
+        for levels in self._levels.values():
+            levels.clear()
+
+    def levels(self, member_name):
+        """A member's completed levels, in the order they were completed."""
+        return list(self._levels.get(member_name, {}).values())
+
+    def completions(self):
+        """(member, CompletedLevel) for every completion, member by member."""
+        for member_name, levels in self._levels.items():
+            for level in levels.values():
+                yield member_name, level
+
+    def resolve(self, query):
+        """Members matching a typed name: [exact match], else every case-insensitive or prefix match."""
+        if query in self._levels:
+            return [query]
+        folded = query.casefold()
+        matches = []
+        for member_name, _ in self._names.matches(query):
+            if member_name.casefold() == folded:
+                return [member_name]
+            matches.append(member_name)
+        return matches
+
+    def matches(self, prefix, limit=None):
+        """Members whose names start with prefix in any case, at most `limit`."""
+        return [member_name for member_name, _ in self._names.matches(prefix, limit)]
@@ -0,0 +1,99 @@
+from bisect import bisect_left, insort
+
+from prefix import PrefixIndex
+
+
+class Leaderboard:
+    """
+    Players' point totals across all teams, kept sorted as points change.
+
+    Players are grouped by score and the distinct scores are kept in a sorted list, so the top
+    K players come from walking the highest scores (ties stay together) without re-sorting
+    everyone, and a player's rank is one more than the number of players above their score.
+    """
+
+    def __init__(self):
+        self._points = {}
+        self._by_score = {}
+        self._scores = []  # distinct scores, ascending
+        self._names = {}  # lowercase name -> name
+        self._index = PrefixIndex()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, name):
+        return name in self._points
+
+    def clear(self):
+        self._points.clear()
+        self._by_score.clear()
+        self._scores.clear()
+        self._names.clear()
+        self._index.clear()
+
+    def rebuild(self, teams):
+        """Total every team's members; a player on several teams gets the sum."""
+        self.clear()
+        for team in teams:
+            for name, points in team.members.items():
+                self.add(name, points)
+
+    def points(self, name):
+        return self._points.get(name, 0)
+
+    def find(self, name):
+        """The player with this name in any case, or None."""
+        return self._names.get(name.lower())
+
+    def matches(self, prefix, limit=None):
+        """Players whose names start with prefix in any case, at most `limit`."""
+        return [name for name, _ in self._index.matches(prefix, limit)]
+
+    def add(self, name, delta):
+        """Change a player's total by delta (negative to take points back)."""
+        self.set(name, self._points.get(name, 0) + delta)
+
+    def set(self, name, points):
+        old = self._points.get(name)
+        if old == points:
+            return
+        if old is None:
+            self._index.add(name)
+        else:
+            players = self._by_score[old]
+            players.discard(name)
+            if not players:
+                del self._by_score[old]
+                del self._scores[bisect_left(self._scores, old)]
+        self._points[name] = points
+        self._names[name.lower()] = name
+        if points not in self._by_score:
+            self._by_score[points] = set()
+            insort(self._scores, points)
+        self._by_score[points].add(name)
+
+    def top(self, count):
+        """
+        Groups of tied players, best first, as (rank, points, names), until at least `count`
+        players with points are listed. The last group is never cut off part way.
+        """
+        groups = []
+        listed = 0
+        for points in reversed(self._scores):
+            if listed >= count or points <= 0:
+                break
+            names = sorted(self._by_score[points], key=str.lower)
+            groups.append((listed + 1, points, names))
+            listed += len(names)
+        return groups
+
+    def rank(self, name):
+        """(rank, points) of a player; players with the same points share a rank."""
+        points = self._points[name]
+        above = sum(len(self._by_score[score]) for score in self._scores[bisect_left(self._scores, points) + 1:])
+        return above + 1, points
+
+    def ties(self, name):
+        """How many other players have exactly this player's points."""
+        return len(self._by_score[self._points[name]]) - 1
@@ -0,0 +1,443 @@
+"""
+Headless load test for the bot's game logic.
+
+Drives the real command callbacks from Bot.py (complete, progress, use, ...) and
+generate_tasks against thousands of synthetic teams and members, spread over one or more
+games, with a local stand-in for Discord: sends are counted (optionally with a simulated
+round trip) instead of going to a server. Runs in a temporary directory so it never touches
+a real game_state.json.
+
+    python loadtest.py --games 4 --teams 500 --members 5 --ops 20000 --concurrency 50 \
+        --mix complete=50,progress=10,use=5,generate=10,current=15,points=10
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+DEFAULT_MIX = "complete=50,progress=10,use=5,generate=10,current=15,points=10"
+OPERATIONS = ("complete", "progress", "use", "generate", "current", "points", "current_all", "points_all", "mvp", "rank", "completed", "autocomplete", "complete_bulk")
+
+# The guild every game of the load test is played in; game N is played in channel N
+LOADTEST_GUILD_ID = 1
+
+# The author of the command running in the current worker task, and the buttons last sent to it
+current_author = contextvars.ContextVar("current_author")
+current_view = contextvars.ContextVar("current_view")
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakePermissions:
+    administrator = True
+
+
+class DiscordStandIn:
+    """Collects everything the bot would have sent."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self.characters = 0
+
+    async def send(self, content=None, **kwargs):
+        self.messages += 1
+        self.characters += len(content or "")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeMember:
+    def __init__(self, name, sink, member_id=0):
+        self.id = member_id
+        self.name = name
+        self.global_name = None
+        self.nick = None
+        self.display_name = name
+        self.mention = f"@{name}"
+        self.roles = [FakeRole("Team Captain")]
+        self.guild_permissions = FakePermissions()
+        self._sink = sink
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, **kwargs):
+        await self._sink.send(content, **kwargs)
+
+
+class FakeGuild:
+    """The load test's guild; its members are whoever the test has made up so far."""
+
+    def __init__(self, sink):
+        self.id = LOADTEST_GUILD_ID
+        self.chunked = True
+        self._sink = sink
+        self._members = {}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def member(self, name, index=None):
+        """The member with this name, joining the guild (and member_index) if they are new."""
+        if name not in self._members:
+            member = self._members[name] = FakeMember(name, self._sink, member_id=10 ** 17 + len(self._members))
+            if index is not None:
+                index.add(self, member)
+        return self._members[name]
+
+
+class FakeMessage:
+    def __init__(self, channel_id=0):
+        self.id = 0
+        self.channel = argparse.Namespace(id=channel_id)
+
+
+class FakeContext:
+    def __init__(self, author, sink, game, guild=None):
+        self.author = author
+        self.guild = guild
+        self.message = argparse.Namespace(attachments=[])
+        # Commands are invoked as prefix commands
+        self.interaction = None
+        # What the bot's before_invoke hook attaches; the load test calls command callbacks directly
+        self.game = game
+        self._sink = sink
+
+    async def send(self, content=None, view=None, **kwargs):
+        if view is not None:
+            current_view.set(view)
+        await self._sink.send(content, **kwargs)
+        return FakeMessage()
+
+
+class FakeResponse:
+    def __init__(self, sink):
+        self._sink = sink
+
+    async def send_message(self, content=None, **kwargs):
+        await self._sink.send(content, **kwargs)
+
+    async def edit_message(self, content=None, view=None, **kwargs):
+        current_view.set(view)
+        await self._sink.send(content, **kwargs)
+
+
+class FakeInteraction:
+    """A button click or slash command keystroke by the current author."""
+
+    def __init__(self, author, sink, channel_id, **options):
+        self.user = author
+        self.guild_id = LOADTEST_GUILD_ID
+        self.channel_id = channel_id
+        self.response = FakeResponse(sink)
+        self.message = FakeMessage(channel_id)
+        self.followup = sink
+        self.namespace = argparse.Namespace(**options)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r} in --mix; choose from {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Timer:
+    """Wraps a function and accumulates how long calls to it take."""
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.calls += 1
+
+
+class LoadTest:
+    def __init__(self, bot_module, args):
+        self.Bot = bot_module
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.sink = DiscordStandIn(args.send_latency / 1000)
+        self.guild = FakeGuild(self.sink)
+        self.admin = self.guild.member("loadtest-admin")
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.first_errors = {}
+        self.team_members = {}  # (channel, team_key) -> member names
+        self.games = {}  # channel -> game
+        self.checkpoint_timers = []
+        self.record_timers = []
+
+        if not args.pace:
+            # The stand-in has no rate limits to respect
+            bot_module.outbox.per = 0
+        # Imported alongside Bot, once main() has put this directory on sys.path
+        from tasks import generate_tasks
+        self.generate_tasks = generate_tasks
+
+    async def click(self, channel_id, custom_id_suffix=None, index=None):
+        """Press a button on the last view sent to this worker, by custom_id ending or position."""
+        view = current_view.get(None)
+        if view is None:
+            return False
+        buttons = view.children
+        if custom_id_suffix is not None:
+            buttons = [b for b in buttons if b.custom_id.endswith(custom_id_suffix)]
+        elif index is not None:
+            buttons = buttons[index:index + 1]
+        if not buttons:
+            return False
+        await buttons[0].callback(FakeInteraction(current_author.get(), self.sink, channel_id))
+        return True
+
+    async def autocomplete(self, channel_id, team_key):
+        """Typing `/complete <team> <task> <member>` one character at a time."""
+        Bot = self.Bot
+        member_name = self.rng.choice(self.team_members[(channel_id, team_key)])
+        for end in range(1, len(team_key) + 1):
+            await Bot.team_autocomplete(FakeInteraction(current_author.get(), self.sink, channel_id), team_key[:end])
+        interaction = FakeInteraction(current_author.get(), self.sink, channel_id, team_name=team_key)
+        await Bot.task_autocomplete(interaction, "")
+        for end in range(1, len(member_name) + 1):
+            await Bot.member_autocomplete(interaction, member_name[:end])
+
+    async def progress(self, ctx, channel_id, team_key):
+        """!progress, then the captain's button choices."""
+        current_view.set(None)
+        await self.Bot.progress.callback(ctx, team_key)
+        if self.rng.random() < self.args.shop_rate:
+            if await self.click(channel_id, ":shop"):
+                # One of the offered items, or Cancel (the last button)
+                await self.click(channel_id, index=self.rng.randrange(len(current_view.get().children)))
+        else:
+            await self.click(channel_id, ":next")
+
+    def context(self, game, name=None):
+        author = self.guild.member(name, self.Bot.member_index) if name else self.admin
+        current_author.set(author)
+        return FakeContext(author, self.sink, game, self.guild)
+
+    async def setup(self):
+        Bot = self.Bot
+        for channel_id in range(1, self.args.games + 1):
+            game_id = Bot.DEFAULT_GAME if channel_id == 1 else f"game{channel_id}"
+            if game_id != Bot.DEFAULT_GAME:
+                Bot.games.bind(LOADTEST_GUILD_ID, game_id, channel_id)
+            game = self.games[channel_id] = await Bot.games.get(LOADTEST_GUILD_ID, channel_id)
+            engine = game.engine
+            engine.checkpoint = Timer(engine.checkpoint)
+            engine.record = Timer(engine.record)
+            self.checkpoint_timers.append(engine.checkpoint)
+            self.record_timers.append(engine.record)
+
+            await Bot.set_teams.callback(self.context(game), self.args.teams)
+            for team_key in list(engine.teams):
+                members = [self.guild.member(f"{team_key}-member{i}", Bot.member_index) for i in range(self.args.members)]
+                self.team_members[(channel_id, team_key)] = [m.name for m in members]
+                await Bot.assign_members.callback(self.context(game), team_key, *(m.name for m in members))
+            await Bot.start.callback(self.context(game))
+
+    async def run_op(self, op):
+        Bot = self.Bot
+        channel_id, team_key = self.rng.choice(self.team_members_keys)
+        game = self.games[channel_id]
+        team = game.engine.teams[team_key]
+        members = self.team_members[(channel_id, team_key)]
+        ctx = self.context(game, f"captain-{team_key}")
+
+        if op == "complete":
+            open_tasks = [i for i, task in enumerate(team.wave.tasks, 1) if not task.completed]
+            task_number = self.rng.choice(open_tasks) if open_tasks else 1
+            coro = Bot.complete.callback(ctx, team_key, task_number, self.rng.choice(members))
+        elif op == "progress":
+            coro = self.progress(ctx, channel_id, team_key)
+        elif op == "use":
+            if not team.purchases:
+                team.purchases.append(self.rng.choice(["RickRolling Stew", "Monkey's Paw", "DoubleDipping Brew", "GP"]))
+            open_tasks = [i for i, task in enumerate(team.wave.tasks, 1) if not task.completed]
+            coro = Bot.use.callback(ctx, team_key, 1, self.rng.choice(open_tasks) if open_tasks else None)
+        elif op == "generate":
+            coro = None
+        elif op == "current":
+            coro = Bot.current.callback(ctx, team_key)
+        elif op == "complete_bulk":
+            # A judge's batch: a few entries for this channel's teams, some of them doomed
+            entries = []
+            for _ in range(self.args.bulk_size):
+                key = self.rng.choice([k for c, k in self.team_members_keys if c == channel_id])
+                entries.append(f"{key}, {self.rng.randint(1, 4)}, {self.rng.choice(self.team_members[(channel_id, key)])}")
+            coro = Bot.complete_bulk.callback(ctx, entries="\n".join(entries))
+        elif op == "points":
+            coro = Bot.points.callback(ctx, team_key)
+        elif op == "current_all":
+            coro = Bot.current.callback(ctx)
+        elif op == "points_all":
+            coro = Bot.points.callback(ctx)
+        elif op == "mvp":
+            coro = Bot.mvp.callback(ctx)
+        elif op == "rank":
+            coro = Bot.rank.callback(ctx, member=self.rng.choice(members))
+        elif op == "autocomplete":
+            coro = self.autocomplete(channel_id, team_key)
+        else:
+            coro = Bot.completed.callback(ctx, team_key)
+
+        start = time.perf_counter()
+        try:
+            if coro is None:
+                self.generate_tasks(team.wave.number, game.engine.task_indexes.get(team_key, team.completed_tasks), self.rng)
+            else:
+                await coro
+        except Exception as e:
+            self.errors[op] += 1
+            self.first_errors.setdefault(op, repr(e))
+        self.latencies[op].append(time.perf_counter() - start)
+
+    async def worker(self, queue):
+        while True:
+            try:
+                op = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self.run_op(op)
+
+    async def run(self):
+        args = self.args
+        mix = parse_mix(args.mix)
+        ops = self.rng.choices(list(mix), weights=list(mix.values()), k=args.ops)
+
+        setup_start = time.perf_counter()
+        await self.setup()
+        self.setup_seconds = time.perf_counter() - setup_start
+        self.team_members_keys = list(self.team_members)
+
+        queue = asyncio.Queue()
+        for op in ops:
+            queue.put_nowait(op)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self.worker(queue) for _ in range(args.concurrency)))
+        self.run_seconds = time.perf_counter() - start
+
+        flush_start = time.perf_counter()
+        self.Bot.games.close()
+        self.flush_seconds = time.perf_counter() - flush_start
+
+    def report(self):
+        args = self.args
+        total = sum(len(v) for v in self.latencies.values())
+        lines = [
+            f"Games: {args.games}  Teams/game: {args.teams}  Members/team: {args.members}  Ops: {total}  Concurrency: {args.concurrency}  "
+            f"Storage: {self.Bot.STORAGE_BACKEND}",
+            f"Setup (set_teams + assign_members + start): {self.setup_seconds:.2f}s",
+            f"Run: {self.run_seconds:.2f}s  Throughput: {total / self.run_seconds if self.run_seconds else 0:.0f} ops/sec",
+            "",
+            f"{'command':<12} {'count':>7} {'errors':>6} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}",
+        ]
+        for op in OPERATIONS:
+            values = sorted(self.latencies.get(op, []))
+            if not values:
+                continue
+            mean = sum(values) / len(values)
+            lines.append(
+                f"{op:<12} {len(values):>7} {self.errors[op]:>6} {mean * 1000:>8.3f} "
+                f"{percentile(values, 50) * 1000:>8.3f} {percentile(values, 95) * 1000:>8.3f} {percentile(values, 99) * 1000:>8.3f}"
+            )
+        for op, error in self.first_errors.items():
+            lines.append(f"  first {op} error: {error}")
+        lines += [
+            "",
+            f"engine.checkpoint: {sum(t.calls for t in self.checkpoint_timers)} calls, "
+            f"{sum(t.seconds for t in self.checkpoint_timers) * 1000:.1f} ms on the event loop",
+            f"engine.record:     {sum(t.calls for t in self.record_timers)} calls, "
+            f"{sum(t.seconds for t in self.record_timers) * 1000:.1f} ms on the event loop",
+        ]
+        persisters = [game.storage.persister for game in self.games.values() if hasattr(game.storage, "persister")]
+        if persisters:
+            lines.append(
+                f"snapshot writes: {sum(p.saves for p in persisters)} writes, "
+                f"{sum(p.save_seconds for p in persisters) * 1000:.1f} ms total, "
+                f"{sum(p.bytes_written for p in persisters) / 1024:.0f} KiB written"
+            )
+        caches = [game.render_cache for game in self.games.values()]
+        lines += [
+            f"render cache:    {sum(c.hits for c in caches)} hits, {sum(c.misses for c in caches)} misses",
+            f"outbox:          {self.Bot.outbox.messages} packed messages, {self.Bot.outbox.wait_seconds:.1f}s waiting on rate limits",
+            f"final flush:     {self.flush_seconds * 1000:.1f} ms",
+            f"Discord stand-in: {self.sink.messages} messages, {self.sink.characters} characters",
+        ]
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=1, help="games played at once, each in its own channel")
+    parser.add_argument("--teams", type=int, default=500, help="teams per game")
+    parser.add_argument("--members", type=int, default=5, help="members per team")
+    parser.add_argument("--ops", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--bulk-size", type=int, default=20, help="entries per complete_bulk operation")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted operations, from: {', '.join(OPERATIONS)}")
+    parser.add_argument("--shop-rate", type=float, default=0.3, help="fraction of progress calls that visit the shop")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="simulated ms per Discord send")
+    parser.add_argument("--pace", action="store_true", help="pace packed replies to Discord's per-channel rate limit")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--save-delay", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--show-output", action="store_true", help="don't silence the commands' print() output")
+    args = parser.parse_args(argv)
+
+    # Bot.py reads its config from the environment at import time
+    os.environ.setdefault("DISCORD_BOT_TOKEN", "loadtest")
+    for name in ("GAME_CHAT_ID", "GAME_CHANNEL_ID", "ANNOUNCEMENTS_ID"):
+        os.environ.setdefault(name, "0")
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ["SAVE_DELAY"] = str(args.save_delay)
+    os.environ["GAME_SEED"] = str(args.seed)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix="roguelike-loadtest-")
+    os.chdir(workdir)
+
+    import Bot
+
+    load_test = LoadTest(Bot, args)
+    with contextlib.ExitStack() as stack:
+        if not args.show_output:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        asyncio.run(load_test.run())
+    print(load_test.report())
+    print(f"\nState written to {workdir}")
+
+
+if __name__ == "__main__":
+    main()
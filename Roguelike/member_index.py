@@ -0,0 +1,98 @@
+import re
+
+# <@123>, <@!123> or a bare ID
+_MENTION = re.compile(r"<@!?(\d{15,20})>|(\d{15,20})")
+
+
+class _GuildMembers:
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}  # case-folded username, global name or nickname -> {id: member}
+        # The names each member was indexed under; discord.py updates cached members in place,
+        # so by the time an update event arrives the member object already has its new names
+        self.indexed_names = {}
+        self.complete = False
+
+    def add(self, member):
+        self.remove(member.id)
+        self.by_id[member.id] = member
+        names = self.indexed_names[member.id] = {name.casefold() for name in _names(member)}
+        for name in names:
+            self.by_name.setdefault(name, {})[member.id] = member
+
+    def remove(self, member_id):
+        self.by_id.pop(member_id, None)
+        for name in self.indexed_names.pop(member_id, ()):
+            members = self.by_name.get(name)
+            if members is not None:
+                members.pop(member_id, None)
+                if not members:
+                    del self.by_name[name]
+
+
+def _names(member):
+    return {name for name in (member.name, getattr(member, "global_name", None), member.nick) if name}
+
+
+class MemberIndex:
+    """
+    Each guild's members by ID, username, global name and nickname, so a typed name finds a
+    member without walking the guild's member list. Built from the guild's member cache the
+    first time the guild is used, then kept current from member join, update and remove events.
+    Members are any objects with `id`, `name`, `nick` and (optionally) `global_name`.
+    """
+
+    def __init__(self):
+        self._guilds = {}
+
+    def _guild(self, guild):
+        index = self._guilds.get(guild.id)
+        # A guild used before its member list finished loading is indexed again once it has
+        if index is None or (not index.complete and getattr(guild, "chunked", True)):
+            index = self._guilds[guild.id] = _GuildMembers()
+            for member in guild.members:
+                index.add(member)
+            index.complete = getattr(guild, "chunked", True)
+        return index
+
+    def add(self, guild, member):
+        """A member joined or changed their nickname."""
+        if guild.id in self._guilds:
+            self._guilds[guild.id].add(member)
+
+    def remove(self, guild, member):
+        if guild.id in self._guilds:
+            self._guilds[guild.id].remove(member.id)
+
+    def update_user(self, user):
+        """A username or global name changed, in every guild the user is in."""
+        for index in self._guilds.values():
+            member = index.by_id.get(user.id)
+            if member is not None:
+                index.add(member)
+
+    def get(self, guild, member_id):
+        return self._guild(guild).by_id.get(member_id)
+
+    def by_username(self, guild, name):
+        """The member with exactly this username, or None."""
+        for member in self._guild(guild).by_name.get(name.casefold(), {}).values():
+            if member.name == name:
+                return member
+        return None
+
+    def resolve(self, guild, query):
+        """
+        Members a typed mention, ID or name could mean: the member with that ID, else the
+        members with exactly that username, global name or nickname, else the same in any case.
+        """
+        index = self._guild(guild)
+        match = _MENTION.fullmatch(query.strip())
+        if match:
+            member = index.by_id.get(int(match.group(1) or match.group(2)))
+            return [member] if member else []
+        candidates = list(index.by_name.get(query.casefold(), {}).values())
+        for exact in ([m for m in candidates if m.name == query], [m for m in candidates if query in _names(m)]):
+            if exact:
+                return exact
+        return candidates
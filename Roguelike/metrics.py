@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for the bot, served in the text exposition format by a small aiohttp
+endpoint. Only the metric types the bot needs are implemented, so nothing is required
+beyond the aiohttp that discord.py already depends on.
+
+Commands are measured from the bot's invoke hooks, Discord API calls from an aiohttp trace,
+and event-loop lag by a heartbeat task; see instrument().
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+# Seconds; fine enough at the bottom for commands that take well under a millisecond
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # Saves are measured in worker threads
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += self._samples()
+        return "\n".join(lines)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.label_names:
+            values = [((), 0)]
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from `function` at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                logging.error(f"Error reading metric {self.name}: {e}")
+                return []
+            return [f"{self.name} {_number(value)}"]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # [count per bucket..., sum]
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _labels(self.label_names, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMANDS = REGISTRY.register(Counter(
+    "roguelike_command_invocations_total", "Commands invoked, by command.", ("command",)))
+COMMAND_ERRORS = REGISTRY.register(Counter(
+    "roguelike_command_errors_total", "Commands that failed (checks, arguments or the command itself).", ("command",)))
+COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "roguelike_command_duration_seconds", "Time from a command's before-invoke hook to its after-invoke hook.", ("command",)))
+
+SAVE_SECONDS = REGISTRY.register(Histogram(
+    "roguelike_save_duration_seconds", "Time to write a full save of a game.", ("backend",)))
+SAVE_BYTES = REGISTRY.register(Counter(
+    "roguelike_save_bytes_written_total", "Bytes written by full saves (JSON snapshots)."))
+
+DISCORD_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "roguelike_discord_request_duration_seconds", "Discord API request latency, including sends, by HTTP method.",
+    ("method",)))
+DISCORD_RATE_LIMITED = REGISTRY.register(Counter(
+    "roguelike_discord_rate_limited_total", "Discord API responses with status 429."))
+
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "roguelike_event_loop_lag_seconds", "How late the event-loop heartbeat woke up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+
+
+# Command lifecycle; called from the bot's before_invoke and after_invoke hooks and listeners
+
+def command_started(ctx):
+    ctx.metrics_started_at = time.perf_counter()
+
+
+def command_finished(ctx):
+    started_at = getattr(ctx, "metrics_started_at", None)
+    if started_at is not None:
+        COMMAND_SECONDS.observe(time.perf_counter() - started_at, command=ctx.command.qualified_name)
+
+
+async def _on_command(ctx):
+    COMMANDS.inc(command=ctx.command.qualified_name)
+
+
+async def _on_command_error(ctx, error):
+    COMMAND_ERRORS.inc(command=ctx.command.qualified_name if ctx.command else "unknown")
+
+
+def discord_trace():
+    """An aiohttp trace for the bot's HTTP client: request latency and 429s."""
+    async def on_request_start(session, context, params):
+        context.started_at = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        DISCORD_REQUEST_SECONDS.observe(time.perf_counter() - context.started_at, method=params.method)
+        if params.response.status == 429:
+            DISCORD_RATE_LIMITED.inc()
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+async def watch_event_loop(interval=0.5):
+    """Heartbeat: anything blocking the loop shows up as the heartbeat waking late."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+
+async def serve(host="127.0.0.1", port=9108):
+    """Serve GET /metrics until the bot stops."""
+    async def metrics(request):
+        return web.Response(body=REGISTRY.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+def instrument(bot):
+    """Count every command and its errors. Timing needs command_started/command_finished in the invoke hooks."""
+    bot.add_listener(_on_command, "on_command")
+    bot.add_listener(_on_command_error, "on_command_error")
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import deque
+
+# Discord's message length limit
+MESSAGE_LIMIT = 2000
+
+FENCE = "```"
+
+
+def _pieces(line, width):
+    """A line cut into pieces of at most width characters (only lines longer than a message are cut)."""
+    if len(line) <= width:
+        return [line]
+    return [line[i:i + width] for i in range(0, len(line), width)]
+
+
+def pack(text, limit=MESSAGE_LIMIT):
+    """
+    Split text into as few messages of at most `limit` characters as possible.
+
+    Messages break between lines. A code block that doesn't fit is closed at the end of one
+    message and reopened at the start of the next, so its formatting survives the split.
+    """
+    messages = []
+    lines = []
+    size = 0
+    fence = None  # the opening line of the code block we are in, if any
+
+    for line in text.split("\n"):
+        for piece in _pieces(line, limit - 2 * (len(FENCE) + 8)):
+            # Room for the piece, its newline and a closing fence if we end up inside a block
+            needed = len(piece) + 1
+            closing = len(FENCE) + 1 if fence else 0
+            if lines and size + needed + closing > limit:
+                if fence:
+                    lines.append(FENCE)
+                messages.append("\n".join(lines))
+                lines = [fence] if fence else []
+                size = len(fence) + 1 if fence else 0
+            lines.append(piece)
+            size += needed
+            if piece.startswith(FENCE):
+                fence = None if fence else piece
+
+    if lines:
+        messages.append("\n".join(lines))
+    # Discord rejects empty messages
+    return [message for message in messages if message.strip()]
+
+
+class _Channel:
+    def __init__(self, rate):
+        self.lock = asyncio.Lock()
+        self.sent_at = deque(maxlen=rate)
+
+
+class Outbox:
+    """
+    Sends long replies as few full messages, paced to Discord's per-channel rate limit.
+
+    At most `rate` messages go to a channel every `per` seconds; sends to the same channel
+    wait their turn, so concurrent commands don't interleave their messages or run into
+    429s. `per=0` turns pacing off.
+    """
+
+    def __init__(self, rate=5, per=5.0, limit=MESSAGE_LIMIT):
+        self.rate = rate
+        self.per = per
+        self.limit = limit
+        self._channels = {}
+
+        # Counters for diagnostics
+        self.messages = 0
+        self.wait_seconds = 0.0
+
+    def _channel(self, destination):
+        channel = getattr(destination, "channel", None) or destination
+        key = getattr(channel, "id", None) or id(channel)
+        if key not in self._channels:
+            self._channels[key] = _Channel(self.rate)
+        return self._channels[key]
+
+    async def send(self, destination, text):
+        """Send text to a channel, context or member; returns the number of messages it took."""
+        messages = pack(text, self.limit)
+        channel = self._channel(destination)
+        async with channel.lock:
+            for message in messages:
+                await self._wait_turn(channel)
+                await destination.send(message)
+                self.messages += 1
+        return len(messages)
+
+    async def _wait_turn(self, channel):
+        if self.per and len(channel.sent_at) == self.rate:
+            wait = channel.sent_at[0] + self.per - time.monotonic()
+            if wait > 0:
+                self.wait_seconds += wait
+                await asyncio.sleep(wait)
+        channel.sent_at.append(time.monotonic())
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from metrics import SAVE_BYTES, SAVE_SECONDS
+
+
+def _encode_json(snapshot):
+    return json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+
+
+def write_atomic(path, data):
+    """Write bytes to path via a temp file and os.replace so a crash can't leave a truncated file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteBehindPersister:
+    """
+    Coalesces bursts of save requests into one write per `delay` seconds.
+
+    Commands call mark_dirty() instead of writing the file themselves. `snapshot` is called
+    on the event loop and must return data that the loop won't mutate afterwards (fresh
+    containers); it is then encoded to bytes by `encode` (compact JSON by default) and written
+    atomically in a worker thread.
+    """
+
+    def __init__(self, path, snapshot, delay=2.0, encode=_encode_json):
+        self.path = path
+        self.snapshot = snapshot
+        self.delay = delay
+        self.encode = encode
+        self._dirty = False
+        self._task = None
+        self._lock = threading.Lock()
+        # Snapshots are numbered when taken, so a slow write-behind flush can't land on top of a newer checkpoint
+        self._taken = 0
+        self._written = 0
+
+        # Counters for diagnostics
+        self.saves = 0
+        self.save_seconds = 0.0
+        self.bytes_written = 0
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def mark_dirty(self):
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, shutdown): write straight away
+            self.flush_now()
+            return
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._dirty:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    async def flush(self):
+        """Write the current state from a worker thread."""
+        self._dirty = False
+        try:
+            data = self._take()
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        except Exception as e:
+            self._dirty = True
+            logging.error(f"Error saving game state to {self.path}: {e}")
+
+    def flush_now(self):
+        """Synchronous flush, used on shutdown and for checkpoints."""
+        self._dirty = False
+        self._write(self._take())
+
+    def _take(self):
+        self._taken += 1
+        return self._taken, self.snapshot()
+
+    def _write(self, taken):
+        number, snapshot = taken
+        with self._lock:
+            if number <= self._written:
+                return
+            self._written = number
+            start = time.perf_counter()
+            data = self.encode(snapshot)
+            write_atomic(self.path, data)
+            elapsed = time.perf_counter() - start
+            self.saves += 1
+            self.save_seconds += elapsed
+            self.bytes_written += len(data)
+            SAVE_SECONDS.observe(elapsed, backend="json")
+            SAVE_BYTES.inc(len(data))
+
+
+class JournalError(ValueError):
+    """A journaled event doesn't fit the snapshot it is replayed onto."""
+
+
+def apply_event(game_state, event):
+    """
+    Apply one journaled event to game_state. Events carry the resulting values rather than
+    deltas, so replaying an event the snapshot already contains is harmless. Raises
+    JournalError for an event about a team or task slot the snapshot doesn't have.
+    """
+    event_type = event["type"]
+    team = game_state.get(event.get("team"))
+    if team is None and event_type != "team_updated":
+        raise JournalError(f"event {event.get('seq')} ({event_type}) is for team {event.get('team')!r}, "
+                           f"which the snapshot doesn't have")
+
+    if event_type == "task_completed":
+        if not 0 <= event["index"] < len(team["tasks"]):
+            raise JournalError(f"event {event.get('seq')} (task_completed) is for task slot {event['index']} "
+                               f"of {event['team']}, which has {len(team['tasks'])} tasks in the snapshot")
+        team["tasks"][event["index"]] = event["task"]
+        team["points"] = event["team_points"]
+        team["members"][event["member"]] = event["member_points"]
+        team["completed_tasks"].setdefault(event["difficulty"], {})[event["task_id"]] = event["completed"]
+        if event.get("completed_at"):
+            timestamps = team.setdefault("completed_at", {}).setdefault(event["difficulty"], {}).setdefault(
+                event["task_id"], [None] * len(event["completed"]))
+            timestamps[event["task"][4]] = event["completed_at"]
+        if event.get("wave") is not None:
+            waves = team.setdefault("completed_wave", {}).setdefault(event["difficulty"], {}).setdefault(
+                event["task_id"], [None] * len(event["completed"]))
+            waves[event["task"][4]] = event["wave"]
+        if event.get("double_points_used"):
+            team.pop("double_points_task", None)
+    elif event_type == "item_purchased":
+        team["points"] = event["team_points"]
+        team["purchases"] = event["purchases"]
+    elif event_type == "item_used":
+        team["purchases"] = event["purchases"]
+        team["tasks"] = event["tasks"]
+        team["gp"] = event.get("gp", team.get("gp", 0))
+    elif event_type == "wave_advanced":
+        team["wave"] = event["wave"]
+        team["tasks"] = event["tasks"]
+        team["shop_accessed"] = event["shop_accessed"]
+    elif event_type == "double_points_expired":
+        pass
+    elif event_type == "team_renamed":
+        team["custom_name"] = event["name"]
+    elif event_type == "team_updated":
+        game_state[event["team"]] = team = event["data"]
+    else:
+        logging.warning(f"Skipping unknown journal event type {event_type!r}")
+        return
+    # Events that start or end a DoubleDipping Brew carry the team's window as it is afterwards
+    if "double_points_task" in event:
+        if event["double_points_task"]:
+            team["double_points_task"] = event["double_points_task"]
+        else:
+            team.pop("double_points_task", None)
+
+
+class EventJournal:
+    """
+    Append-only JSON-lines log of game events, written next to the snapshot.
+
+    Every event gets a sequence number. rotate() moves the live log aside as an archive
+    segment named after its last sequence number; archives are kept as the audit trail and
+    replay() only reads segments newer than the snapshot it is applied to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0
+        self.pending = 0
+        self._file = None
+
+    def append(self, event_type, team_key, **data):
+        return self.append_many([(event_type, team_key, data)])[0]
+
+    def append_many(self, events):
+        """Append (event_type, team_key, data) events with one write."""
+        t = datetime.utcnow().isoformat()
+        appended = []
+        for event_type, team_key, data in events:
+            self.seq += 1
+            self.pending += 1
+            event = {"seq": self.seq, "t": t, "type": event_type, "team": team_key}
+            event.update(data)
+            appended.append(event)
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write("".join(json.dumps(event, separators=(',', ':')) + "\n" for event in appended))
+        self._file.flush()
+        return appended
+
+    def rotate(self):
+        """Close the live log and archive it; returns the last sequence number it holds."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path) and self.pending:
+            os.replace(self.path, f"{self.path}.{self.seq:012d}")
+        self.pending = 0
+        return self.seq
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def segments(self, after_seq=0):
+        """Journal files that may hold events newer than after_seq, oldest first."""
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        archives = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit() and int(suffix) > after_seq:
+                archives.append((int(suffix), os.path.join(directory, name)))
+        paths = [path for _, path in sorted(archives)]
+        if os.path.exists(self.path):
+            paths.append(self.path)
+        return paths
+
+    def events(self, after_seq=0):
+        for path in self.segments(after_seq):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append
+                        logging.warning(f"Skipping unreadable journal line in {path}")
+                        continue
+                    if event["seq"] > after_seq:
+                        yield event
+
+    def replay(self, game_state, after_seq=0):
+        """
+        Apply every event newer than the snapshot and continue numbering after the last one.
+        Raises JournalError, naming the journal, if an event doesn't fit the snapshot.
+        """
+        self.close()
+        self.seq = after_seq
+        self.pending = 0
+        for event in self.events(after_seq):
+            try:
+                apply_event(game_state, event)
+            except JournalError as e:
+                raise JournalError(f"Can't replay {self.path} onto a snapshot taken at event {after_seq}: {e}") from e
+            self.seq = max(self.seq, event["seq"])
+            self.pending += 1
+        return game_state
@@ -0,0 +1,42 @@
+from bisect import bisect_left
+
+
+class PrefixIndex:
+    """
+    Names sorted by their case-folded form, so the names starting with a typed prefix are
+    found by bisection instead of a scan. Each name can carry a value, such as a team key.
+    """
+
+    def __init__(self):
+        self._entries = []  # sorted (folded name, name, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def add(self, name, value=None):
+        entry = (name.casefold(), name, value)
+        position = bisect_left(self._entries, entry)
+        if position == len(self._entries) or self._entries[position] != entry:
+            self._entries.insert(position, entry)
+
+    def remove(self, name, value=None):
+        entry = (name.casefold(), name, value)
+        position = bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def matches(self, prefix, limit=None):
+        """(name, value) for every name starting with prefix in any case, in order, at most `limit`."""
+        folded = prefix.casefold()
+        position = bisect_left(self._entries, (folded,))
+        matches = []
+        while position < len(self._entries) and (limit is None or len(matches) < limit):
+            folded_name, name, value = self._entries[position]
+            if not folded_name.startswith(folded):
+                break
+            matches.append((name, value))
+            position += 1
+        return matches
@@ -0,0 +1,110 @@
+"""
+On-demand cProfile profiling of running commands, for finding hot paths during an event.
+
+An admin arms the profiler for the next N invocations of one command, or for a time window
+of everything the bot does; the stats are aggregated and reported as text. Until it is
+armed, the invoke hooks only check one attribute, so there is no cost when it is off.
+"""
+import cProfile
+import io
+import pstats
+import time
+
+# Functions listed in each section of a report
+REPORT_LINES = 40
+
+
+class ProfileSession:
+    def __init__(self, command, count, destination):
+        self.command = command  # None profiles everything for a time window
+        self.count = count
+        self.destination = destination
+        self.started = 0
+        self.finished = 0
+        self.started_at = time.monotonic()
+        self.profile = cProfile.Profile()
+        self._depth = 0
+
+    def enter(self):
+        # Profiled commands can overlap; the profile runs while any of them is running
+        if self._depth == 0:
+            self.profile.enable()
+        self._depth += 1
+
+    def exit(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self.profile.disable()
+
+    def report(self):
+        """The hottest functions, by cumulative and by own time."""
+        elapsed = time.monotonic() - self.started_at
+        if self.command:
+            header = (f"Profile of {self.finished} invocation(s) of !{self.command} over {elapsed:.1f}s\n"
+                      "Work other tasks did while a profiled invocation was awaiting is included.\n")
+        else:
+            header = f"Profile of everything the bot did for {elapsed:.1f}s\n"
+        stream = io.StringIO()
+        stream.write(header)
+        stats = pstats.Stats(self.profile, stream=stream)
+        if not stats.stats:
+            stream.write("\nNothing was recorded.\n")
+            return stream.getvalue()
+        stats.strip_dirs()
+        for order in ("cumulative", "tottime"):
+            stream.write(f"\n===== Top {REPORT_LINES} by {order} =====\n")
+            stats.sort_stats(order).print_stats(REPORT_LINES)
+        return stream.getvalue()
+
+
+class CommandProfiler:
+    """One profiling session at a time, driven by the bot's invoke hooks."""
+
+    def __init__(self):
+        self.session = None
+
+    def profile_command(self, command, count, destination):
+        self._check_idle()
+        self.session = ProfileSession(command, count, destination)
+
+    def profile_window(self, destination):
+        """Start profiling everything; finish() ends it."""
+        self._check_idle()
+        self.session = ProfileSession(None, 0, destination)
+        self.session.enter()
+
+    def _check_idle(self):
+        if self.session is not None:
+            target = f"!{self.session.command}" if self.session.command else "a time window"
+            raise ValueError(f"Already profiling {target}. Use `!profile stop` first.")
+
+    def command_started(self, ctx):
+        session = self.session
+        if session is None or session.command != ctx.command.qualified_name or session.started >= session.count:
+            return
+        session.started += 1
+        ctx.profile_session = session
+        session.enter()
+
+    def command_finished(self, ctx):
+        """
+        The finished session once its last invocation is done, else None. Called from both
+        after_invoke and the command error listener; only the first call counts.
+        """
+        session = getattr(ctx, "profile_session", None)
+        if session is None:
+            return None
+        ctx.profile_session = None
+        session.exit()
+        session.finished += 1
+        if session.finished >= session.count and session is self.session:
+            self.session = None
+            return session
+        return None
+
+    def finish(self):
+        """Stop the current session early (or end a time window) and return it, or None."""
+        session, self.session = self.session, None
+        if session is not None and session.command is None:
+            session.exit()
+        return session
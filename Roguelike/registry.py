@@ -0,0 +1,59 @@
+from prefix import PrefixIndex
+
+
+class TeamRegistry:
+    """
+    Case-folded index of team keys ("Team1") and custom names onto the canonical team key.
+    Every command resolves its team through here instead of scanning all teams, and slash
+    command autocomplete finds teams by the start of either name.
+    Teams are any objects with a `custom_name` attribute.
+    """
+
+    def __init__(self, teams=None):
+        self.teams = {}
+        self._aliases = {}
+        self._names = PrefixIndex()
+        self.rebuild(teams if teams is not None else {})
+
+    def rebuild(self, teams):
+        """Re-index a freshly loaded or freshly created set of teams."""
+        self.teams = teams
+        self._aliases = {}
+        self._names.clear()
+        for key in teams:
+            self._aliases[key.casefold()] = key
+            self._names.add(key, key)
+        for key, team in teams.items():
+            if team.custom_name:
+                # Team keys win over custom names if they ever collide
+                self._aliases.setdefault(team.custom_name.casefold(), key)
+                self._names.add(team.custom_name, key)
+
+    def lookup(self, name):
+        """Return (team_key, team) for a team key or custom name, or (None, None)."""
+        key = self._aliases.get(name.casefold())
+        if key is None:
+            return None, None
+        return key, self.teams[key]
+
+    def is_taken(self, name):
+        return name.casefold() in self._aliases
+
+    def rename(self, team_key, name):
+        """Set a team's custom name and move its alias."""
+        team = self.teams[team_key]
+        old_name = team.custom_name
+        if old_name and self._aliases.get(old_name.casefold()) == team_key and old_name.casefold() != team_key.casefold():
+            del self._aliases[old_name.casefold()]
+        if old_name:
+            self._names.remove(old_name, team_key)
+        team.custom_name = name
+        self._aliases.setdefault(name.casefold(), team_key)
+        self._names.add(name, team_key)
+
+    def matches(self, prefix, limit=None):
+        """(name, team_key) for team keys and custom names starting with prefix, in any case."""
+        return self._names.matches(prefix, limit)
+
+    def __len__(self):
+        return len(self.teams)
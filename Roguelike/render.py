@@ -0,0 +1,42 @@
+class RenderCache:
+    """
+    Rendered reply text, reused until the game changes.
+
+    block() caches one team's part of a view against that team's version; view() caches a
+    whole all-teams view against the engine's version and rebuilds it from the team blocks,
+    so after a change only the teams that changed are rendered again.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._blocks = {}
+        self._views = {}
+
+        # Counters for diagnostics
+        self.hits = 0
+        self.misses = 0
+
+    def block(self, view, team, render):
+        cached = self._blocks.get((view, team.key))
+        if cached is not None and cached[0] == team.version:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        text = render(team)
+        # Rendering may itself change the team (!current resets a stale shop flag)
+        self._blocks[(view, team.key)] = (team.version, text)
+        return text
+
+    def view(self, view, render, header="", separator=""):
+        """header followed by every team's block (each followed by separator), in team order."""
+        cached = self._views.get(view)
+        if cached is not None and cached[0] == self.engine.version:
+            self.hits += 1
+            return cached[1]
+        text = header + "".join(self.block(view, team, render) + separator for team in self.engine.teams.values())
+        self._views[view] = (self.engine.version, text)
+        return text
+
+    def clear(self):
+        self._blocks.clear()
+        self._views.clear()
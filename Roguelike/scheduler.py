@@ -0,0 +1,114 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+
+from persistence import WriteBehindPersister
+
+
+class DeadlineScheduler:
+    """
+    Every pending deadline of every game in one heap, fired by one background task (run()).
+
+    A deadline is keyed by a tuple whose first element is its kind, e.g.
+    ("double_points", guild_id, game_id, team_key); scheduling a key again moves its deadline,
+    so each effect has at most one. When a deadline passes, the handler registered for its
+    kind is awaited with the key and the data it was scheduled with. Deadlines are wall-clock
+    times and are saved to `path`, so ones that pass while the bot is down fire when it
+    comes back.
+    """
+
+    def __init__(self, path=None, delay=2.0):
+        self._heap = []  # (when, seq, key); entries whose seq is no longer pending are skipped
+        self._pending = {}  # key -> (when, seq, data)
+        self._handlers = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self.persister = WriteBehindPersister(path, self._snapshot, delay=delay) if path else None
+
+        # Counters for diagnostics
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def handler(self, kind):
+        """Decorator registering `async def handler(key, **data)` for deadlines of this kind."""
+        def register(func):
+            self._handlers[kind] = func
+            return func
+        return register
+
+    def _snapshot(self):
+        return [[list(key), when, data] for key, (when, _, data) in self._pending.items()]
+
+    def _changed(self):
+        if self.persister:
+            self.persister.mark_dirty()
+
+    def load(self):
+        """Read the deadlines saved by an earlier run."""
+        if not self.persister or not os.path.exists(self.persister.path):
+            return
+        with open(self.persister.path, 'r', encoding='utf-8') as file:
+            for key, when, data in json.load(file):
+                self._push(tuple(key), when, data)
+
+    def _push(self, key, when, data):
+        seq = next(self._seq)
+        self._pending[key] = (when, seq, data)
+        heapq.heappush(self._heap, (when, seq, key))
+        # Moved and cancelled deadlines leave stale entries behind; drop them once they dominate
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._heap = [(when, seq, key) for key, (when, seq, _) in self._pending.items()]
+            heapq.heapify(self._heap)
+
+    def schedule(self, key, when, **data):
+        """Fire `key` at `when` (seconds since the epoch), replacing any deadline it already has."""
+        self._push(key, when, data)
+        self._wakeup.set()
+        self._changed()
+
+    def cancel(self, key):
+        if self._pending.pop(key, None) is not None:
+            self._changed()
+
+    def deadline(self, key):
+        """When `key` fires, or None."""
+        pending = self._pending.get(key)
+        return pending[0] if pending else None
+
+    def _next(self):
+        """The earliest live heap entry, dropping stale ones."""
+        while self._heap:
+            when, seq, key = self._heap[0]
+            pending = self._pending.get(key)
+            if pending is not None and pending[1] == seq:
+                return when, key
+            heapq.heappop(self._heap)
+        return None
+
+    async def run(self):
+        """Sleep until the earliest deadline (or until an earlier one is scheduled) and fire what is due."""
+        while True:
+            self._wakeup.clear()
+            head = self._next()
+            delay = None if head is None else head[0] - time.time()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, key = head
+            heapq.heappop(self._heap)
+            _, _, data = self._pending.pop(key)
+            self._changed()
+            self.fired += 1
+            try:
+                await self._handlers[key[0]](key, **data)
+            except Exception as e:
+                logging.error(f"Error firing deadline {key}: {e}")
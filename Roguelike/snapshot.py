@@ -0,0 +1,214 @@
+"""
+The compact, versioned file format game snapshots are saved in.
+
+A snapshot is a one-line ASCII header followed by the payload:
+
+    RLSNAP <schema version> <compression>\n<payload>
+
+The payload is compact JSON, compressed with zlib or gzip or not at all, holding
+
+    {
+        "journal_seq": 0, "game_started": false, "game_seed": null,
+        "teams": [[team_key, {"wave": ..., "tasks": [...], ..., "completed": [[difficulty, task_id, [member per level],
+                                                                              [time per level] or null, [wave per level] or null], ...]}], ...]
+    }
+
+Completions are kept as lists rather than objects keyed by task ID, so task IDs stay integers
+through a round trip. Files without the header are the JSON saves written before this format
+(schema 1); decode() upgrades them and older snapshots, so existing saves load and are
+rewritten on the next save. Schema 3 added the wave each level was completed in.
+
+    python snapshot.py game_state.json --compression zlib
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+import zlib
+
+from catalog import get_catalog
+
+MAGIC = b"RLSNAP"
+
+SCHEMA_VERSION = 3
+
+COMPRESSIONS = ("none", "zlib", "gzip")
+
+
+class SnapshotError(ValueError):
+    """The snapshot file is unreadable, or was written by a newer version of the bot."""
+
+
+def _compress(payload, compression):
+    if compression == "zlib":
+        return zlib.compress(payload, 6)
+    if compression == "gzip":
+        return gzip.compress(payload, 6, mtime=0)
+    if compression == "none":
+        return payload
+    raise ValueError(f"Unknown snapshot compression {compression!r}; expected one of {', '.join(COMPRESSIONS)}")
+
+
+def _decompress(payload, compression):
+    if compression == "zlib":
+        return zlib.decompress(payload)
+    if compression == "gzip":
+        return gzip.decompress(payload)
+    if compression == "none":
+        return payload
+    raise SnapshotError(f"unknown compression {compression!r}")
+
+
+def pack_team(team):
+    """A team's saved form with its completions as [difficulty, task_id, levels, timestamps, waves] lists."""
+    packed = {k: v for k, v in team.items() if k not in ("completed_tasks", "completed_at", "completed_wave")}
+    completed_at = team.get("completed_at", {})
+    completed_wave = team.get("completed_wave", {})
+    packed["completed"] = [
+        [difficulty, task_id, task_levels, completed_at.get(difficulty, {}).get(task_id),
+         completed_wave.get(difficulty, {}).get(task_id)]
+        for difficulty, tasks in team.get("completed_tasks", {}).items()
+        for task_id, task_levels in tasks.items()
+    ]
+    return packed
+
+
+def unpack_team(packed):
+    team = {k: v for k, v in packed.items() if k != "completed"}
+    completed_tasks = team["completed_tasks"] = {}
+    completed_at = team["completed_at"] = {}
+    completed_wave = team["completed_wave"] = {}
+    # Restore points (see backups.py) aren't versioned; those made before schema 3 have no waves
+    for difficulty, task_id, task_levels, timestamps, *waves in packed.get("completed", ()):
+        waves = waves[0] if waves else None
+        completed_tasks.setdefault(difficulty, {})[task_id] = task_levels
+        if timestamps is not None:
+            completed_at.setdefault(difficulty, {})[task_id] = timestamps
+        if waves is not None:
+            completed_wave.setdefault(difficulty, {})[task_id] = waves
+    return team
+
+
+def _fit_levels(values, level_count):
+    """A per-level list resized to level_count, never dropping a level that has a value."""
+    if not isinstance(values, list) or level_count is None:
+        return values
+    filled = max((level + 1 for level, value in enumerate(values) if value), default=0)
+    size = max(level_count, filled)
+    return values[:size] + [None] * (size - len(values))
+
+
+def _upgrade_v1(body):
+    """
+    The original indented JSON save: {"game_state": {key: team}, ...}, with task IDs as string
+    keys. The first saves sized every completed_tasks list by the difficulty's family count,
+    so lists are fitted to each family's level count in the current catalog.
+    """
+    families = get_catalog().families
+    teams = []
+    for key, team in body.get("game_state", {}).items():
+        team = dict(team)
+        for field_name in ("completed_tasks", "completed_at", "completed_wave"):
+            team[field_name] = {
+                difficulty: {
+                    int(task_id): _fit_levels(values, len(families[difficulty][int(task_id)])
+                                              if int(task_id) in families.get(difficulty, {}) else None)
+                    for task_id, values in tasks.items()
+                }
+                for difficulty, tasks in team.get(field_name, {}).items()
+            }
+        teams.append([key, pack_team(team)])
+    return {
+        "journal_seq": body.get("journal_seq", 0),
+        "game_started": body.get("game_started", False),
+        "game_seed": body.get("game_seed"),
+        "teams": teams,
+    }
+
+
+def _upgrade_v2(body):
+    """Completions gain the wave they were completed in, which schema 2 didn't record."""
+    for _, team in body["teams"]:
+        team["completed"] = [entry + [None] * (5 - len(entry)) for entry in team.get("completed", ())]
+    return body
+
+
+# Each upgrades a payload of its schema version to the next one
+_UPGRADES = {1: _upgrade_v1, 2: _upgrade_v2}
+
+
+def encode(data, compression="zlib"):
+    """
+    A snapshot of `data` ({"game_state": {key: team}, "game_started", "game_seed", "journal_seq"}
+    as the storage layer passes it), as bytes.
+    """
+    body = {
+        "journal_seq": data.get("journal_seq", 0),
+        "game_started": data.get("game_started", False),
+        "game_seed": data.get("game_seed"),
+        "teams": [[key, pack_team(team)] for key, team in data.get("game_state", {}).items()],
+    }
+    payload = json.dumps(body, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return b"%s %d %s\n" % (MAGIC, SCHEMA_VERSION, compression.encode('ascii')) + _compress(payload, compression)
+
+
+def decode(raw):
+    """The data a snapshot (or an older JSON save) holds, in the form encode() takes, with integer task IDs."""
+    try:
+        if raw.startswith(MAGIC + b" "):
+            header, _, payload = raw.partition(b"\n")
+            _, version, compression = header.decode('ascii').split()
+            version = int(version)
+            body = json.loads(_decompress(payload, compression))
+        else:
+            version = 1
+            body = json.loads(raw)
+    except (ValueError, zlib.error, OSError, EOFError) as e:
+        raise SnapshotError(f"unreadable snapshot: {e}") from e
+    if version > SCHEMA_VERSION:
+        raise SnapshotError(f"snapshot schema {version} is newer than this bot's ({SCHEMA_VERSION})")
+    while version < SCHEMA_VERSION:
+        body = _UPGRADES[version](body)
+        version += 1
+    return {
+        "journal_seq": body.get("journal_seq", 0),
+        "game_started": body.get("game_started", False),
+        "game_seed": body.get("game_seed"),
+        "game_state": {key: unpack_team(team) for key, team in body["teams"]},
+    }
+
+
+def read(path):
+    """decode() the file at path."""
+    with open(path, 'rb') as file:
+        raw = file.read()
+    try:
+        return decode(raw)
+    except SnapshotError as e:
+        raise SnapshotError(f"{path}: {e}") from e
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert game saves to the current snapshot format.")
+    parser.add_argument("files", nargs="+", help="JSON saves or snapshots to convert")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="zlib")
+    parser.add_argument("--suffix", default=".snap", help="written next to each input, replacing its extension")
+    args = parser.parse_args()
+
+    from persistence import write_atomic
+    for path in args.files:
+        start = time.perf_counter()
+        data = read(path)
+        read_ms = (time.perf_counter() - start) * 1000
+        output = os.path.splitext(path)[0] + args.suffix
+        encoded = encode(data, args.compression)
+        write_atomic(output, encoded)
+        start = time.perf_counter()
+        read(output)
+        print(f"{path} ({os.path.getsize(path) / 1024:.1f} KiB, read in {read_ms:.1f} ms) -> {output} "
+              f"({len(encoded) / 1024:.1f} KiB, read in {(time.perf_counter() - start) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import snapshot as snapshot_format
+from metrics import SAVE_SECONDS
+
+from persistence import WriteBehindPersister, EventJournal
+
+
+# Team fields with their own column in SQLite; anything else is kept in teams.extra
+TEAM_COLUMNS = ("wave", "tasks", "points", "gp", "members", "purchases", "completed_tasks", "completed_at",
+                "completed_wave", "custom_name", "shop_accessed")
+
+
+class JsonStorage:
+    """
+    The default backend: a snapshot file (see snapshot.py) written behind by
+    WriteBehindPersister, plus a JSON-lines event journal that is replayed on load and
+    compacted every `compact_every` events. Read queries are answered from memory by the engine.
+
+    `snapshot` is a callable returning {"game_state": ..., "game_started": ..., "game_seed": ...}.
+    A game saved before snapshots had their own format is read from `legacy_file` until its
+    first save in the new format.
+    """
+
+    def __init__(self, save_file, journal_file, snapshot, delay=2.0, compact_every=1000, compression="zlib",
+                 legacy_file=None):
+        if compression not in snapshot_format.COMPRESSIONS:
+            raise ValueError(f"Unknown SNAPSHOT_COMPRESSION {compression!r}; expected one of "
+                             f"{', '.join(snapshot_format.COMPRESSIONS)}")
+        self.save_file = save_file
+        self.legacy_file = legacy_file
+        self.snapshot = snapshot
+        self.compact_every = compact_every
+        self.journal = EventJournal(journal_file)
+        self.persister = WriteBehindPersister(save_file, self._snapshot, delay=delay,
+                                              encode=lambda data: snapshot_format.encode(data, compression))
+
+    def _snapshot(self):
+        data = {"journal_seq": self.journal.seq}
+        data.update(self.snapshot())
+        return data
+
+    def load(self):
+        """Return (game_state, meta), where meta holds game_started and game_seed."""
+        state = {}
+        meta = {"game_started": False, "game_seed": None}
+        journal_seq = 0
+        path = self.save_file
+        if not os.path.exists(path) and self.legacy_file and os.path.exists(self.legacy_file):
+            path = self.legacy_file
+            logging.info(f"Reading {path}; it will be saved as {self.save_file} from now on")
+        if os.path.exists(path):
+            data = snapshot_format.read(path)
+            meta["game_started"] = data["game_started"]
+            meta["game_seed"] = data["game_seed"]
+            state = data["game_state"]
+            journal_seq = data["journal_seq"]
+        self.journal.replay(state, journal_seq)
+        return state, meta
+
+    def save(self):
+        self.persister.mark_dirty()
+
+    def checkpoint(self):
+        """
+        Write the snapshot now and start a new journal. Whole-game changes (!set_teams, !start)
+        aren't journaled, so they must be on disk before the next event is.
+        """
+        self.journal.rotate()
+        self.persister.flush_now()
+
+    def record(self, event_type, team_key, **data):
+        self.record_many([(event_type, team_key, data)])
+
+    def record_many(self, events):
+        self.journal.append_many(events)
+        if self.journal.pending >= self.compact_every:
+            self.journal.rotate()
+            self.save()
+
+    def close(self):
+        self.journal.rotate()
+        self.persister.flush_now()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    season TEXT PRIMARY KEY,
+    game_started INTEGER NOT NULL DEFAULT 0,
+    game_seed TEXT
+);
+CREATE TABLE IF NOT EXISTS teams (
+    season TEXT NOT NULL,
+    team_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    custom_name TEXT,
+    wave INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    gp INTEGER NOT NULL,
+    shop_accessed INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (season, team_key)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    season TEXT NOT NULL,
+    team_key TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    difficulty TEXT,
+    description TEXT,
+    points INTEGER,
+    task_id INTEGER,
+    level INTEGER,
+    completed_by TEXT,
+    PRIMARY KEY (season, team_key, slot)
+);
+CREATE TABLE IF NOT EXISTS completed_levels (
+    season TEXT NOT NULL,
+    team_key TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    task_id INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    slots INTEGER NOT NULL,
+    member TEXT NOT NULL,
+    completed_at TEXT,
+    wave INTEGER,
+    PRIMARY KEY (season, team_key, difficulty, task_id, level)
+);
+CREATE INDEX IF NOT EXISTS completed_levels_by_member ON completed_levels (season, team_key, member);
+CREATE TABLE IF NOT EXISTS members (
+    season TEXT NOT NULL,
+    team_key TEXT NOT NULL,
+    member TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (season, team_key, member)
+);
+CREATE INDEX IF NOT EXISTS members_by_member ON members (season, member);
+CREATE TABLE IF NOT EXISTS purchases (
+    season TEXT NOT NULL,
+    team_key TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    PRIMARY KEY (season, team_key, slot)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    season TEXT NOT NULL,
+    t TEXT NOT NULL,
+    type TEXT NOT NULL,
+    team_key TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_season ON events (season, seq);
+"""
+
+
+class SqliteStorage:
+    """
+    Normalized SQLite backend (WAL mode). Several seasons can share one database file.
+
+    Journal events are applied as row-level updates in one transaction each, and also kept
+    in the events table as the audit trail.
+    """
+
+    def __init__(self, db_file, season, snapshot):
+        self.season = season
+        self.snapshot = snapshot
+        # Games are opened and closed in worker threads and used on the event loop, never at once
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Databases created before completions recorded their wave
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(completed_levels)")}
+        if "wave" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE completed_levels ADD COLUMN wave INTEGER")
+
+    def load(self):
+        season = self.season
+        cur = self.conn.cursor()
+        row = cur.execute("SELECT game_started, game_seed FROM games WHERE season = ?", (season,)).fetchone()
+        meta = {"game_started": bool(row[0]) if row else False, "game_seed": row[1] if row else None}
+
+        state = {}
+        for key, custom_name, wave, points, gp, shop_accessed, extra in cur.execute(
+                "SELECT team_key, custom_name, wave, points, gp, shop_accessed, extra FROM teams "
+                "WHERE season = ? ORDER BY position", (season,)):
+            team = {
+                "wave": wave,
+                "tasks": [],
+                "points": points,
+                "gp": gp,
+                "members": {},
+                "purchases": [],
+                "completed_tasks": {},
+                "completed_at": {},
+                "completed_wave": {},
+                "custom_name": custom_name,
+                "shop_accessed": bool(shop_accessed),
+            }
+            team.update(json.loads(extra))
+            state[key] = team
+
+        for key, *task in cur.execute(
+                "SELECT team_key, difficulty, description, points, task_id, level, completed_by FROM tasks "
+                "WHERE season = ? ORDER BY team_key, slot", (season,)):
+            state[key]["tasks"].append(self._task_from_row(task))
+
+        for key, difficulty, task_id, level, slots, member, completed_at, wave in cur.execute(
+                "SELECT team_key, difficulty, task_id, level, slots, member, completed_at, wave FROM completed_levels "
+                "WHERE season = ?", (season,)):
+            task_levels = state[key]["completed_tasks"].setdefault(difficulty, {}).setdefault(task_id, [None] * slots)
+            task_levels[level] = member
+            timestamps = state[key]["completed_at"].setdefault(difficulty, {}).setdefault(task_id, [None] * slots)
+            timestamps[level] = completed_at
+            if wave is not None:
+                waves = state[key]["completed_wave"].setdefault(difficulty, {}).setdefault(task_id, [None] * slots)
+                waves[level] = wave
+
+        for key, member, points in cur.execute(
+                "SELECT team_key, member, points FROM members WHERE season = ? ORDER BY rowid", (season,)):
+            state[key]["members"][member] = points
+
+        for key, item in cur.execute(
+                "SELECT team_key, item FROM purchases WHERE season = ? ORDER BY team_key, slot", (season,)):
+            state[key]["purchases"].append(item)
+
+        return state, meta
+
+    def save(self):
+        """Rewrite every row of this season. Only used for whole-game changes like !set_teams and !start."""
+        start = time.perf_counter()
+        data = self.snapshot()
+        season = self.season
+        with self.conn:
+            for table in ("teams", "tasks", "completed_levels", "members", "purchases"):
+                self.conn.execute(f"DELETE FROM {table} WHERE season = ?", (season,))
+            self.conn.execute(
+                "INSERT INTO games (season, game_started, game_seed) VALUES (?, ?, ?) "
+                "ON CONFLICT (season) DO UPDATE SET game_started = excluded.game_started, game_seed = excluded.game_seed",
+                (season, int(bool(data["game_started"])), data.get("game_seed")))
+            for position, (key, team) in enumerate(data["game_state"].items()):
+                self._write_team(key, team, position)
+        SAVE_SECONDS.observe(time.perf_counter() - start, backend="sqlite")
+
+    def checkpoint(self):
+        """save() already rewrites the season in one transaction before returning."""
+        self.save()
+
+    def record(self, event_type, team_key, **data):
+        self.record_many([(event_type, team_key, data)])
+
+    def record_many(self, events):
+        """Apply (event_type, team_key, data) events in one transaction."""
+        t = datetime.utcnow().isoformat()
+        with self.conn:
+            for event_type, team_key, data in events:
+                self._apply(event_type, team_key, data, t)
+
+    def _apply(self, event_type, team_key, data, t):
+        season = self.season
+        self.conn.execute(
+            "INSERT INTO events (season, t, type, team_key, data) VALUES (?, ?, ?, ?, ?)",
+            (season, t, event_type, team_key, json.dumps(data, separators=(',', ':'))))
+
+        if event_type == "task_completed":
+            task = data["task"]
+            self.conn.execute(
+                "UPDATE tasks SET completed_by = ? WHERE season = ? AND team_key = ? AND slot = ?",
+                (data["member"], season, team_key, data["index"]))
+            self.conn.execute(
+                "UPDATE teams SET points = ? WHERE season = ? AND team_key = ?",
+                (data["team_points"], season, team_key))
+            self._upsert_member(team_key, data["member"], data["member_points"])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completed_levels "
+                "(season, team_key, difficulty, task_id, level, slots, member, completed_at, wave) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (season, team_key, data["difficulty"], data["task_id"], task[4], len(data["completed"]),
+                 data["member"], data.get("completed_at", t), data.get("wave")))
+            if data.get("double_points_used"):
+                self._set_extra(team_key, "double_points_task", None)
+        elif event_type == "item_purchased":
+            self.conn.execute(
+                "UPDATE teams SET points = ? WHERE season = ? AND team_key = ?",
+                (data["team_points"], season, team_key))
+            self._write_purchases(team_key, data["purchases"])
+        elif event_type == "item_used":
+            self._write_purchases(team_key, data["purchases"])
+            self._write_tasks(team_key, data["tasks"])
+            if "gp" in data:
+                self.conn.execute(
+                    "UPDATE teams SET gp = ? WHERE season = ? AND team_key = ?", (data["gp"], season, team_key))
+        elif event_type == "wave_advanced":
+            self.conn.execute(
+                "UPDATE teams SET wave = ?, shop_accessed = ? WHERE season = ? AND team_key = ?",
+                (data["wave"], int(bool(data["shop_accessed"])), season, team_key))
+            self._write_tasks(team_key, data["tasks"])
+        elif event_type == "double_points_expired":
+            pass
+        elif event_type == "team_renamed":
+            self.conn.execute(
+                "UPDATE teams SET custom_name = ? WHERE season = ? AND team_key = ?",
+                (data["name"], season, team_key))
+        elif event_type == "team_updated":
+            self._write_team(team_key, data["data"])
+        else:
+            logging.warning(f"No SQLite mapping for event type {event_type!r}; only the event row was stored")
+            return
+        if "double_points_task" in data:
+            self._set_extra(team_key, "double_points_task", data["double_points_task"])
+
+    def close(self):
+        self.conn.close()
+
+    # Row writers, called inside a transaction
+
+    def _write_team(self, team_key, team, position=None):
+        season = self.season
+        extra = {k: v for k, v in team.items() if k not in TEAM_COLUMNS}
+        if position is None:
+            row = self.conn.execute(
+                "SELECT position FROM teams WHERE season = ? AND team_key = ?", (season, team_key)).fetchone()
+            position = row[0] if row else self.conn.execute(
+                "SELECT COUNT(*) FROM teams WHERE season = ?", (season,)).fetchone()[0]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO teams VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (season, team_key, position, team["custom_name"], team["wave"], team["points"], team["gp"],
+             int(bool(team.get("shop_accessed", False))), json.dumps(extra)))
+        self._write_tasks(team_key, team["tasks"])
+        self._write_purchases(team_key, team["purchases"])
+
+        self.conn.execute("DELETE FROM members WHERE season = ? AND team_key = ?", (season, team_key))
+        for member_name, points in team["members"].items():
+            self._upsert_member(team_key, member_name, points)
+
+        # Keep the completion timestamps and waves of levels that are still completed by the same
+        # member, for team data that doesn't carry its own
+        recorded = {
+            (difficulty, task_id, level, member): (t, wave)
+            for difficulty, task_id, level, member, t, wave in self.conn.execute(
+                "SELECT difficulty, task_id, level, member, completed_at, wave FROM completed_levels "
+                "WHERE season = ? AND team_key = ?", (season, team_key))
+        }
+        self.conn.execute("DELETE FROM completed_levels WHERE season = ? AND team_key = ?", (season, team_key))
+        for difficulty, tasks in team["completed_tasks"].items():
+            for task_id, task_levels in tasks.items():
+                timestamps = team.get("completed_at", {}).get(difficulty, {}).get(task_id) or []
+                waves = team.get("completed_wave", {}).get(difficulty, {}).get(task_id) or []
+                for level, member in enumerate(task_levels):
+                    if member:
+                        old_timestamp, old_wave = recorded.get((difficulty, int(task_id), level, member), (None, None))
+                        timestamp = timestamps[level] if level < len(timestamps) else None
+                        wave = waves[level] if level < len(waves) else None
+                        self.conn.execute(
+                            "INSERT INTO completed_levels "
+                            "(season, team_key, difficulty, task_id, level, slots, member, completed_at, wave) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (season, team_key, difficulty, int(task_id), level, len(task_levels), member,
+                             timestamp or old_timestamp, wave if wave is not None else old_wave))
+
+    def _write_tasks(self, team_key, tasks):
+        self.conn.execute("DELETE FROM tasks WHERE season = ? AND team_key = ?", (self.season, team_key))
+        for slot, task in enumerate(tasks):
+            if task is None:
+                row = (None,) * 6
+            else:
+                row = tuple(task[:5]) + (task[6] if "completed" in task else None,)
+            self.conn.execute("INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (self.season, team_key, slot) + row)
+
+    def _write_purchases(self, team_key, purchases):
+        self.conn.execute("DELETE FROM purchases WHERE season = ? AND team_key = ?", (self.season, team_key))
+        self.conn.executemany(
+            "INSERT INTO purchases VALUES (?, ?, ?, ?)",
+            [(self.season, team_key, slot, item) for slot, item in enumerate(purchases)])
+
+    def _set_extra(self, team_key, field, value):
+        """Set a field kept in teams.extra; None removes it."""
+        row = self.conn.execute(
+            "SELECT extra FROM teams WHERE season = ? AND team_key = ?", (self.season, team_key)).fetchone()
+        if row:
+            extra = json.loads(row[0])
+            if value is None:
+                extra.pop(field, None)
+            else:
+                extra[field] = value
+            self.conn.execute(
+                "UPDATE teams SET extra = ? WHERE season = ? AND team_key = ?", (json.dumps(extra), self.season, team_key))
+
+    def _upsert_member(self, team_key, member_name, points):
+        self.conn.execute(
+            "INSERT INTO members (season, team_key, member, points) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (season, team_key, member) DO UPDATE SET points = excluded.points",
+            (self.season, team_key, member_name, points))
+
+    @staticmethod
+    def _task_from_row(row):
+        difficulty, description, points, task_id, level, completed_by = row
+        if difficulty is None:
+            return None
+        task = [difficulty, description, points, task_id, level]
+        if completed_by is not None:
+            task += ["completed", completed_by]
+        return task
+
+    # Read queries
+
+    def team_summaries(self):
+        return self.conn.execute(
+            "SELECT team_key, custom_name, wave, points, gp FROM teams WHERE season = ? ORDER BY position",
+            (self.season,)).fetchall()
+
+    def completed_levels(self, team_key, member=None):
+        if member is None:
+            return self.conn.execute(
+                "SELECT difficulty, task_id, level, member FROM completed_levels "
+                "WHERE season = ? AND team_key = ? ORDER BY difficulty, task_id, level",
+                (self.season, team_key)).fetchall()
+        return self.conn.execute(
+            "SELECT difficulty, task_id, level, member FROM completed_levels "
+            "WHERE season = ? AND team_key = ? AND member = ? ORDER BY completed_at, difficulty, task_id, level",
+            (self.season, team_key, member)).fetchall()
+
+
+def open_storage(backend, snapshot, save_file, journal_file, db_file, season, delay=2.0, compact_every=1000,
+                 compression="zlib", legacy_file=None):
+    if backend == "json":
+        return JsonStorage(save_file, journal_file, snapshot, delay=delay, compact_every=compact_every,
+                           compression=compression, legacy_file=legacy_file)
+    if backend == "sqlite":
+        return SqliteStorage(db_file, season, snapshot)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected 'json' or 'sqlite'")
+
+
+def has_saved_game(backend, save_file, journal_file, db_file, season, legacy_file=None):
+    """Whether open_storage with these arguments would find a game that was saved before."""
+    if backend == "json":
+        return (any(os.path.exists(path) for path in (save_file, legacy_file) if path)
+                or bool(EventJournal(journal_file).segments()))
+    if not os.path.exists(db_file):
+        return False
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT 1 FROM games WHERE season = ?", (season,)).fetchone() is not None
+    except sqlite3.OperationalError:
+        # No games table: nothing was ever saved there
+        return False
+    finally:
+        conn.close()
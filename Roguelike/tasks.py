@@ -0,0 +1,210 @@
+import bisect
+import random
+
+from catalog import get_catalog
+
+
+def get_task_weights(wave):
+    if wave < 10:
+        return {"easy": 90, "medium": 9, "hard": 1}
+    elif wave < 20:
+        return {"easy": 70, "medium": 25, "hard": 5}
+    elif wave < 30:
+        return {"easy": 50, "medium": 40, "hard": 10}
+    elif wave < 40:
+        return {"easy": 30, "medium": 50, "hard": 20}
+    elif wave < 50:
+        return {"easy": 10, "medium": 60, "hard": 30}
+    else:
+        return {"easy": 5, "medium": 35, "hard": 60}
+
+
+
+# Tasks offered per regular wave, and how many of them must be completed to progress
+TASKS_PER_WAVE = 3
+TASKS_TO_PROGRESS = 2
+
+# Difficulty weights used by Monkey's Paw re-rolls
+HARDER_TASK_WEIGHTS = {"easy": 10, "medium": 30, "hard": 60}
+
+
+def level_count(difficulty, task_id):
+    if difficulty == "boss":
+        return 1
+    return len(get_catalog().families[difficulty][int(task_id)])
+
+
+def task_details(difficulty, task_id, level):
+    """The catalog entry ({"description", "points"}) of one task level, boss tasks included."""
+    catalog = get_catalog()
+    if difficulty == "boss":
+        description, points = catalog.boss[int(task_id)]
+        return {"description": description, "points": points}
+    return catalog.families[difficulty][int(task_id)][level]
+
+
+def next_level(task_levels):
+    """The next level to offer, given a completed_tasks entry (a list of who completed each level)."""
+    if isinstance(task_levels, int):
+        return task_levels + 1
+    for level in range(len(task_levels) - 1, -1, -1):
+        if task_levels[level]:
+            return level + 1
+    return 0
+
+
+class TeamTaskIndex:
+    """
+    The next available level of every task family for one team, and per difficulty a pool
+    of the families that still have a level left. Pools are kept sorted by task ID, so they
+    depend only on what the team has completed and not on the order it happened in; that
+    is what lets a wave be regenerated from the game seed. record() keeps them current as
+    the team completes tasks. An index keeps drawing from the catalog it was built from, so
+    it must be rebuilt when the catalog is swapped.
+    """
+
+    def __init__(self, completed_tasks, catalog=None):
+        self.catalog = catalog or get_catalog()
+        families_by_difficulty = self.catalog.families
+        self.next_levels = {difficulty: {} for difficulty in families_by_difficulty}
+        self.pools = {difficulty: [] for difficulty in families_by_difficulty}
+
+        for difficulty, families in families_by_difficulty.items():
+            completed = {int(task_id): task_levels for task_id, task_levels in completed_tasks.get(difficulty, {}).items()}
+            for task_id in sorted(families):
+                level = next_level(completed[task_id]) if task_id in completed else 0
+                self.next_levels[difficulty][task_id] = level
+                if level < len(families[task_id]):
+                    self.pools[difficulty].append(task_id)
+
+    def _remove(self, difficulty, task_id):
+        # A family is used up a handful of times per wave, so an O(families) delete is fine
+        pool = self.pools[difficulty]
+        position = bisect.bisect_left(pool, task_id)
+        if position < len(pool) and pool[position] == task_id:
+            del pool[position]
+
+    def record(self, difficulty, task_id, level):
+        """Record that a level was completed."""
+        if difficulty not in self.next_levels:
+            return
+        task_id = int(task_id)
+        if level + 1 <= self.next_levels[difficulty].get(task_id, 0):
+            return
+        self.next_levels[difficulty][task_id] = level + 1
+        if level + 1 >= len(self.catalog.families[difficulty][task_id]):
+            self._remove(difficulty, task_id)
+
+    def available(self, difficulty, taken=0):
+        """Whether the difficulty still has a family left once `taken` of its families are already in use."""
+        return len(self.pools[difficulty]) > taken
+
+    def task(self, difficulty, task_id):
+        level = self.next_levels[difficulty][task_id]
+        task_info = self.catalog.families[difficulty][task_id][level]
+        return (difficulty, task_info["description"], task_info["points"], task_id, level)
+
+    def draw(self, difficulty, rng=random, exclude=()):
+        """A random available task of this difficulty whose (difficulty, task_id) isn't in exclude, or None."""
+        pool = self.pools[difficulty]
+        if not pool:
+            return None
+        # Rejection sampling is O(1) while few families are excluded; fall back to filtering the pool
+        for _ in range(4):
+            task_id = pool[rng.randrange(len(pool))]
+            if (difficulty, task_id) not in exclude:
+                return self.task(difficulty, task_id)
+        remaining = [task_id for task_id in pool if (difficulty, task_id) not in exclude]
+        if not remaining:
+            return None
+        return self.task(difficulty, rng.choice(remaining))
+
+
+class TaskIndexCache:
+    """TeamTaskIndex per team key, built on first use from the team's completed_tasks."""
+
+    def __init__(self):
+        self._indexes = {}
+
+    def get(self, team_key, completed_tasks):
+        index = self._indexes.get(team_key)
+        if index is None:
+            index = self._indexes[team_key] = TeamTaskIndex(completed_tasks)
+        return index
+
+    def invalidate(self, team_key=None):
+        if team_key is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(team_key, None)
+
+
+def select_task(index, difficulty, rng=random, exclude=(), weights=None):
+    """
+    Draw a task of the given difficulty. When that pool has run dry, fall back to the other
+    difficulties that still have tasks, picked by weight. Returns None once every pool is empty.
+    """
+    task = index.draw(difficulty, rng, exclude)
+    if task:
+        return task
+    weights = weights or get_task_weights(1)
+    fallbacks = [d for d in index.catalog.families if d != difficulty and index.available(d)]
+    while fallbacks:
+        fallback = rng.choices(fallbacks, weights=[weights.get(d, 1) or 1 for d in fallbacks])[0]
+        task = index.draw(fallback, rng, exclude)
+        if task:
+            return task
+        fallbacks.remove(fallback)
+    return None
+
+
+def team_rng(game_seed, team_key, wave):
+    """
+    The random stream for one team's wave. Streams are independent of each other and of the
+    order teams are generated in, so any team's wave can be regenerated from the game seed.
+    """
+    return random.Random(f"{game_seed}:{team_key}:{wave}")
+
+
+def generate_tasks(wave, index, rng=random):
+    """
+    Draw one wave of tasks. Difficulties are picked by the wave's weights from the pools that
+    still have an unused family, so this always terminates. A team that has nearly exhausted
+    the catalog gets fewer than TASKS_PER_WAVE tasks.
+    """
+    if wave % 10 == 0:
+        # Boss wave, only one task
+        return [rng.choice(index.catalog.boss_tasks)]
+
+    weights = get_task_weights(wave)
+    tasks = []
+    taken = set()  # (difficulty, task_id) already assigned this wave
+    taken_per_difficulty = dict.fromkeys(index.catalog.families, 0)
+
+    for _ in range(TASKS_PER_WAVE):
+        difficulties = [d for d in index.catalog.families if index.available(d, taken_per_difficulty[d])]
+        if not difficulties:
+            break
+        difficulty = rng.choices(difficulties, weights=[weights[d] for d in difficulties])[0]
+        task = index.draw(difficulty, rng, taken)
+        tasks.append(task)
+        taken.add((difficulty, task[3]))
+        taken_per_difficulty[difficulty] += 1
+
+    return tasks
+
+
+def tasks_required(tasks):
+    """Completions needed to clear a wave; fewer when the team has almost run out of tasks."""
+    return min(TASKS_TO_PROGRESS, len(tasks))
+
+
+def generate_wave(wave, completed_tasks, game_seed, indexes):
+    """
+    Draw one wave for every team in a single pass. `completed_tasks` maps each team key to
+    the team's completed_tasks; returns {team_key: tasks}.
+    """
+    return {
+        team_key: generate_tasks(wave, indexes.get(team_key, team_completed), team_rng(game_seed, team_key, wave))
+        for team_key, team_completed in completed_tasks.items()
+    }
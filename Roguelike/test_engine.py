@@ -0,0 +1,34 @@
+import dataclasses
+import os
+import unittest
+
+import snapshot
+from catalog import load_catalog
+from engine import GameEngine
+
+# A save written by the bot before it had a catalog file, engine or snapshot format
+BASELINE_SAVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata", "baseline_game_state.json")
+
+
+def migrated_engine():
+    data = snapshot.read(BASELINE_SAVE)
+    engine = GameEngine()
+    engine.load(data["game_state"], data)
+    return engine
+
+
+class CatalogConflictsTest(unittest.TestCase):
+    def test_migrated_save_fits_the_catalog_it_was_played_with(self):
+        self.assertEqual(migrated_engine().catalog_conflicts(load_catalog()), [])
+
+    def test_completed_level_missing_from_the_catalog(self):
+        catalog = load_catalog()
+        families = dict(catalog.families)
+        # Team1 has completed the first three levels of easy family 1
+        families["easy"] = {**families["easy"], 1: families["easy"][1][:2]}
+        conflicts = migrated_engine().catalog_conflicts(dataclasses.replace(catalog, families=families))
+        self.assertIn("Team1 has completed level 3 of easy family 1, the catalog only has 2", conflicts)
+
+
+if __name__ == "__main__":
+    unittest.main()
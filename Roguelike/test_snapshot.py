@@ -0,0 +1,60 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import snapshot
+from engine import GameEngine
+from storage import open_storage
+from tasks import level_count
+
+# A save written by the bot before it had a catalog file, engine or snapshot format
+BASELINE_SAVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata", "baseline_game_state.json")
+
+
+class BaselineUpgradeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        # Laid out as Bot.open_game_storage opens GUILD_ID's default game
+        shutil.copy(BASELINE_SAVE, os.path.join(self.directory, "game_state.json"))
+
+    def open(self, engine):
+        return open_storage("json", engine.snapshot, os.path.join(self.directory, "game_state.snap"),
+                            os.path.join(self.directory, "game_state.journal"), None, "default",
+                            legacy_file=os.path.join(self.directory, "game_state.json"))
+
+    def test_level_lists_fit_the_catalog(self):
+        state = snapshot.read(BASELINE_SAVE)["game_state"]
+        for team in state.values():
+            for difficulty, tasks in team["completed_tasks"].items():
+                for task_id, task_levels in tasks.items():
+                    self.assertEqual(len(task_levels), level_count(difficulty, task_id), (difficulty, task_id))
+
+    def test_completions_survive_the_upgrade(self):
+        with open(BASELINE_SAVE) as file:
+            legacy = json.load(file)["game_state"]
+        state = snapshot.read(BASELINE_SAVE)["game_state"]
+        for key, team in legacy.items():
+            for difficulty, tasks in team["completed_tasks"].items():
+                for task_id, task_levels in tasks.items():
+                    upgraded = state[key]["completed_tasks"][difficulty][int(task_id)]
+                    self.assertEqual([level for level in task_levels if level], [level for level in upgraded if level])
+
+    def test_matches_a_fresh_save(self):
+        engine = GameEngine()
+        storage = self.open(engine)
+        engine.load(*storage.load())
+        storage.checkpoint()
+        storage.journal.close()
+
+        reloaded = GameEngine()
+        reloaded.load(*self.open(reloaded).load())
+        self.assertEqual(reloaded.snapshot(), engine.snapshot())
+        self.assertTrue(reloaded.game_started)
+        self.assertEqual(reloaded.teams["Team2"].custom_name, "Wolves")
+
+
+if __name__ == "__main__":
+    unittest.main()
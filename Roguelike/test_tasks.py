@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from catalog import get_catalog
+from tasks import TeamTaskIndex, generate_tasks, team_rng
+
+
+def use_up(completed_tasks, index, difficulty, task_id):
+    """Complete every level of a family, as the team's completed_tasks and the index see it."""
+    levels = len(index.catalog.families[difficulty][task_id])
+    completed_tasks.setdefault(difficulty, {})[task_id] = ["member"] * levels
+    for level in range(levels):
+        index.record(difficulty, task_id, level)
+
+
+class TeamTaskIndexTest(unittest.TestCase):
+    def test_rebuilt_index_draws_the_same_wave(self):
+        families = get_catalog().families
+        # Use up some families in a shuffled order, so the live index has seen removals a fresh one hasn't
+        used_up = [(difficulty, task_id) for difficulty in families for task_id in list(families[difficulty])[::3]]
+        random.Random(1).shuffle(used_up)
+
+        completed_tasks = {}
+        live = TeamTaskIndex({})
+        for difficulty, task_id in used_up:
+            use_up(completed_tasks, live, difficulty, task_id)
+        rebuilt = TeamTaskIndex(completed_tasks)
+
+        self.assertEqual(live.pools, rebuilt.pools)
+        for wave in range(1, 10):
+            self.assertEqual(generate_tasks(wave, live, team_rng("seed", "Team1", wave)),
+                             generate_tasks(wave, rebuilt, team_rng("seed", "Team1", wave)))
+
+    def test_completion_order_does_not_change_the_wave(self):
+        families = get_catalog().families
+        used_up = [(difficulty, task_id) for difficulty in families for task_id in list(families[difficulty])[:4]]
+
+        indexes = []
+        for order in (used_up, used_up[::-1]):
+            index = TeamTaskIndex({})
+            for difficulty, task_id in order:
+                use_up({}, index, difficulty, task_id)
+            indexes.append(index)
+
+        self.assertEqual(generate_tasks(3, indexes[0], team_rng("seed", "Team2", 3)),
+                         generate_tasks(3, indexes[1], team_rng("seed", "Team2", 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()